@@ -0,0 +1,719 @@
+from yamal import Node_Manager, Node, Socket_Server, Shared_Ring_Buffer, Frame_Receiver, Bag_Writer, Bag_Reader, Image_Display, send_frame, decode_ndarray
+from yamal import SHARED, COPY, DEEP_COPY, BLOCK, JPEG, ENCODINGS, MSG_CLOSE, MSG_SUBSCRIBE, MSG_FLOAT, MSG_NDARRAY, SUBSCRIPTION_FORMAT, FLOAT_FORMAT
+import yamal
+import numpy as np
+import cv2
+import time, threading, multiprocessing, socket, subprocess, sys, os, tempfile, argparse, platform, json, gc
+
+
+def _noop(topic, message):
+    pass
+
+
+def bench_delivery_modes(n_publishes=200, subscriber_counts=(1, 2, 4, 8), shape=(1080, 1920, 3)):
+
+    frame = np.zeros(shape, dtype=np.uint8)
+
+    print(f'delivery mode benchmark, frame {shape}, {n_publishes} publishes')
+    print(f'{"mode":>14} ' + ' '.join(f'{f"{n} subs":>10}' for n in subscriber_counts) + '   (us per publish)')
+
+    for delivery in (COPY, DEEP_COPY, SHARED):
+        timings = []
+
+        for n_subscribers in subscriber_counts:
+            mgr = Node_Manager()
+            for i in range(n_subscribers):
+                Node(f'subscriber {i}', mgr).subscribe('frame', _noop)
+
+            t = time.perf_counter()
+            for _ in range(n_publishes):
+                mgr.publish('frame', frame, delivery=delivery)
+            timings.append((time.perf_counter() - t) / n_publishes * 1_000_000)
+
+        print(f'{delivery:>14} ' + ' '.join(f'{t:>10.1f}' for t in timings))
+
+
+def bench_concurrent_publishers(duration=1.0, publisher_counts=(1, 4, 16)):
+
+    print(f'concurrent publisher benchmark, {duration}s per run')
+    print(f'{"publishers":>10} {"publishes/s":>14}')
+
+    for n_publishers in publisher_counts:
+        mgr = Node_Manager()
+        publishers = [Node(f'publisher {i}', mgr) for i in range(n_publishers)]
+        for i in range(n_publishers):
+            Node(f'subscriber {i}', mgr).subscribe(f'topic {i}', _noop)
+
+        counts = [0] * n_publishers
+        start_event = threading.Event()
+        stop_event = threading.Event()
+
+        def run(index):
+            topic = f'topic {index}'
+            publisher = publishers[index]
+            count = 0
+            start_event.wait()
+            while not stop_event.is_set():
+                publisher.publish(topic, count)
+                count += 1
+            counts[index] = count
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(n_publishers)]
+        for thread in threads:
+            thread.start()
+
+        t = time.perf_counter()
+        start_event.set()
+        time.sleep(duration)
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - t
+
+        print(f'{n_publishers:>10} {sum(counts) / elapsed:>14.0f}')
+
+
+def _queue_reader(image_queue, results):
+    received = 0
+    while True:
+        image = image_queue.get()
+        if image is None:
+            break
+        received += 1
+    results.put(received)
+
+
+def _ring_reader(attach_args, condition, results):
+    shape, dtype, n_slots, name = attach_args
+    ring = Shared_Ring_Buffer(shape, dtype, n_slots, name=name, condition=condition)
+    received = 0
+    while not ring.closed:
+        with ring.view(timeout=0.1) as image:
+            if image is not None:
+                received += 1
+    results.put(received)
+    ring.close()
+
+
+def bench_frame_transport(n_frames=200, shapes={'720p': (720, 1280, 3), '4K': (2160, 3840, 3)}):
+
+    print(f'frame transport benchmark, {n_frames} frames')
+    print(f'{"resolution":>10} {"transport":>12} {"received fps":>13} {"dropped":>8}')
+
+    for resolution, shape in shapes.items():
+        frame = np.zeros(shape, dtype=np.uint8)
+        results = multiprocessing.Queue()
+
+        image_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_queue_reader, args=(image_queue, results))
+        process.start()
+
+        t = time.perf_counter()
+        for _ in range(n_frames):
+            image_queue.put(frame)
+        image_queue.put(None)
+        received = results.get()
+        process.join()
+        elapsed = time.perf_counter() - t
+
+        print(f'{resolution:>10} {"queue":>12} {received / elapsed:>13.1f} {n_frames - received:>8}')
+
+        ring = Shared_Ring_Buffer(shape, np.uint8, n_slots=4)
+        process = multiprocessing.Process(target=_ring_reader, args=(ring.attach_args(), ring.condition, results))
+        process.start()
+
+        t = time.perf_counter()
+        for _ in range(n_frames):
+            ring.write(frame)
+        ring.close()
+        received = results.get()
+        process.join()
+        elapsed = time.perf_counter() - t
+
+        print(f'{resolution:>10} {"shared ring":>12} {received / elapsed:>13.1f} {n_frames - received:>8}')
+
+
+def _subscribed_client(mgr, server, topic):
+    n_subscribers = len(mgr.subscriptions.get(topic, ()))
+    client_conn = socket.create_connection(server.address)
+    send_frame(client_conn, MSG_SUBSCRIBE, payload=SUBSCRIPTION_FORMAT.pack(0, 90) + topic.encode())
+    while len(mgr.subscriptions.get(topic, ())) == n_subscribers:
+        time.sleep(0.001)
+    return client_conn
+
+
+def bench_socket_framing(messages={'float': (1.5, 200_000), 'string 32B': ('x' * 32, 200_000), 'bytes 4MB': (bytes(4 << 20), 200)}):
+
+    print('socket framing benchmark, loopback server')
+    print(f'{"message":>12} {"messages/s":>12} {"MB/s":>10}')
+
+    for label, (message, n_messages) in messages.items():
+        mgr = Node_Manager()
+        server = Socket_Server(mgr, '127.0.0.1', 0, overflow_policy=BLOCK)
+        server_thread = threading.Thread(target=server.run)
+        server_thread.start()
+
+        client_conn = _subscribed_client(mgr, server, 'topic')
+        receiver = Frame_Receiver(client_conn)
+
+        def send():
+            for _ in range(n_messages):
+                mgr.publish('topic', message)
+
+        thread = threading.Thread(target=send)
+
+        t = time.perf_counter()
+        thread.start()
+        n_bytes = 0
+        for _ in range(n_messages + 1):
+            msg_type, topic_id, payload = receiver.receive()
+            n_bytes += len(payload)
+        elapsed = time.perf_counter() - t
+        thread.join()
+
+        print(f'{label:>12} {n_messages / elapsed:>12.0f} {n_bytes / elapsed / 1e6:>10.1f}')
+
+        server.close()
+        server_thread.join()
+        client_conn.close()
+
+
+def _drain(client_conn):
+    receiver = Frame_Receiver(client_conn)
+    try:
+        while receiver.receive()[0] != MSG_CLOSE:
+            pass
+    except (ConnectionError, OSError):
+        pass
+
+
+def bench_socket_fan_out(n_publishes=30, client_counts=(1, 10, 50), shape=(720, 1280, 3), quality=80):
+
+    frame = np.random.default_rng(0).integers(0, 255, shape, dtype=np.uint8)
+
+    print(f'socket fan-out benchmark, jpeg {shape} frames, {n_publishes} publishes')
+    print(f'{"clients":>8} {"ms/publish, per connection":>28} {"ms/publish, shared":>20}')
+
+    for n_clients in client_counts:
+        mgr = Node_Manager()
+        server = Socket_Server(mgr, '127.0.0.1', 0, overflow_policy=BLOCK)
+        server_thread = threading.Thread(target=server.run)
+        server_thread.start()
+
+        clients = []
+        for _ in range(n_clients):
+            client_conn = socket.create_connection(server.address)
+            send_frame(client_conn, MSG_SUBSCRIBE, payload=SUBSCRIPTION_FORMAT.pack(ENCODINGS.index(JPEG), quality) + b'frame')
+            threading.Thread(target=_drain, args=(client_conn,), daemon=True).start()
+            clients.append(client_conn)
+
+        while len(server.connections) < n_clients or sum(len(n) for n in server.relays.get('frame', {}).values()) < n_clients:
+            time.sleep(0.001)
+
+        # what every connection subscribing on its own used to cost
+        t = time.perf_counter()
+        for _ in range(n_publishes):
+            for node in list(server.connections):
+                node.send_message('frame', frame)
+        per_connection = (time.perf_counter() - t) / n_publishes * 1000
+
+        t = time.perf_counter()
+        for _ in range(n_publishes):
+            mgr.publish('frame', frame, delivery=SHARED)
+        shared = (time.perf_counter() - t) / n_publishes * 1000
+
+        print(f'{n_clients:>8} {per_connection:>28.2f} {shared:>20.2f}')
+
+        server.close()
+        server_thread.join()
+        for client_conn in clients:
+            client_conn.close()
+
+
+def bench_batched_delivery(n_messages=200_000, batch_sizes=(1, 16, 256)):
+
+    print(f'batched delivery benchmark, {n_messages} floats on one topic')
+    print(f'{"batch size":>12} {"messages/s":>12}')
+
+    for batch_size in (None,) + batch_sizes:
+        mgr = Node_Manager()
+        subscriber = Node('subscriber', mgr)
+
+        received = [0]
+        done = threading.Event()
+
+        def callback(topic, message):
+            received[0] += 1
+            if received[0] == n_messages:
+                done.set()
+
+        def batch_callback(topic, messages):
+            received[0] += len(messages)
+            if received[0] == n_messages:
+                done.set()
+
+        if batch_size is None:
+            subscriber.subscribe('ping', callback, asynchronous=True, queue_size=1024, overflow_policy=BLOCK)
+        else:
+            subscriber.subscribe('ping', batch_callback, batch_size=batch_size, batch_timeout=0.001, queue_size=1024, overflow_policy=BLOCK)
+
+        t = time.perf_counter()
+        for i in range(n_messages):
+            mgr.publish('ping', float(i))
+        done.wait()
+        elapsed = time.perf_counter() - t
+
+        mgr.close_all_nodes()
+        print(f'{"per message" if batch_size is None else batch_size:>12} {n_messages / elapsed:>12.0f}')
+
+
+def _blur(topic, frame):
+    return cv2.GaussianBlur(frame, (31, 31), 0)
+
+
+def bench_worker_pool(n_frames=200, shape=(720, 1280, 3), workers=(1, 2, 4)):
+
+    frame = np.random.default_rng(0).integers(0, 255, shape, dtype=np.uint8)
+
+    print(f'worker pool benchmark, {n_frames} gaussian blurs of {shape[1]}x{shape[0]} frames, results in frame order')
+    print(f'{"workers":>8} {"frames/s":>10} {"max reorder":>12}')
+
+    for n in workers:
+        mgr = Node_Manager()
+        subscriber = Node('subscriber', mgr)
+
+        received = [0]
+        done = threading.Event()
+
+        def result_callback(topic, result):
+            received[0] += 1
+            if received[0] == n_frames:
+                done.set()
+
+        subscriber.subscribe('frame', _blur, workers=n, queue_size=2 * n, overflow_policy=BLOCK, result_callback=result_callback)
+
+        t = time.perf_counter()
+        for _ in range(n_frames):
+            mgr.publish('frame', frame, delivery=SHARED)
+        done.wait()
+        elapsed = time.perf_counter() - t
+
+        stats = mgr.subscriptions['frame'][0].stats()
+        mgr.close_all_nodes()
+        print(f'{n:>8} {n_frames / elapsed:>10.1f} {stats["max reorder depth"]:>12}')
+
+
+def bench_bag_replay(n_frames=300, shape=(720, 1280, 3)):
+
+    path = os.path.join(tempfile.mkdtemp(), 'benchmark.bag')
+    frame = np.random.default_rng(0).integers(0, 255, shape, dtype=np.uint8)
+
+    t = time.perf_counter()
+    bag = Bag_Writer(path)
+    for i in range(n_frames):
+        bag.write('webcam_frame', frame, timestamp=i / 30)
+    bag.close()
+    write_time = time.perf_counter() - t
+
+    mgr = Node_Manager()
+    mgr.topics['webcam_frame'] = {'delivery': SHARED}
+    checksum = []
+    Node('subscriber', mgr).subscribe('webcam_frame', lambda topic, message: checksum.append(message[0, 0, 0]))
+
+    t = time.perf_counter()
+    bag = Bag_Reader(path)
+    for timestamp, topic, message in bag.messages():
+        mgr.publish(topic, message)
+    replay_time = time.perf_counter() - t
+    bag.close()
+
+    size = os.path.getsize(path) / 1e6
+    os.remove(path)
+
+    print(f'bag benchmark, {n_frames} frames of {shape}, {size:.0f} MB')
+    print(f'{"record":>8} {n_frames / write_time:>8.0f} fps {size / write_time:>8.0f} MB/s')
+    print(f'{"replay":>8} {n_frames / replay_time:>8.0f} fps {size / replay_time:>8.0f} MB/s (as fast as possible, shared delivery)')
+
+
+def _rss(pid):
+    # resident memory in MB, linux only
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+def bench_startup(cfg='examples/configs/ping.yaml', n_runs=5):
+
+    print(f'startup benchmark, {cfg} headless, {n_runs} runs')
+    print(f'{"":>20} {"seconds":>8} {"rss MB":>8}')
+
+    timings = []
+    rss = []
+    for _ in range(n_runs):
+        t = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-u', 'yamal.py', '--cfg', cfg, '--cli', 'False', '--verbose', '1'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+        # every node has started once the last 'started' line shows up
+        n_nodes = 2
+        for line in process.stdout:
+            if line.strip().endswith('started'):
+                n_nodes -= 1
+                if n_nodes == 0:
+                    break
+
+        timings.append(time.perf_counter() - t)
+        rss.append(_rss(process.pid))
+        process.kill()
+        process.wait()
+
+    print(f'{"until nodes started":>20} {min(timings):>8.3f} {rss[-1] if rss[-1] is not None else float("nan"):>8.1f}')
+
+    t = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import yamal'], check=True)
+    print(f'{"import yamal":>20} {time.perf_counter() - t:>8.3f}')
+
+
+# headless sweep, every case reports throughput and latency percentiles so runs can be compared as JSON
+
+IN_PROCESS = 'in-process'
+SOCKET = 'socket'
+
+SWEEP = {'sizes': (8, 1024, 65536, 1 << 20), 'subscribers': (1, 4, 16), 'publishers': (1, 4), 'transports': (IN_PROCESS, SOCKET),
+         'display shapes': ((480, 640, 3), (720, 1280, 3), (1080, 1920, 3))}
+QUICK_SWEEP = {'sizes': (8, 65536), 'subscribers': (1, 4), 'publishers': (1, 2), 'transports': (IN_PROCESS, SOCKET),
+               'display shapes': ((480, 640, 3),)}
+
+# the parameters that identify a case, everything else in a result is a measurement
+CASE_KEYS = ('benchmark', 'transport', 'size', 'subscribers', 'publishers', 'shape')
+
+
+def _latency(latencies):
+    latencies = np.asarray(latencies, dtype=np.float64)
+    if len(latencies) == 0:
+        return None
+    return {'p50': float(np.percentile(latencies, 50)), 'p90': float(np.percentile(latencies, 90)),
+            'p99': float(np.percentile(latencies, 99)), 'max': float(latencies.max())}
+
+
+def _stamper(size):
+    # messages of size bytes carrying the time they were published, 8 bytes is a bare float
+    if size <= 8:
+        return time.perf_counter
+
+    message = np.zeros(size // 8, dtype=np.float64)
+
+    def stamp():
+        message[0] = time.perf_counter()
+        return message
+
+    return stamp
+
+
+def _stamp_of(message):
+    return message if isinstance(message, float) else float(message[0])
+
+
+def _n_messages(size, n_subscribers, n_publishers, quick):
+    # roughly the same amount of delivered data per case, but never too few messages for percentiles
+    budget, cap = (8 << 20, 5000) if quick else (32 << 20, 20000)
+    return max(100, min(cap, budget // (max(size, 1024) * n_subscribers))) // n_publishers
+
+
+def _run_publishers(mgr, n_publishers, n_messages, size, window=None):
+    # with a window, a publisher waits for a free slot, one is freed whenever a message reached every subscriber
+    start = threading.Barrier(n_publishers + 1)
+
+    def run():
+        stamp = _stamper(size)
+        start.wait()
+        for _ in range(n_messages):
+            if window is not None:
+                window.acquire()
+            mgr.publish('bench', stamp())
+
+    threads = [threading.Thread(target=run) for _ in range(n_publishers)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    return threads
+
+
+def _bench_in_process(size, n_subscribers, n_publishers, n_messages, paced=False):
+    # delivery is synchronous, a message has reached every subscriber once publish returns, so it never needs pacing
+    mgr = Node_Manager({'verbose': 0})
+    latencies = []
+
+    def callback(topic, message):
+        latencies.append(time.perf_counter() - _stamp_of(message))
+
+    for i in range(n_subscribers):
+        Node(f'subscriber {i}', mgr).subscribe('bench', callback)
+
+    t = time.perf_counter()
+    for thread in _run_publishers(mgr, n_publishers, n_messages, size):
+        thread.join()
+    elapsed = time.perf_counter() - t
+
+    mgr.close_all_nodes()
+    return latencies, elapsed
+
+
+def _socket_reader(conn, expected, latencies, delivered, done):
+    receiver = Frame_Receiver(conn)
+    received = 0
+    try:
+        while received < expected:
+            msg_type, topic_id, payload = receiver.receive()
+            if msg_type == MSG_FLOAT:
+                stamp = FLOAT_FORMAT.unpack(payload)[0]
+            elif msg_type == MSG_NDARRAY:
+                stamp = float(decode_ndarray(payload)[0])
+            else:
+                continue
+            latencies.append(time.perf_counter() - stamp)
+            delivered()
+            received += 1
+    except (ConnectionError, OSError):
+        pass
+    done.release()
+
+
+def _bench_socket(size, n_subscribers, n_publishers, n_messages, paced=False):
+    # saturated, messages queue up in the connection buffers, which is what throughput is measured on,
+    # paced, every publisher has about one message in flight, which is what latency is measured on
+    mgr = Node_Manager({'verbose': 0})
+    server = Socket_Server(mgr, '127.0.0.1', 0, overflow_policy=BLOCK)
+    server_thread = threading.Thread(target=server.run)
+    server_thread.start()
+
+    clients = []
+    for _ in range(n_subscribers):
+        client_conn = socket.create_connection(server.address)
+        send_frame(client_conn, MSG_SUBSCRIBE, payload=SUBSCRIPTION_FORMAT.pack(0, 90) + b'bench')
+        clients.append(client_conn)
+
+    while sum(len(nodes) for nodes in server.relays.get('bench', {}).values()) < n_subscribers:
+        time.sleep(0.001)
+
+    latencies = []
+    done = threading.Semaphore(0)
+    window = threading.Semaphore(n_publishers) if paced else None
+    count = [0]
+    count_lock = threading.Lock()
+
+    def delivered():
+        if window is not None:
+            with count_lock:
+                count[0] += 1
+                if count[0] % n_subscribers == 0:
+                    window.release()
+
+    for client_conn in clients:
+        threading.Thread(target=_socket_reader, args=(client_conn, n_publishers * n_messages, latencies, delivered, done), daemon=True).start()
+
+    t = time.perf_counter()
+    for thread in _run_publishers(mgr, n_publishers, n_messages, size, window):
+        thread.join()
+    for _ in clients:
+        done.acquire()
+    elapsed = time.perf_counter() - t
+
+    server.close()
+    server_thread.join()
+    for client_conn in clients:
+        client_conn.close()
+    return latencies, elapsed
+
+
+def _headless_display_process(*args):
+    # the display process with the gui functions patched, it renders into nothing
+    for name in ('imshow', 'waitKey', 'setWindowTitle', 'destroyWindow', 'destroyAllWindows'):
+        setattr(cv2, name, lambda *args: None)
+    yamal._run_display_process(*args)
+
+
+def _bench_display(shape, n_frames):
+    frame = np.random.default_rng(0).integers(0, 255, shape, dtype=np.uint8)
+    yamal._display_server = yamal._Display_Server(_headless_display_process)
+    display = Image_Display('benchmark')
+
+    # the display process takes a while to start, only frames it is ready for are timed
+    deadline = time.monotonic() + 30
+    while not (display.stats() or {}).get('rendered') and time.monotonic() < deadline:
+        display.display(frame)
+        time.sleep(0.01)
+    warm_up = display.stats() or {}
+
+    latencies = []
+    t = time.perf_counter()
+    for _ in range(n_frames):
+        t_display = time.perf_counter()
+        display.display(frame)
+        latencies.append(time.perf_counter() - t_display)
+    elapsed = time.perf_counter() - t
+
+    server = display.server
+    display.close()
+    stats = dict(server.window_stats.get('benchmark', {}))
+    for key in ('rendered', 'dropped'):
+        stats[key] = stats.get(key, 0) - warm_up.get(key, 0)
+    return latencies, elapsed, stats
+
+
+def _median_run(runs, latency_runs=None):
+    # runs are (latencies, elapsed, published), the median over the runs evens out the odd slow one
+    throughputs = [len(latencies) / elapsed for latencies, elapsed, _ in runs]
+    percentiles = [_latency(latencies) for latencies, _, _ in (latency_runs or runs)]
+    return {
+        'runs': len(runs),
+        'messages': len(runs[0][0]),
+        'throughput': float(np.median(throughputs)),
+        'publishes per second': float(np.median([published / elapsed for _, elapsed, published in runs])),
+        'latency': {key: float(np.median([p[key] for p in percentiles])) for key in percentiles[0]},
+    }
+
+
+def run_suite(sweep=SWEEP, quick=False, repeats=None):
+
+    repeats = repeats or 3
+    results = []
+
+    def record(case, runs, latency_runs=None, **extra):
+        result = dict(case, **_median_run(runs, latency_runs), **extra)
+        results.append(result)
+        latency = result['latency']
+        print(f'{case["benchmark"]:>8} {case.get("transport", ""):>10} {case.get("size", str(case.get("shape", ""))):>14} '
+              f'{case.get("subscribers", ""):>5} {case.get("publishers", ""):>5} {result["throughput"]:>12.0f} '
+              f'{latency["p50"] * 1e6:>10.1f} {latency["p99"] * 1e6:>10.1f}')
+
+    print(f'{"":>8} {"transport":>10} {"size":>14} {"subs":>5} {"pubs":>5} {"messages/s":>12} {"p50 us":>10} {"p99 us":>10}')
+
+    for transport in sweep['transports']:
+        for size in sweep['sizes']:
+            for n_subscribers in sweep['subscribers']:
+                for n_publishers in sweep['publishers']:
+                    n_messages = _n_messages(size, n_subscribers, n_publishers, quick)
+                    bench = _bench_in_process if transport == IN_PROCESS else _bench_socket
+
+                    def measure(paced):
+                        # without the garbage collector kicking in
+                        gc.collect()
+                        gc.disable()
+                        try:
+                            return bench(size, n_subscribers, n_publishers, n_messages, paced) + (n_publishers * n_messages,)
+                        finally:
+                            gc.enable()
+
+                    bench(size, n_subscribers, n_publishers, max(1, n_messages // 10))
+                    runs = [measure(False) for _ in range(repeats)]
+                    latency_runs = [measure(True) for _ in range(repeats)] if transport == SOCKET else None
+
+                    record({'benchmark': 'publish', 'transport': transport, 'size': size, 'subscribers': n_subscribers, 'publishers': n_publishers}, runs, latency_runs)
+
+    for shape in sweep['display shapes']:
+        n_frames = 100 if quick else 500
+        runs, rendered, dropped = [], 0, 0
+        for _ in range(repeats):
+            latencies, elapsed, stats = _bench_display(shape, n_frames)
+            runs.append((latencies, elapsed, n_frames))
+            rendered += stats.get('rendered', 0)
+            dropped += stats.get('dropped', 0)
+        record({'benchmark': 'display', 'shape': list(shape)}, runs, rendered=rendered, dropped=dropped)
+
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def suite_report(results, quick=False):
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def _case(result):
+    return tuple((key, json.dumps(result.get(key))) for key in CASE_KEYS)
+
+
+def compare(report, baseline, tolerance=0.25, min_latency_change=5e-6):
+    # a case regresses when its throughput drops or its median latency grows by more than tolerance,
+    # latency also has to grow by min_latency_change seconds, below that it is timer noise
+    baseline_results = {_case(result): result for result in baseline['results']}
+    regressions = []
+
+    print(f'compared against {baseline["meta"].get("commit")} from {baseline["meta"].get("time")}, tolerance {tolerance:.0%}')
+
+    for result in report['results']:
+        base = baseline_results.get(_case(result))
+        if base is None:
+            continue
+
+        throughput = result['throughput'] / base['throughput'] - 1
+        latency = result['latency']['p50'] / base['latency']['p50'] - 1
+        slower = result['latency']['p50'] - base['latency']['p50'] > min_latency_change
+        label = ', '.join(f'{key}: {result[key]}' for key in CASE_KEYS if key in result)
+
+        if throughput < -tolerance or (latency > tolerance and slower):
+            regressions.append({'case': label, 'throughput change': throughput, 'p50 change': latency})
+            print(f'REGRESSION {label}: throughput {throughput:+.0%}, p50 latency {latency:+.0%}')
+
+    if len(regressions) == 0:
+        print('no regressions')
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmark YAMAL', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--suite', action='store_true', help='run the headless sweep instead of the individual benchmarks')
+    parser.add_argument('--quick', action='store_true', help='a smaller sweep with fewer messages per case')
+    parser.add_argument('--json', type=str, default=None, help='write the sweep results to this file, implies --suite')
+    parser.add_argument('--baseline', type=str, default=None, help='compare the sweep to results written earlier with --json, implies --suite')
+    parser.add_argument('--repeats', type=int, default=None, help='measured runs per case, the median is reported')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative change in throughput or median latency flagged as a regression')
+    parser.add_argument('--min-latency-change', type=float, default=5e-6, help='seconds the median latency has to grow by to be flagged')
+    args = parser.parse_args()
+
+    if args.suite or args.quick or args.json or args.baseline:
+        report = suite_report(run_suite(QUICK_SWEEP if args.quick else SWEEP, args.quick, args.repeats), args.quick)
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            if compare(report, baseline, args.tolerance, args.min_latency_change):
+                sys.exit(1)
+
+        sys.exit(0)
+
+    bench_delivery_modes()
+    bench_concurrent_publishers()
+    bench_frame_transport()
+    bench_socket_framing()
+    bench_socket_fan_out()
+    bench_batched_delivery()
+    bench_worker_pool()
+    bench_bag_replay()
+    bench_startup()
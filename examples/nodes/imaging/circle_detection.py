@@ -1,4 +1,4 @@
-from yamal import Node
+from yamal import Node, writable, get_arg
 import cv2
 import numpy as np
 
@@ -9,7 +9,12 @@ class Circle_detection(Node):
         super().__init__(name, mgr, args)
 
     def run(self):
-        self.subscribe(self.args['frame subscription'], self.detect_circle)
+        # HoughCircles releases the GIL, so frames are spread over worker threads and published again in frame order
+        self.subscribe(self.args['frame subscription'], self.detect_circle, workers=get_arg(self.args, 'workers', 4),
+                       queue_size=get_arg(self.args, 'queue size', 8), result_callback=self.publish_circles)
+
+        # the same detection on demand, call('detect_circles', image) returns the image with the circles drawn in
+        self.provide_service('detect_circles', self.detect_circle, workers=get_arg(self.args, 'workers', 4))
     
     def detect_circle(self, topic, image):
         
@@ -21,7 +26,10 @@ class Circle_detection(Node):
                                 param1=100, param2=30,
                                 minRadius=1, maxRadius=30)
         
-        self.publish('circle_detection_frame', self.draw_circles(image, circles))
+        return self.draw_circles(writable(image), circles)
+
+    def publish_circles(self, topic, image):
+        self.publish('circle_detection_frame', image)
     
     def draw_circles(self, image, circles):
 
@@ -3,6 +3,9 @@ from yamal import Node, Image_Display
 
 class Display_frame(Node):
 
+    # the first image display of a process starts the display process
+    starts_processes = True
+
     def __init__(self, name, mgr, args=None):
         super().__init__(name, mgr, args)
 
@@ -1,5 +1,4 @@
 from yamal import Node
-import time
 import cv2
 
 
@@ -31,14 +30,13 @@ class Webcam(Node):
 
         self.vid = cv2.VideoCapture(0)
 
-        while not self._close_event.is_set():
+        self.loop(while_loop_condition=True, rate=self.args['fps'])
 
-            t = time.time()
-
-            frame = self.get_frame()
+    def loop_event(self, item):
+        frame = self.get_frame()
+        # a failed read returns None, which does not fit the frame schema
+        if frame is not None:
             self.publish('webcam_frame', frame)
-
-            time.sleep(max(0, (1/self.args['fps']) - (time.time() - t) ))
     
     def get_frame(self):
         ret, frame = self.vid.read()
@@ -5,11 +5,10 @@ import time
 class Ping_Pub(Node):
 
     def run(self):
-        self.loop(for_loop_count=get_arg(self.args, 'number of pings', 10))
+        self.loop(for_loop_count=get_arg(self.args, 'number of pings', 10), period=get_arg(self.args, 'delay', 1))
 
     def loop_event(self, item):
         self.publish(get_arg(self.args, 'topic', 'ping'), time.time())
-        time.sleep(get_arg(self.args, 'delay', 1))
 
 
 class Ping_Sub(Node):
@@ -23,14 +22,16 @@ class Ping_Sub(Node):
 
     def callback_function(self, topic, message):
         ping = round((time.time() - message) * 1_000_000)
-        print(f'received ping {ping}ns')
+        self.logger.info('received ping %dus', ping)
         self.pings.append(ping)
     
     def before_close(self):
-        print('---')
-        print(f'average ping: {round(sum(self.pings) / len(self.pings), 2)}ns')
-        print(f'max ping: {round(max(self.pings), 2)}ns')
-        print(f'min ping: {round(min(self.pings), 2)}ns')
-        print('---')
+        # verbose 0 shows the summary at every level, log only joins its arguments for enabled levels
+        if self.pings:
+            self.log('---', verbose=0)
+            self.log('average ping (us):', round(sum(self.pings) / len(self.pings), 2), verbose=0)
+            self.log('max ping (us):', max(self.pings), verbose=0)
+            self.log('min ping (us):', min(self.pings), verbose=0)
+            self.log('---', verbose=0)
         
         return super().before_close()
@@ -0,0 +1,77 @@
+from yamal import Node, Bag_Writer, Bag_Reader, get_arg
+import queue
+import time
+
+
+class Recorder(Node):
+
+    def __init__(self, name, mgr, args=None):
+        super().__init__(name, mgr, args)
+
+        self.bag = Bag_Writer(self.args['path'])
+        self.queue = queue.Queue(get_arg(self.args, 'queue size', 100))
+
+    def run(self):
+        for topic in self.args['topics']:
+            self.subscribe(topic, self.record)
+
+        # messages are timestamped when published and written on this thread, a full queue blocks the publisher
+        duration = get_arg(self.args, 'duration')
+        end = None if duration is None else time.monotonic() + duration
+
+        while True:
+            try:
+                item = self.queue.get(timeout=None if end is None else max(0, end - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                break
+            self.bag.write(*item)
+
+        for topic in self.args['topics']:
+            self.unsubscribe(topic)
+
+        while not self.queue.empty():
+            item = self.queue.get()
+            if item is not None:
+                self.bag.write(*item)
+
+        self.bag.close()
+        self.log(f'recorded {len(self.bag.index)} messages to {self.args["path"]}', verbose=1)
+
+    def record(self, topic, message):
+        self.queue.put((topic, message, time.time()))
+
+    def before_close(self):
+        self.queue.put(None)
+        return super().before_close()
+
+
+class Replayer(Node):
+
+    def run(self):
+
+        # speed 1 replays at the original timing, 2 twice as fast, 0 as fast as possible
+        speed = get_arg(self.args, 'speed', 1)
+        bag = Bag_Reader(self.args['path'])
+
+        start = time.monotonic()
+        first = None
+
+        for timestamp, topic, message in bag.messages(topics=get_arg(self.args, 'topics')):
+
+            if first is None:
+                first = timestamp
+
+            if speed:
+                wait = (timestamp - first) / speed - (time.monotonic() - start)
+                if wait > 0 and self._close_event.wait(wait):
+                    break
+
+            if self._close_event.is_set():
+                break
+
+            self.publish(topic, message)
+
+        self.log(f'replayed {self.args["path"]} in {time.monotonic() - start:.2f}s', verbose=1)
+        bag.close()
@@ -1,5 +1,9 @@
-from yamal import Node_Manager, Node
-import time, pytest
+from yamal import Node_Manager, Client_Manager, Node, Socket_Server, Shared_Ring_Buffer, Frame_Receiver, send_frame, writable
+from yamal import DROP_NEWEST, SHARED, COPY, RAW, JPEG, MSG_CLOSE, MSG_TOPIC, MSG_SUBSCRIBE, MSG_INT, MSG_FLOAT, MSG_BYTES
+from yamal import INT_FORMAT, FLOAT_FORMAT, SUBSCRIPTION_FORMAT
+import numpy as np
+import yamal
+import time, threading, socket, subprocess, sys, os, pytest
 
 
 class Publisher(Node):
@@ -28,6 +32,59 @@ class Subscriber(Node):
         pytest.timings.append(ping)
 
 
+class Echo(Node):
+
+    def run(self):
+        self.failed = False
+        self.subscribe('ping', self.echo)
+
+    def echo(self, topic, message):
+        if self.args and self.args.get('fail first') and not self.failed:
+            self.failed = True
+            raise RuntimeError('first ping')
+        self.publish('pong', message)
+
+
+class Collector(Node):
+
+    def run(self):
+        pytest.collected = []
+        self.subscribe('pong', lambda topic, message: pytest.collected.append(message))
+
+
+class Slow_Init(Node):
+
+    instances = []
+
+    def __init__(self, name, mgr, args):
+        super().__init__(name, mgr, args)
+        time.sleep(0.3)
+        Slow_Init.instances.append(name)
+
+    def run(self):
+        pass
+
+
+class Forking_Init(Node):
+
+    starts_processes = True
+    threads = []
+
+    def __init__(self, name, mgr, args):
+        super().__init__(name, mgr, args)
+        Forking_Init.threads.append(threading.current_thread())
+
+    def run(self):
+        pass
+
+
+class Doubler(Node):
+
+    def run(self):
+        self.provide_service('double', lambda name, request: 2 * request)
+        self.publish('greeting', self.call('greet', 'process', timeout=2).result())
+
+
 def test_publish_subscribe():
 
     pytest.timings = []
@@ -53,4 +110,1122 @@ def test_publish_subscribe():
     print(max(pytest.timings))
 
     assert len(pytest.timings) == n_pings
-    assert max(pytest.timings) < 0.001
\ No newline at end of file
+    assert max(pytest.timings) < 0.001
+
+def test_async_subscription_overflow():
+
+    mgr = Node_Manager()
+    subscriber = Node('slow subscriber', mgr)
+
+    started = threading.Event()
+    release = threading.Event()
+    received = []
+
+    def slow_callback(topic, message):
+        started.set()
+        release.wait()
+        received.append(message)
+
+    subscriber.subscribe('numbers', slow_callback, asynchronous=True, queue_size=2, overflow_policy=DROP_NEWEST)
+
+    mgr.publish('numbers', 0)
+    started.wait()
+
+    t = time.time()
+    for i in range(1, 10):
+        mgr.publish('numbers', i)
+    publish_time = time.time() - t
+
+    subscription = mgr.subscriptions['numbers'][0]
+
+    release.set()
+    time.sleep(0.1)
+
+    mgr.close_all_nodes()
+
+    assert publish_time < 0.01
+    assert received == [0, 1, 2]
+    assert subscription.dropped == 7
+
+
+def test_batched_subscription():
+
+    mgr = Node_Manager()
+    subscriber = Node('batch subscriber', mgr)
+
+    batches = []
+    subscriber.subscribe('numbers', lambda topic, messages: batches.append(messages), batch_size=4, batch_timeout=0.2)
+    subscriber.subscribe('frames', lambda topic, messages: batches.append(messages), batch_timeout=0.1, stack=True)
+
+    t = time.time()
+    for i in range(10):
+        mgr.publish('numbers', i)
+    assert wait_for(lambda: len(batches) == 3)
+    batch_time = time.time() - t
+
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert 0.15 < batch_time < 1
+
+    for i in range(3):
+        mgr.publish('frames', np.full((2, 2), i, dtype=np.uint8))
+    assert wait_for(lambda: len(batches) == 4)
+
+    assert batches[3].shape == (3, 2, 2) and batches[3][2, 0, 0] == 2
+
+    # arrays that do not stack come as a list, the subscription keeps delivering
+    mgr.publish('frames', np.zeros((2, 2), dtype=np.uint8))
+    mgr.publish('frames', np.zeros((3, 3), dtype=np.uint8))
+    assert wait_for(lambda: len(batches) == 5)
+    assert isinstance(batches[4], list) and [frame.shape for frame in batches[4]] == [(2, 2), (3, 3)]
+    assert mgr.subscriptions['numbers'][0].stats()['batches'] == 3
+
+    # a burst within the timeout is a single batch, nothing is dropped
+    bursts = []
+    subscriber.subscribe('burst', lambda topic, messages: bursts.append(messages), batch_timeout=0.2)
+    for i in range(100):
+        mgr.publish('burst', i)
+    assert wait_for(lambda: len(bursts) == 1)
+    assert bursts == [list(range(100))] and mgr.subscriptions['burst'][0].dropped == 0
+
+    # a pattern subscription is handed each concrete topic with its own messages
+    by_topic = []
+    subscriber.subscribe('ping/*', lambda topic, messages: by_topic.append((topic, messages)), batch_timeout=0.1)
+    for topic, i in (('ping/a', 1), ('ping/b', 2), ('ping/a', 3)):
+        mgr.publish(topic, i)
+    assert wait_for(lambda: len(by_topic) == 2)
+    assert by_topic == [('ping/a', [1, 3]), ('ping/b', [2])]
+
+    mgr.close_all_nodes()
+
+
+def square(topic, message):
+    time.sleep(0.01 * (message % 3))
+    return message * message
+
+
+def test_worker_pool_subscription():
+
+    mgr = Node_Manager()
+    subscriber = Node('pool subscriber', mgr)
+
+    results = []
+    subscriber.subscribe('numbers', square, workers=4, queue_size=20, overflow_policy=yamal.BLOCK, result_callback=lambda topic, result: results.append(result))
+
+    for i in range(20):
+        mgr.publish('numbers', i)
+    assert wait_for(lambda: len(results) == 20)
+
+    # workers finish out of order, results come out in the order the messages went in
+    assert results == [i * i for i in range(20)]
+
+    stats = mgr.subscriptions['numbers'][0].stats()
+    assert stats['duration']['count'] == 20 and stats['in flight'] == 0 and stats['reorder depth'] == 0
+    assert stats['max reorder depth'] > 0 and stats['processed rate'] > 0
+
+    processed = []
+    subscriber.subscribe('squares', square, workers=2, worker_type=yamal.PROCESSES, result_callback=lambda topic, result: processed.append(result))
+    for i in range(5):
+        mgr.publish('squares', i)
+    assert wait_for(lambda: len(processed) == 5, timeout=10)
+    assert processed == [0, 1, 4, 9, 16]
+
+    # process workers get the callback pickled, lambdas and methods of nodes are refused when subscribing
+    for callback in (lambda topic, message: message, subscriber.loop_event):
+        with pytest.raises(TypeError):
+            subscriber.subscribe('refused', callback, workers=2, worker_type=yamal.PROCESSES)
+    assert 'refused' not in mgr.subscriptions
+
+    mgr.close_all_nodes()
+
+
+def test_conflating_topic():
+
+    mgr = Node_Manager()
+    mgr.topics['frame'] = {'conflate': True}
+    subscriber = Node('slow subscriber', mgr)
+
+    started = threading.Event()
+    release = threading.Event()
+    received = []
+
+    def slow_callback(topic, message):
+        started.set()
+        release.wait()
+        received.append(message)
+
+    subscriber.subscribe('frame', slow_callback)
+
+    mgr.publish('frame', 0)
+    started.wait()
+    for i in range(1, 10):
+        mgr.publish('frame', i)
+
+    subscription = mgr.subscriptions['frame'][0]
+    assert len(subscription.queue) == 1
+
+    release.set()
+    assert wait_for(lambda: len(received) == 2)
+
+    mgr.close_all_nodes()
+
+    assert received == [0, 9]
+    assert subscription.dropped == 8
+
+
+class Ticker(Node):
+
+    def run(self):
+        self.tick_times = []
+        self.tick_threads = set()
+        self.loop(for_loop_count=self.args['ticks'], period=self.args['period'], overrun_policy=self.args.get('policy', yamal.SKIP), block=self.args.get('block', True))
+
+    def loop_event(self, item):
+        self.tick_times.append(time.monotonic())
+        self.tick_threads.add(threading.get_ident())
+        time.sleep(self.args.get('work', 0))
+
+
+def test_periodic_loop():
+
+    config = {
+        'steady': {'class name': 'Ticker', 'location': 'test_yamal.py', 'args': {'ticks': 20, 'period': 0.01}},
+        'skipping': {'class name': 'Ticker', 'location': 'test_yamal.py', 'args': {'ticks': 4, 'period': 0.01, 'work': 0.025}},
+        'catching up': {'class name': 'Ticker', 'location': 'test_yamal.py', 'args': {'ticks': 4, 'period': 0.01, 'work': 0.025, 'policy': yamal.CATCH_UP}},
+        }
+    config.update({f'timer{i}': {'class name': 'Ticker', 'location': 'test_yamal.py', 'args': {'ticks': 5, 'period': 0.01, 'block': False}} for i in range(3)})
+
+    mgr = Node_Manager()
+    mgr._start(config)
+
+    nodes = {node.name: node for node, thread in mgr.threads}
+    loops = {name: stats['loops'][0] for name, stats in mgr.stats()['nodes'].items()}
+
+    # a loaded machine can make the odd tick late, the schedule itself must not drift
+    steady = nodes['steady'].tick_times
+    assert len(steady) == 20
+    offsets = [t - i * 0.01 for i, t in enumerate(steady)]
+    first, second = sorted(offsets[:10]), sorted(offsets[10:])
+    assert abs(second[5] - first[5]) < 0.005
+    assert loops['steady']['overruns'] <= 2
+
+    # every 25ms tick misses at least 2 deadlines of 10ms, skipping them keeps the ticks on the 10ms grid
+    skipping = nodes['skipping'].tick_times
+    assert loops['skipping']['ticks'] == 4 and loops['skipping']['overruns'] >= 8
+    assert all(b - a >= 0.025 for a, b in zip(skipping, skipping[1:]))
+
+    # catching up runs the missed ticks back to back, so 4 ticks take about 4 times the work
+    catching_up = nodes['catching up'].tick_times
+    assert loops['catching up']['ticks'] == 4 and loops['catching up']['overruns'] >= 1
+    assert 3 * 0.025 <= catching_up[-1] - catching_up[0] < 3 * 0.025 + 0.03
+
+    timer_threads = set.union(*(nodes[f'timer{i}'].tick_threads for i in range(3)))
+    assert len(timer_threads) == 1 and wait_for(lambda: mgr.timer.thread is None)
+    assert all(loops[f'timer{i}']['ticks'] == 5 for i in range(3))
+
+    # the cpu of ticks on the timer thread is charged to the nodes of the loops
+    node_stats = mgr.stats()['nodes']
+    assert all(node_stats[f'timer{i}']['run cpu'] >= loops[f'timer{i}']['cpu'] > 0 for i in range(3))
+
+    # the thread of a node with a non-blocking loop returns right away, the manager waits for the loop itself
+    mgr = Node_Manager()
+    start_thread = threading.Thread(target=mgr._start, args=({'timer': {'class name': 'Ticker', 'location': 'test_yamal.py', 'args': {'ticks': 30, 'period': 0.01, 'block': False}}},), daemon=True)
+    start_thread.start()
+    assert wait_for(lambda: mgr.threads and not mgr.threads[0][1].is_alive())
+    node = mgr.threads[0][0]
+    assert not node.periodic_tasks[0].done.is_set() and start_thread.is_alive()
+    start_thread.join(timeout=2)
+    assert not start_thread.is_alive() and len(node.tick_times) == 30
+
+
+def test_wildcard_topics():
+
+    trie = yamal.Topic_Trie()
+    for pattern in ('camera/*/frame', 'sensors/#', '#'):
+        trie.add(pattern)
+
+    assert sorted(trie.match('camera/left/frame')) == ['#', 'camera/*/frame']
+    assert sorted(trie.match('sensors')) == ['#', 'sensors/#']
+    assert sorted(trie.match('sensors/imu/gyro')) == ['#', 'sensors/#']
+    assert trie.match('camera/left/depth') == ['#']
+
+    trie.remove('camera/*/frame')
+    assert 'camera' not in trie.root
+
+    mgr = Node_Manager()
+    subscriber = Node('subscriber', mgr)
+
+    received = []
+    subscriber.subscribe('camera/*/frame', lambda topic, message: received.append(('frames', topic)))
+    subscriber.subscribe('camera/left/frame', lambda topic, message: received.append(('left', topic)))
+
+    mgr.publish('camera/left/frame', 0)
+    mgr.publish('camera/right/frame', 0)
+    mgr.publish('camera/right/depth', 0)
+
+    assert sorted(received) == [('frames', 'camera/left/frame'), ('frames', 'camera/right/frame'), ('left', 'camera/left/frame')]
+    assert len(mgr._resolved['camera/left/frame']) == 2
+
+    # (un)subscribing invalidates the resolved subscribers
+    subscriber.unsubscribe('camera/*/frame')
+    subscriber.subscribe('camera/#', lambda topic, message: received.append(('camera', topic)))
+    received.clear()
+
+    mgr.publish('camera/right/depth', 0)
+    mgr.publish('camera/left/frame', 0)
+
+    assert sorted(received) == [('camera', 'camera/left/frame'), ('camera', 'camera/right/depth'), ('left', 'camera/left/frame')]
+
+    # endless concrete topics under a pattern neither grow the resolved cache nor the stats without bound
+    sensors = Node_Manager()
+    Node('subscriber', sensors).subscribe('sensors/#', lambda topic, message: None)
+    for i in range(3 * yamal.MAX_CACHED_TOPICS):
+        sensors.publish(f'sensors/{i}', 0)
+    assert len(sensors._resolved) <= yamal.MAX_CACHED_TOPICS and len(sensors.topic_stats) <= yamal.MAX_CACHED_TOPICS
+    assert f'sensors/{3 * yamal.MAX_CACHED_TOPICS - 1}' in sensors.topic_stats
+
+    server, server_thread = start_server(mgr)
+    client = Client_Manager({})
+    client.conn = socket.create_connection(server.address)
+    threading.Thread(target=client._listen, daemon=True).start()
+
+    remote = []
+    client.subscribe('camera/*', callback_function=lambda topic, message: remote.append(topic))
+    assert wait_for(lambda: 'camera/*' in mgr.subscriptions)
+
+    # a raising callback does not end the client's listener
+    client.subscribe('boom', callback_function=lambda topic, message: 1 / 0)
+    assert wait_for(lambda: 'boom' in mgr.subscriptions)
+    mgr.publish('boom', 1)
+
+    mgr.publish('camera/gps', 1.0)
+    assert wait_for(lambda: remote == ['camera/gps'])
+    assert client.get_topics() == ['boom', 'camera/gps', 'camera/left/frame', 'camera/right/depth', 'camera/right/frame']
+
+    # calls still waiting when the connection closes fail
+    release = threading.Event()
+    Node('slow', mgr).provide_service('slow', lambda name, request: release.wait())
+    pending = client.call('slow', 1)
+
+    server.close()
+    server_thread.join()
+    with pytest.raises(ConnectionError):
+        pending.result(timeout=2)
+    release.set()
+    client.conn.close()
+
+
+def test_delivery_modes():
+
+    mgr = Node_Manager()
+    subscriber = Node('subscriber', mgr)
+
+    received = []
+    subscriber.subscribe('frame', lambda topic, message: received.append(message))
+
+    frame = np.zeros((4, 4), dtype=np.uint8)
+
+    mgr.publish('frame', frame, delivery=SHARED)
+    mgr.publish('frame', frame, delivery=COPY)
+
+    shared, copied = received
+
+    assert np.shares_memory(shared, frame) and not shared.flags.writeable
+    assert not np.shares_memory(copied, frame)
+
+    # the publisher keeps writing into its own array
+    assert frame.flags.writeable
+    frame[1, 1] = 2
+
+    # copy on write, only the subscriber that modifies the message pays for the copy
+    modified = writable(shared)
+    modified[0, 0] = 1
+
+    assert frame[0, 0] == 0 and not np.shares_memory(modified, frame)
+    assert writable(copied) is copied
+
+
+def test_process_node():
+
+    n_pings = 5
+
+    config = {
+        'publisher': {
+            'class name': 'Publisher',
+            'location': 'test_yamal.py',
+            'args': {'number of pings': n_pings}
+            },
+        'echo': {
+            'class name': 'Echo',
+            'location': 'test_yamal.py',
+            'process': True,
+            'args': {'fail first': True}
+            },
+        'collector': {
+            'class name': 'Collector',
+            'location': 'test_yamal.py'
+            }
+        }
+
+    mgr = Node_Manager()
+
+    mgr._start(config)
+
+    echo = mgr.threads[1][0]
+
+    # the raising callback only cost the first ping
+    assert len(pytest.collected) == n_pings - 1
+    assert echo.process.pid != os.getpid()
+    assert not echo.process.is_alive()
+
+
+def test_services():
+
+    mgr = Node_Manager()
+    provider, caller = Node('provider', mgr), Node('caller', mgr)
+
+    def slow_echo(name, request):
+        time.sleep(0.1)
+        return request
+
+    provider.provide_service('echo', slow_echo, workers=4)
+    provider.provide_service('fail', lambda name, request: 1 / 0)
+
+    # concurrent calls are served by the pool, in-process requests and responses are not copied
+    request = np.zeros(4)
+    t = time.time()
+    calls = [caller.call('echo', request) for _ in range(4)]
+    assert all(call.result(timeout=1) is request for call in calls)
+    assert time.time() - t < 0.3
+
+    with pytest.raises(TimeoutError):
+        caller.call('echo', 1, timeout=0.02).result()
+    with pytest.raises(ZeroDivisionError):
+        caller.call('fail', 1).result(timeout=1)
+    with pytest.raises(LookupError):
+        caller.call('missing', 1).result(timeout=1)
+
+    # finished calls are released by their timeouts
+    calls = [caller.call('echo', i, timeout=60) for i in range(3)]
+    assert [call.result(timeout=1) for call in calls] == [0, 1, 2]
+    assert all(task.future is None for _, _, task in mgr.timer.tasks if isinstance(task, yamal._Call_Timeout))
+    with pytest.raises(ValueError):
+        caller.provide_service('echo', slow_echo)
+
+    # over the socket server
+    server, server_thread = start_server(mgr)
+    client = Client_Manager({})
+    client.conn = socket.create_connection(server.address)
+    listen_thread = threading.Thread(target=client._listen, daemon=True)
+    listen_thread.start()
+
+    frame = np.arange(6, dtype=np.uint8).reshape(2, 3)
+    assert np.array_equal(client.call('echo', frame, timeout=1).result(timeout=2), frame)
+    with pytest.raises(RuntimeError, match='ZeroDivisionError'):
+        client.call('fail', 1).result(timeout=1)
+    with pytest.raises(RuntimeError, match='LookupError'):
+        client.call('missing', 1).result(timeout=1)
+
+    # between federated managers
+    other = Node_Manager()
+    bridge = other.connect(*server.address)
+    assert wait_for(lambda: 'echo' in bridge.remote_services)
+    assert Node('remote caller', other).call('echo', 'hi', timeout=1).result(timeout=2) == 'hi'
+
+    stats = mgr.stats()['services']
+    assert stats['echo']['calls'] == 10 and stats['echo']['provider'] == 'provider'
+    assert stats['fail']['failures'] == 2
+
+    other.stop_server()
+    server.close()
+    server_thread.join()
+    listen_thread.join()
+    client.conn.close()
+    mgr.close_all_nodes()
+
+    # a process node provides a service and calls one of the main process
+    mgr = Node_Manager()
+    Node('main', mgr).provide_service('greet', lambda name, request: f'hello {request}')
+    greetings = []
+    Node('listener', mgr).subscribe('greeting', lambda topic, message: greetings.append(message))
+
+    doubler = yamal.Process_Node('doubler', mgr, 'test_yamal.py', 'Doubler')
+    threading.Thread(target=doubler.run, daemon=True).start()
+
+    assert wait_for(lambda: 'double' in mgr.services, timeout=5)
+    assert mgr.call('double', 21, timeout=2).result(timeout=3) == 42
+    assert wait_for(lambda: greetings == ['hello process'])
+
+    doubler.close()
+    assert wait_for(lambda: 'double' not in mgr.services)
+    mgr.close_all_nodes()
+
+
+def test_shared_ring_buffer():
+
+    writer = Shared_Ring_Buffer((2, 3), np.uint8, n_slots=3)
+    shape, dtype, n_slots, name = writer.attach_args()
+    reader = Shared_Ring_Buffer(shape, dtype, n_slots, name=name, condition=writer.condition)
+
+    for i in range(1, 6):
+        writer.write(np.full((2, 3), i, dtype=np.uint8))
+
+    oldest = reader.read(timeout=0, latest=False)
+    newest = reader.read(timeout=0)
+
+    assert oldest[0, 0] == 3
+    assert newest[0, 0] == 5
+    assert reader.dropped == 3
+    assert reader.read(timeout=0) is None
+
+    with reader.view(timeout=0, latest=True) as frame:
+        assert frame is None
+
+    writer.write(np.full((2, 3), 6, dtype=np.uint8))
+    with reader.view(timeout=0) as frame:
+        assert frame[0, 0] == 6 and not frame.flags.writeable
+
+    reader.close()
+    writer.close()
+
+
+def _headless_display_process(*args):
+    # the display process with the gui functions patched, it renders into nothing
+    import cv2
+    for function in ('imshow', 'waitKey', 'setWindowTitle', 'destroyWindow', 'destroyAllWindows'):
+        setattr(cv2, function, lambda *args: None)
+    yamal._run_display_process(*args)
+
+
+def test_image_display():
+
+    pytest.importorskip('cv2')
+    yamal._display_server = yamal._Display_Server(_headless_display_process)
+
+    first = yamal.Image_Display('first')
+    second = yamal.Image_Display('second')
+
+    assert first.server is second.server
+
+    for i in range(20):
+        first.display(np.full((4, 4, 3), i, dtype=np.uint8))
+        second.display(np.full((8, 8), i, dtype=np.uint8))
+        time.sleep(0.01)
+    for i in range(50):
+        first.display(np.full((4, 4, 3), i, dtype=np.uint8))
+
+    assert wait_for(lambda: (first.stats() or {}).get('rendered', 0) + (first.stats() or {}).get('dropped', 0) == 70)
+
+    server = first.server
+    first.close()
+    second.close()
+
+    assert not server.process.is_alive()
+    assert server.window_stats['second']['rendered'] + server.window_stats['second']['dropped'] == 20
+    assert server.window_stats['first']['dropped'] > 0
+    assert yamal._display_server is None
+
+
+def test_bag_recording(tmp_path):
+
+    path = str(tmp_path / 'test.bag')
+    frame = np.arange(24, dtype=np.uint16).reshape(2, 3, 4)
+
+    config = {
+        'recorder': {
+            'class name': 'Recorder',
+            'location': 'examples/nodes/recording/bag.py',
+            'args': {'path': path, 'topics': ['frame', 'info'], 'duration': 0.3}
+            },
+        }
+
+    mgr = Node_Manager()
+    thread = threading.Thread(target=mgr._start, args=(config,))
+    thread.start()
+    assert wait_for(lambda: 'frame' in mgr.subscriptions and 'info' in mgr.subscriptions)
+
+    mgr.publish('frame', frame)
+    time.sleep(0.1)
+    mgr.publish('info', {'fps': 30})
+    mgr.publish('frame', 2.5)
+    thread.join()
+
+    bag = yamal.Bag_Reader(path)
+    (t0, topic0, recorded), (t1, topic1, info), (t2, topic2, number) = bag.messages()
+
+    assert (topic0, topic1, topic2) == ('frame', 'info', 'frame')
+    assert np.array_equal(recorded, frame) and recorded.dtype == np.uint16 and not recorded.flags.writeable
+    assert info == {'fps': 30} and number == 2.5
+    assert 0.08 < t1 - t0 < 0.3
+    assert bag.seek(t1) == 1
+    bag.close()
+
+    mgr = Node_Manager()
+    received = []
+    Node('subscriber', mgr).subscribe('frame', lambda topic, message: received.append(time.monotonic()))
+    replayer = yamal._load_node_class('examples/nodes/recording/bag.py', 'Replayer')
+    for speed in (1, 0):
+        replayer('replayer', mgr, {'path': path, 'speed': speed}).run()
+
+    assert len(received) == 4
+    assert abs((received[1] - received[0]) - (t2 - t0)) < 0.05
+    assert received[3] - received[2] < 0.01
+
+    # a recording that was never closed is read by scanning its records
+    writer = yamal.Bag_Writer(str(tmp_path / 'unclosed.bag'))
+    writer.write('frame', frame, timestamp=1.0)
+    writer.file.flush()
+    unclosed = yamal.Bag_Reader(writer.path)
+    assert len(unclosed) == 1
+    unclosed.close()
+    writer.close()
+
+    # pickles only come back out of bags, never off a socket
+    with pytest.raises(ValueError):
+        yamal.decode_message(yamal.MSG_PICKLE, yamal.pickle.dumps({'fps': 30}))
+
+
+def wait_for(condition, timeout=2):
+    t = time.time()
+    while not condition() and time.time() - t < timeout:
+        time.sleep(0.01)
+    return condition()
+
+
+def start_server(mgr, **kwargs):
+    server = Socket_Server(mgr, '127.0.0.1', 0, **kwargs)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    return server, thread
+
+
+def test_socket_framing():
+
+    mgr = Node_Manager()
+    server, server_thread = start_server(mgr)
+
+    client_conn = socket.create_connection(server.address)
+    receiver = Frame_Receiver(client_conn, buffer_size=16)
+
+    for topic in ('ping', 'image'):
+        send_frame(client_conn, MSG_SUBSCRIBE, payload=SUBSCRIPTION_FORMAT.pack(0, 90) + topic.encode())
+    assert wait_for(lambda: 'ping' in mgr.subscriptions and 'image' in mgr.subscriptions)
+
+    payload = b'$START$binary$END$data' * 100_000
+
+    mgr.publish('ping', 1.5)
+    mgr.publish('ping', 42)
+    mgr.publish('image', payload)
+
+    received = []
+    for _ in range(5):
+        msg_type, topic_id, data = receiver.receive()
+        received.append((msg_type, topic_id, bytes(data)))
+
+    assert received[0] == (MSG_TOPIC, 1, b'ping')
+    assert received[1] == (MSG_FLOAT, 1, FLOAT_FORMAT.pack(1.5))
+    assert received[2] == (MSG_INT, 1, INT_FORMAT.pack(42))
+    assert received[3] == (MSG_TOPIC, 2, b'image')
+    assert received[4] == (MSG_BYTES, 2, payload)
+
+    t = time.time()
+    server.close()
+    server_thread.join()
+
+    assert time.time() - t < 0.5
+    assert receiver.receive()[0] == MSG_CLOSE
+    assert len(mgr.subscriptions) == 0
+
+    client_conn.close()
+
+
+def test_socket_arrays():
+
+    mgr = Node_Manager()
+    server, server_thread = start_server(mgr)
+
+    client = Client_Manager({})
+    client.conn = socket.create_connection(server.address)
+    listen_thread = threading.Thread(target=client._listen, daemon=True)
+    listen_thread.start()
+
+    received = {'frame': [], 'jpeg frame': []}
+    def callback_function(topic, message):
+        received[topic].append(message)
+
+    client.subscribe('frame', callback_function=callback_function)
+    client.subscribe('jpeg frame', JPEG, 95, callback_function=callback_function)
+    assert wait_for(lambda: 'frame' in mgr.subscriptions and 'jpeg frame' in mgr.subscriptions)
+
+    frame = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    depth = np.arange(12, dtype=np.float32).reshape(3, 4)
+    mgr.publish('frame', frame)
+    mgr.publish('frame', depth)
+    mgr.publish('jpeg frame', np.zeros((64, 64, 3), dtype=np.uint8))
+
+    assert wait_for(lambda: len(received['jpeg frame']) == 1)
+
+    server.close()
+    server_thread.join()
+    listen_thread.join()
+    client.conn.close()
+
+    assert np.array_equal(received['frame'][0], frame)
+    assert received['frame'][1].dtype == np.float32 and np.array_equal(received['frame'][1], depth)
+    assert received['jpeg frame'][0].shape == (64, 64, 3)
+
+
+def test_topic_schemas():
+
+    mgr = Node_Manager()
+    mgr.declare_topics({
+        'ping': {'schema': 'float64'},
+        'pose': {'schema': {'struct': {'x': 'float32', 'y': 'float32', 'id': 'uint16'}}},
+        'frame': {'schema': {'ndarray': {'dtype': 'uint8', 'shape': [4, 6, 3]}}},
+        'depth': {'schema': {'ndarray': {'dtype': 'float32', 'shape': [None, None]}}},
+    })
+
+    # mismatches raise before anyone receives them
+    for topic, message in [('ping', 'soon'), ('pose', {'x': 1.0, 'y': 2.0}), ('pose', {'x': 1.0, 'y': 2.0, 'id': 70000}),
+                           ('frame', np.zeros((4, 6, 3), np.float32)), ('frame', np.zeros((4, 5, 3), np.uint8)), ('depth', [1.0]),
+                           ('pose', {'x': 1e39, 'y': 2.0, 'id': 1})]:
+        with pytest.raises(TypeError):
+            mgr.publish(topic, message)
+
+    with pytest.raises(ValueError):
+        mgr.declare_topics({'bad': {'schema': 'complex'}})
+
+    server, server_thread = start_server(mgr)
+
+    client = Client_Manager({})
+    client.conn = socket.create_connection(server.address)
+    listen_thread = threading.Thread(target=client._listen, daemon=True)
+    listen_thread.start()
+
+    received = []
+    for topic in ('ping', 'pose', 'frame', 'depth'):
+        client.subscribe(topic, callback_function=lambda topic, message: received.append((topic, message)))
+    assert wait_for(lambda: all(topic in mgr.subscriptions for topic in ('ping', 'pose', 'frame', 'depth')))
+
+    frame = np.arange(72, dtype=np.uint8).reshape(4, 6, 3)
+    depth = np.arange(6, dtype=np.float32).reshape(2, 3)
+    mgr.publish('ping', 1.5)
+    mgr.publish('pose', {'x': 0.5, 'y': -2.0, 'id': 7})
+    mgr.publish('frame', frame)
+    mgr.publish('depth', depth)
+    assert wait_for(lambda: len(received) == 4)
+
+    assert received[0] == ('ping', 1.5)
+    assert received[1] == ('pose', {'x': 0.5, 'y': -2.0, 'id': 7})
+    assert np.array_equal(received[2][1], frame) and np.array_equal(received[3][1], depth)
+
+    server.close()
+    server_thread.join()
+    listen_thread.join()
+    client.conn.close()
+
+    # a fixed shape frame carries nothing but its pixels
+    schema = yamal.compile_schema({'ndarray': {'dtype': 'uint8', 'shape': [4, 6, 3]}})
+    assert memoryview(schema.encode(frame)).nbytes == frame.nbytes
+
+
+def test_socket_backpressure():
+
+    mgr = Node_Manager()
+    server, server_thread = start_server(mgr, max_buffered=1 << 20, overflow_policy=DROP_NEWEST)
+
+    # this client never reads
+    client_conn = socket.create_connection(server.address)
+    send_frame(client_conn, MSG_SUBSCRIBE, payload=SUBSCRIPTION_FORMAT.pack(0, 90) + b'frame')
+    assert wait_for(lambda: 'frame' in mgr.subscriptions)
+
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+
+    t = time.time()
+    for _ in range(100):
+        mgr.publish('frame', frame)
+    publish_time = time.time() - t
+
+    socket_node = server.connections[0]
+
+    assert publish_time < 1
+    assert socket_node.dropped > 0
+    assert socket_node.buffered <= 1 << 20 or len(socket_node.outbound) == 1
+
+    server.close()
+    server_thread.join()
+    client_conn.close()
+
+
+def test_priority_lanes():
+
+    mgr = Node_Manager()
+    mgr.declare_topics({'control': {'priority': 'high'}, 'frame': {'priority': 'low', 'deadline': 0.2}})
+    node = Node('node', mgr)
+
+    with pytest.raises(ValueError):
+        mgr.declare_topics({'other': {'priority': 'urgent'}})
+
+    # messages waiting in a queue past their deadline are dropped, not delivered late
+    release = threading.Event()
+    received = []
+    def slow(topic, message):
+        release.wait()
+        received.append(message)
+
+    mgr.subscribe('frame', slow, node, asynchronous=True)
+    subscription = mgr.subscriptions['frame'][0]
+
+    mgr.publish('frame', 0)
+    assert wait_for(lambda: len(subscription.queue) == 0)
+    for i in range(1, 5):
+        mgr.publish('frame', i)
+    time.sleep(0.3)
+    release.set()
+
+    assert wait_for(lambda: subscription.expired == 4)
+    assert received == [0]
+    assert mgr.lanes['low'].expired == 4 and mgr.lanes['low'].latency.count == 1
+
+    mgr.subscribe('control', lambda topic, message: received.append(message), node)
+    mgr.publish('control', 1.5)
+    mgr.publish('control', 2.5, deadline=60)
+    assert received[-2:] == [1.5, 2.5]
+    assert mgr.lanes['high'].latency.count == 2
+
+    mgr.unsubscribe('frame', node)
+    mgr.unsubscribe('control', node)
+
+    # on a connection the high lane overtakes queued frames of the low one, which expire while waiting
+    server, server_thread = start_server(mgr)
+
+    client_conn = socket.socket()
+    client_conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 16)
+    client_conn.connect(server.address)
+    for topic in ('frame', 'control'):
+        send_frame(client_conn, MSG_SUBSCRIBE, payload=SUBSCRIPTION_FORMAT.pack(0, 90) + topic.encode())
+    assert wait_for(lambda: 'frame' in mgr.subscriptions and 'control' in mgr.subscriptions)
+
+    payload = bytes(1 << 18)
+    for _ in range(40):
+        mgr.publish('frame', payload)
+    mgr.publish('control', 1.5)
+
+    socket_node = server.connections[0]
+    with socket_node.send_lock:
+        ranks = [frame[3] for frame in list(socket_node.outbound)[1:]]
+    assert ranks == sorted(ranks) and ranks[0] == 0
+
+    time.sleep(0.3)
+    receiver = Frame_Receiver(client_conn)
+    frames = []
+    while (MSG_FLOAT, 2) not in frames:
+        frames.append(receiver.receive()[:2])
+
+    assert frames.count((MSG_BYTES, 1)) < 40
+    assert wait_for(lambda: socket_node.expired > 0 and len(socket_node.outbound) == 0)
+    assert server.lanes['low'].expired == socket_node.expired
+    assert server.lanes['high'].latency.count == 1
+
+    server.close()
+    server_thread.join()
+    client_conn.close()
+
+
+class Marker:
+
+    # creates a file when unpickled
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return open, (self.path, 'w')
+
+
+def test_socket_malformed_frames(tmp_path):
+
+    mgr = Node_Manager()
+    server, server_thread = start_server(mgr)
+
+    marker = str(tmp_path / 'marker')
+    pickled = yamal.pickle.dumps(Marker(marker))
+    name = b'echo'
+    hello = (yamal.MSG_HELLO, 0, os.urandom(yamal.MANAGER_ID_SIZE))
+    topic = (MSG_TOPIC, 1, b'remote')
+    cases = [
+        [(yamal.MSG_CALL, 0, yamal.CALL_FORMAT.pack(1, yamal.MSG_PICKLE, len(name)) + name + pickled)],
+        [(yamal.MSG_FORWARD, 1, yamal.FORWARD_FORMAT.pack(yamal.MSG_PICKLE, 0) + pickled)],
+        [hello, topic, (yamal.MSG_FORWARD, 1, yamal.FORWARD_FORMAT.pack(yamal.MSG_PICKLE, 0) + pickled)],
+        [hello, (yamal.MSG_FORWARD, 2, yamal.FORWARD_FORMAT.pack(MSG_INT, 0) + INT_FORMAT.pack(1))],
+        [hello, (yamal.MSG_SCHEMA, 1, b'{not json')],
+        [(MSG_SUBSCRIBE, 0, SUBSCRIPTION_FORMAT.pack(7, 90) + b'frame')],
+        [(MSG_SUBSCRIBE, 0, b'\0')],
+        [(yamal.MSG_UNSUBSCRIBE, 0, b'\xff\xfe')],
+        ]
+
+    # every bad frame closes its own connection, the server keeps serving the others
+    for frames in cases:
+        client_conn = socket.create_connection(server.address)
+        client_conn.settimeout(2)
+        for msg_type, topic_id, payload in frames:
+            send_frame(client_conn, msg_type, topic_id, payload)
+        receiver = Frame_Receiver(client_conn)
+        with pytest.raises(ConnectionError):
+            while True:
+                receiver.receive()
+        client_conn.close()
+
+    # a header announcing a huge frame is refused before anything is allocated
+    client_conn = socket.create_connection(server.address)
+    client_conn.sendall(yamal.FRAME_HEADER.pack(yamal.PROTOCOL_VERSION, MSG_SUBSCRIBE, 0, 1 << 31))
+    client_conn.settimeout(2)
+    assert client_conn.recv(1) == b''
+    client_conn.close()
+
+    assert not os.path.exists(marker)
+    assert server_thread.is_alive()
+    assert wait_for(lambda: len(server.connections) == 0)
+
+    # forwarded messages are published off the selector thread, a raising subscriber only loses its message
+    received = []
+    def fragile(topic, message):
+        if message == 0:
+            raise RuntimeError('fragile subscriber')
+        received.append(message)
+
+    Node('fragile', mgr).subscribe('remote', fragile)
+    client_conn = socket.create_connection(server.address)
+    for msg_type, topic_id, payload in [hello, topic]:
+        send_frame(client_conn, msg_type, topic_id, payload)
+    for i in range(2):
+        send_frame(client_conn, yamal.MSG_FORWARD, 1, yamal.FORWARD_FORMAT.pack(MSG_INT, 0) + INT_FORMAT.pack(i))
+    assert wait_for(lambda: received == [1])
+    assert server_thread.is_alive() and len(server.connections) == 1
+    client_conn.close()
+
+    server.close()
+    server_thread.join()
+
+
+def test_socket_encode_once(monkeypatch):
+
+    encodes = []
+    encode_image = yamal.encode_image
+    monkeypatch.setattr(yamal, 'encode_image', lambda *args: encodes.append(args[1:]) or encode_image(*args))
+
+    mgr = Node_Manager()
+    server, server_thread = start_server(mgr)
+
+    clients = []
+    received = []
+    for encoding in (JPEG, JPEG, RAW):
+        client = Client_Manager({})
+        client.conn = socket.create_connection(server.address)
+        threading.Thread(target=client._listen, daemon=True).start()
+        client.subscribe('frame', encoding, 80, callback_function=lambda topic, message: received.append(message))
+        clients.append(client)
+
+    assert wait_for(lambda: sum(len(group) for group in server.relays.get('frame', {}).values()) == 3)
+    assert len(mgr.subscriptions['frame']) == 1
+
+    mgr.publish('frame', np.zeros((64, 64, 3), dtype=np.uint8))
+
+    assert wait_for(lambda: len(received) == 3)
+    assert encodes == [(JPEG, 80)]
+
+    # jpeg has no 5 channel images, the raw connection gets the frame anyway
+    mgr.publish('frame', np.zeros((4, 4, 5), dtype=np.uint8))
+    assert wait_for(lambda: len(received) == 4) and received[-1].shape == (4, 4, 5)
+
+    server.close()
+    server_thread.join()
+    for client in clients:
+        client.conn.close()
+
+
+def test_federation():
+
+    camera_box, detection_box = Node_Manager(), Node_Manager()
+    # typed on the camera side only, the detection side decodes with the schema sent along
+    camera_box.declare_topics({'camera/frame': {'schema': {'ndarray': {'dtype': 'uint8', 'shape': [3, 4]}}}})
+    camera_box.start_server('127.0.0.1', 0)
+    bridge = detection_box.connect(*camera_box.server.address)
+
+    frames, detections, chat = [], [], []
+    Node('detector', detection_box).subscribe('camera/frame', lambda topic, message: frames.append(message))
+    Node('viewer', camera_box).subscribe('detections', lambda topic, message: detections.append(message))
+    for mgr in (camera_box, detection_box):
+        Node('chat', mgr).subscribe('chat', lambda topic, message, mgr=mgr: chat.append((mgr, message)))
+
+    assert wait_for(lambda: set(camera_box.server.relays) == {'camera/frame', 'chat'} and set(detection_box.server.relays) == {'detections', 'chat'})
+
+    frame = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    camera_box.publish('camera/frame', frame)
+    camera_box.publish('unwatched', 1)
+    detection_box.publish('detections', 3)
+    camera_box.publish('chat', 'hi')
+
+    assert wait_for(lambda: len(frames) == 1 and len(detections) == 1 and len(chat) == 2)
+    time.sleep(0.1)
+
+    assert np.array_equal(frames[0], frame)
+    assert detections == [3]
+    # each side sees the chat message once, it does not bounce back
+    assert sorted((mgr is camera_box, message) for mgr, message in chat) == [(False, 'hi'), (True, 'hi')]
+    assert 'unwatched' not in camera_box.server.relays
+
+    # unsubscribing takes the topic back from the other side
+    detection_box.unsubscribe('camera/frame', detection_box.subscriptions['camera/frame'][0].subscriber)
+    assert wait_for(lambda: 'camera/frame' not in camera_box.subscriptions)
+    assert bridge.peer_id == camera_box.id
+
+    detection_box.stop_server()
+    camera_box.stop_server()
+
+
+def test_benchmark_suite(capsys):
+
+    import benchmark_yamal, copy
+
+    sweep = {'sizes': (8, 4096), 'subscribers': (2,), 'publishers': (1,), 'transports': (benchmark_yamal.IN_PROCESS, benchmark_yamal.SOCKET), 'display shapes': ()}
+    report = benchmark_yamal.suite_report(benchmark_yamal.run_suite(sweep, quick=True, repeats=1), quick=True)
+
+    assert len(report['results']) == 4
+    for result in report['results']:
+        assert result['messages'] == 2 * benchmark_yamal._n_messages(result['size'], 2, 1, quick=True) and result['throughput'] > 0
+        assert 0 < result['latency']['p50'] <= result['latency']['p99'] <= result['latency']['max']
+
+    assert benchmark_yamal.compare(report, report) == []
+
+    # a baseline twice as fast flags every case
+    baseline = copy.deepcopy(report)
+    for result in baseline['results']:
+        result['throughput'] *= 2
+    assert len(benchmark_yamal.compare(report, baseline)) == 4
+    assert 'REGRESSION' in capsys.readouterr().out
+
+
+def test_stats():
+
+    pytest.timings = []
+
+    config = {
+        'publisher': {
+            'class name': 'Publisher',
+            'location': 'test_yamal.py',
+            'args': {'number of pings': 5}
+            },
+        'subscriber': {
+            'class name': 'Subscriber',
+            'location': 'test_yamal.py'
+            }
+        }
+
+    mgr = Node_Manager()
+    mgr._start(config)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_callback(topic, message):
+        started.set()
+        release.wait()
+
+    slow = Node('slow', mgr)
+    slow.subscribe('ping', slow_callback, asynchronous=True, queue_size=1, overflow_policy=DROP_NEWEST)
+    mgr.publish('ping', time.time())
+    started.wait()
+    for _ in range(4):
+        mgr.publish('ping', time.time())
+
+    snapshot = mgr.stats()
+    ping = snapshot['topics']['ping']
+
+    assert ping['published'] == 10
+    assert ping['rate'] > 0
+    assert ping['subscribers']['subscriber']['duration']['count'] == 10
+    assert ping['subscribers']['subscriber']['duration']['p99'] < 0.001
+    assert ping['subscribers']['slow']['dropped'] == 3
+    assert ping['subscribers']['slow']['queue depth'] == 1
+    assert snapshot['nodes']['publisher']['run cpu'] is not None
+
+    mgr.get_stats()
+    release.set()
+    mgr.close_all_nodes()
+
+
+def test_logging():
+
+    import builtins, logging
+
+    class Capture(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+        def emit(self, record):
+            self.records.append((record.name, record.getMessage(), threading.get_ident()))
+
+    mgr = Node_Manager({'verbose': 1})
+    capture = Capture()
+    mgr.log_writer.add_handler(capture)
+
+    node = Node('chatty', mgr)
+    for i in range(100):
+        node.logger.info('message %d', i)
+    node.log('hidden', verbose=2)
+    yamal.log('from yamal', verbose=1)
+    mgr.log_writer.flush()
+
+    records = [record for record in capture.records if record[0] in ('yamal.chatty', 'yamal')]
+    mgr.log_writer.set_handlers(*[handler for handler in mgr.log_writer.handlers if handler is not capture])
+
+    assert [message for _, message, _ in records] == [f'message {i}' for i in range(100)] + ['from yamal']
+    assert records[0][0] == 'yamal.chatty'
+    assert all(thread != threading.get_ident() for _, _, thread in records)
+    assert builtins.print is print and not hasattr(mgr, 'original_print')
+
+    # the cli only takes the place of stdout, a log file keeps getting everything
+    log_file = Capture()
+    mgr.log_writer.add_handler(log_file)
+    screen = Capture()
+    handlers = mgr.log_writer.handlers
+    replaced = mgr.log_writer.replace_stdout(screen)
+    yamal.log('while the cli runs', verbose=1)
+    mgr.log_writer.flush()
+    mgr.log_writer.restore_stdout(screen, replaced)
+
+    assert replaced and all(isinstance(handler, yamal._Stdout_Handler) for handler in replaced)
+    assert all('while the cli runs' in [message for _, message, _ in handler.records] for handler in (screen, log_file))
+    assert set(mgr.log_writer.handlers) == set(handlers)
+    mgr.log_writer.set_handlers(*[handler for handler in mgr.log_writer.handlers if handler is not log_file])
+
+
+def test_lazy_imports():
+
+    code = 'import sys, yamal; mgr = yamal.Node_Manager(); mgr.publish("ping", 1.0); print(" ".join(sorted(m for m in ("numpy", "cv2", "curses", "multiprocessing") if m in sys.modules)))'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == ''
+
+
+def test_node_loading():
+
+    config = {f'slow{i}': {'class name': 'Slow_Init', 'location': 'test_yamal.py'} for i in range(4)}
+    config['forking'] = {'class name': 'Forking_Init', 'location': 'test_yamal.py'}
+
+    mgr = Node_Manager()
+
+    t = time.time()
+    mgr._start(config)
+    start_time = time.time() - t
+
+    nodes = [node for node, thread in mgr.threads]
+    node_class = type(nodes[0])
+
+    assert start_time < 0.9
+    assert [node.name for node in nodes] == list(config)
+    assert all(type(node) is node_class for node in nodes[:-1])
+    assert sorted(node_class.instances) == [name for name in config if name != 'forking']
+
+    # a node starting a process is constructed on the starting thread, before the construction threads
+    assert type(nodes[-1]).__name__ == 'Forking_Init' and type(nodes[-1]).threads == [threading.current_thread()]
+    assert mgr._load_external_node('./test_yamal.py', 'Slow_Init') is node_class
@@ -1,17 +1,115 @@
-import threading, multiprocessing
-import argparse, yaml, time, copy
-import numpy as np, cv2
-import importlib.util, builtins, inspect
-import curses
-import socket, struct
-
-# TODO logging
-
-START_MARKER = b'$START$'
-END_MARKER = b'$END$'
-SPLIT_MARKER = b'$SPLIT$'
-CLOSE_MARKER = b'$CLOSE$'
-SUBSCRIPTION_MARKER = b'$SUB$'
+import threading, queue, sys, os
+import socket, selectors, struct
+import argparse, time, copy, collections, contextlib, bisect, heapq, itertools, functools, numbers, math
+import importlib.util, logging, atexit, types
+
+
+class _Lazy_Module:
+
+    # stands in for a heavy module and imports it on first use, then takes its place in the module globals
+
+    def __init__(self, name, global_name):
+        self._name = name
+        self._global_name = global_name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._global_name] = module
+        return getattr(module, attr)
+
+
+np = _Lazy_Module('numpy', 'np')
+cv2 = _Lazy_Module('cv2', 'cv2')
+curses = _Lazy_Module('curses', 'curses')
+yaml = _Lazy_Module('yaml', 'yaml')
+inspect = _Lazy_Module('inspect', 'inspect')
+multiprocessing = _Lazy_Module('multiprocessing', 'multiprocessing')
+shared_memory = _Lazy_Module('multiprocessing.shared_memory', 'shared_memory')
+resource_tracker = _Lazy_Module('multiprocessing.resource_tracker', 'resource_tracker')
+mmap = _Lazy_Module('mmap', 'mmap')
+pickle = _Lazy_Module('pickle', 'pickle')
+logging_handlers = _Lazy_Module('logging.handlers', 'logging_handlers')
+futures = _Lazy_Module('concurrent.futures', 'futures')
+json = _Lazy_Module('json', 'json')
+
+
+def _is_ndarray(message):
+    # without numpy imported there cannot be any arrays, so this never triggers the import
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(message, numpy.ndarray)
+
+
+# every frame starts with a fixed header: protocol version, message type, topic id, payload length
+PROTOCOL_VERSION = 1
+FRAME_HEADER = struct.Struct('!BBHI')
+# longer frames are refused instead of allocated, a 4K rgb frame is 25 MB
+MAX_FRAME_LENGTH = 256 << 20
+
+MSG_CLOSE = 0
+MSG_TOPIC = 1
+MSG_SUBSCRIBE = 2
+MSG_STR = 3
+MSG_INT = 4
+MSG_FLOAT = 5
+MSG_BYTES = 6
+MSG_NDARRAY = 7
+MSG_IMAGE = 8
+MSG_PICKLE = 9
+MSG_TOPICS = 10
+
+# federation between managers: hello carries the manager id, forwarded messages carry the ids they passed
+MSG_HELLO = 11
+MSG_UNSUBSCRIBE = 12
+MSG_FORWARD = 13
+# the schema of a topic, sent once before its first typed message, which only carries what the schema does not fix
+MSG_SCHEMA = 14
+MSG_TYPED = 15
+# service calls, a reply carries the id of the call it answers, peers tell each other which services they provide
+MSG_CALL = 16
+MSG_REPLY = 17
+MSG_SERVICES = 18
+CALL_FORMAT = struct.Struct('!IBB')
+REPLY_FORMAT = struct.Struct('!IBB')
+FORWARD_FORMAT = struct.Struct('!BB')
+MANAGER_ID_SIZE = 8
+
+INT_FORMAT = struct.Struct('!q')
+FLOAT_FORMAT = struct.Struct('!d')
+
+# how a subscriber wants arrays sent, subscribe frames carry (encoding, quality) in front of the topic
+RAW = 'raw'
+JPEG = 'jpeg'
+PNG = 'png'
+ENCODINGS = (RAW, JPEG, PNG)
+SUBSCRIPTION_FORMAT = struct.Struct('!BB')
+
+DROP_OLDEST = 'drop oldest'
+DROP_NEWEST = 'drop newest'
+BLOCK = 'block'
+
+# shared delivers read-only views and is copy on write for subscribers through writable()
+SHARED = 'shared'
+COPY = 'copy'
+DEEP_COPY = 'deep copy'
+
+THREADS = 'threads'
+PROCESSES = 'processes'
+
+# delivery lanes of a topic, highest first
+HIGH = 'high'
+NORMAL = 'normal'
+LOW = 'low'
+PRIORITIES = (HIGH, NORMAL, LOW)
+
+# what a periodic loop does with ticks it missed
+SKIP = 'skip'
+CATCH_UP = 'catch up'
+
+# concrete topics a manager keeps resolved subscribers and publish stats for, wildcards can match without end
+MAX_CACHED_TOPICS = 4096
+
+# read-only stand-in for missing properties, hot paths look up without allocating an empty dict every time
+_EMPTY_MAPPING = types.MappingProxyType({})
 
 
 
@@ -31,153 +129,1910 @@ def get_arg(args, key, default=None):
     return getattr(args, key)
 
 
+# verbose levels of the command line map onto logging levels, everything yamal logs is under the 'yamal' logger
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+VERBOSE_LEVELS = (logging.WARNING, logging.INFO, logging.DEBUG, TRACE)
+
+logger = logging.getLogger('yamal')
+logger.propagate = False
+
+
+def verbose_level(verbose):
+    return VERBOSE_LEVELS[max(0, min(verbose, len(VERBOSE_LEVELS) - 1))]
+
+
+def log(*args, verbose=0, logger=logger):
+    # print replacement, the message is only joined when its verbose level is enabled
+    level = verbose_level(verbose)
+    if logger.isEnabledFor(level):
+        logger.log(level, ' '.join(str(arg) for arg in args))
+
+
+class _Stdout_Handler(logging.StreamHandler):
+
+    # looks sys.stdout up for every record, so it follows whatever stdout is at the time
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, stream):
+        pass
+
+
+class Log_Writer:
+
+    # loggers only put records on a queue, a background thread formats them and hands them to the handlers
+
+    def __init__(self, *handlers):
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = logging_handlers.QueueHandler(self.queue)
+        self.listener = logging_handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    @property
+    def handlers(self):
+        return self.listener.handlers
+
+    def set_handlers(self, *handlers):
+        self.listener.handlers = handlers
+
+    def add_handler(self, handler):
+        self.listener.handlers = self.listener.handlers + (handler,)
+
+    def replace_stdout(self, handler):
+        # swaps the stdout handler for another one, the others like a log file keep getting every record,
+        # returns what was replaced so it can be put back
+        replaced = tuple(h for h in self.listener.handlers if isinstance(h, _Stdout_Handler))
+        self.listener.handlers = tuple(h for h in self.listener.handlers if h not in replaced) + (handler,)
+        return replaced
+
+    def restore_stdout(self, handler, replaced):
+        self.listener.handlers = tuple(h for h in self.listener.handlers if h is not handler) + replaced
+
+    def flush(self):
+        # waits until everything queued so far is written
+        self.close()
+        self.listener.start()
+
+    def close(self):
+        # writes whatever is still queued
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+
+_log_writer = None
+_log_lock = threading.Lock()
+
+def start_logging(verbose=1):
+    # one writer per process, started on first use and shared by every manager
+    global _log_writer
+
+    with _log_lock:
+        if _log_writer is None:
+            handler = _Stdout_Handler()
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            _log_writer = Log_Writer(handler)
+            logger.handlers = [_log_writer.queue_handler]
+            atexit.register(_log_writer.close)
+
+    logger.setLevel(verbose_level(verbose))
+    return _log_writer
+
+
+def pack_frame(msg_type, topic_id=0, payload=b''):
+    return FRAME_HEADER.pack(PROTOCOL_VERSION, msg_type, topic_id, len(payload)) + payload
+
+
+def send_frame(conn, msg_type, topic_id=0, payload=b''):
+    # payload can be a single buffer or a list of buffers that are sent back to back
+    parts = payload if isinstance(payload, (list, tuple)) else (payload,)
+    length = sum(memoryview(part).nbytes for part in parts)
+    header = FRAME_HEADER.pack(PROTOCOL_VERSION, msg_type, topic_id, length)
+
+    if length < 65536:
+        conn.sendall(header + b''.join(parts))
+    else:
+        # do not copy large payloads just to put the header in front
+        _send_buffers(conn, [header, *parts])
+
+
+def _send_buffers(conn, buffers):
+    if not hasattr(conn, 'sendmsg'):
+        for buffer in buffers:
+            conn.sendall(buffer)
+        return
+
+    views = [memoryview(buffer).cast('B') for buffer in buffers]
+    views = [view for view in views if len(view) > 0]
+
+    while len(views) > 0:
+        sent = conn.sendmsg(views)
+        while sent > 0:
+            if sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+def ndarray_header(array):
+    dtype = array.dtype.str.encode()
+    return struct.pack(f'!B{len(dtype)}sB{array.ndim}I', len(dtype), dtype, array.ndim, *array.shape)
+
+
+def decode_ndarray(payload):
+    # the returned array is a view on payload
+    payload = memoryview(payload)
+    dtype_length = payload[0]
+    dtype = np.dtype(bytes(payload[1:1 + dtype_length]).decode())
+    ndim = payload[1 + dtype_length]
+    offset = 2 + dtype_length
+    shape = struct.unpack_from(f'!{ndim}I', payload, offset)
+    offset += 4 * ndim
+    return np.frombuffer(payload, dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+
+def encode_image(image, encoding=JPEG, quality=90):
+    try:
+        if encoding == JPEG:
+            ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        elif encoding == PNG:
+            ok, encoded = cv2.imencode('.png', image)
+        else:
+            raise ValueError(f'unknown image encoding: {encoding}')
+    except cv2.error as e:
+        # channels or dtypes the codec does not support
+        raise ValueError(f'could not encode image of shape {image.shape} and dtype {image.dtype} as {encoding}: {e}') from e
+
+    if not ok:
+        raise ValueError(f'could not encode image of shape {image.shape} as {encoding}')
+    return encoded
+
+
+class Frame_Receiver:
+
+    def __init__(self, conn, buffer_size=65536, max_length=MAX_FRAME_LENGTH):
+        self.conn = conn
+        self.max_length = max_length
+        self.header = bytearray(FRAME_HEADER.size)
+        self.buffer = bytearray(buffer_size)
+
+        # progress of the frame being received by receive_nowait
+        self._received = 0
+        self._frame = None
+
+    def _recv_into(self, view, wait_for_start=False):
+        received = 0
+        while received < len(view):
+            try:
+                n = self.conn.recv_into(view[received:])
+            except socket.timeout:
+                # a timeout is only passed on between frames, never halfway through one
+                if wait_for_start and received == 0:
+                    raise
+                continue
+
+            if n == 0:
+                raise ConnectionError('connection closed by peer')
+            received += n
+
+    def _parse_header(self):
+        version, msg_type, topic_id, length = FRAME_HEADER.unpack(self.header)
+
+        if version != PROTOCOL_VERSION:
+            raise ConnectionError(f'unsupported protocol version {version}, expected {PROTOCOL_VERSION}')
+        if length > self.max_length:
+            raise ConnectionError(f'frame of {length} bytes is longer than the maximum of {self.max_length}')
+
+        if length > len(self.buffer):
+            self.buffer = bytearray(max(length, 2 * len(self.buffer)))
+
+        return msg_type, topic_id, memoryview(self.buffer)[:length]
+
+    def receive(self):
+        # the returned payload is a view on a reused buffer, only valid until the next call
+        self._recv_into(memoryview(self.header), wait_for_start=True)
+        msg_type, topic_id, payload = self._parse_header()
+        self._recv_into(payload)
+
+        return msg_type, topic_id, payload
+
+    def receive_nowait(self):
+        # for non-blocking sockets, returns None until a whole frame has arrived
+        while True:
+            if self._frame is None:
+                view = memoryview(self.header)[self._received:]
+            else:
+                view = self._frame[2][self._received - FRAME_HEADER.size:]
+
+            if len(view) > 0:
+                try:
+                    n = self.conn.recv_into(view)
+                except (BlockingIOError, socket.timeout):
+                    return None
+
+                if n == 0:
+                    raise ConnectionError('connection closed by peer')
+                self._received += n
+
+                if n < len(view):
+                    continue
+
+            if self._frame is None:
+                self._frame = self._parse_header()
+                continue
+
+            frame = self._frame
+            self._frame = None
+            self._received = 0
+            return frame
+
+
+def encode_message(message, encoding=RAW, quality=90):
+    # returns (message type, payload), where payload can be a list of buffers for send_frame
+
+    if _is_ndarray(message):
+        if encoding != RAW:
+            return MSG_IMAGE, encode_image(message, encoding, quality)
+        if message.dtype.hasobject:
+            raise TypeError('object arrays cannot be sent over a socket')
+        message = np.ascontiguousarray(message)
+        return MSG_NDARRAY, (ndarray_header(message), message)
+
+    elif isinstance(message, str):
+        return MSG_STR, message.encode()
+    elif isinstance(message, int):
+        return MSG_INT, INT_FORMAT.pack(message)
+    elif isinstance(message, float):
+        return MSG_FLOAT, FLOAT_FORMAT.pack(message)
+    elif isinstance(message, (bytes, bytearray, memoryview)):
+        return MSG_BYTES, message
+
+    raise TypeError(f'messages of type {type(message).__name__} cannot be sent over a socket')
+
+
+def decode_message(msg_type, payload):
+    # arrays are returned as a view on payload, pickles are never decoded here, this is what sockets use
+
+    if msg_type == MSG_STR:
+        return bytes(payload).decode()
+    elif msg_type == MSG_INT:
+        return INT_FORMAT.unpack(payload)[0]
+    elif msg_type == MSG_FLOAT:
+        return FLOAT_FORMAT.unpack(payload)[0]
+    elif msg_type == MSG_BYTES:
+        return bytes(payload)
+    elif msg_type == MSG_NDARRAY:
+        return decode_ndarray(payload)
+    elif msg_type == MSG_IMAGE:
+        return cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_UNCHANGED)
+
+    raise ValueError(f'message type not implemented: {msg_type}')
+
+
+# message types a call or reply may carry, anything else coming off a socket closes the connection
+WIRE_TYPES = (MSG_STR, MSG_INT, MSG_FLOAT, MSG_BYTES, MSG_NDARRAY, MSG_IMAGE)
+
+
+def _check_wire_type(msg_type, accepted=WIRE_TYPES):
+    if msg_type not in accepted:
+        raise ConnectionError(f'message type {msg_type} is not accepted over a socket')
+
+
+def encode_call(call_id, name, request):
+    # payload of a MSG_CALL frame: call id, request message type, name length, name and the encoded request
+    msg_type, payload = encode_message(request)
+    name = name.encode()
+    parts = list(payload) if isinstance(payload, (list, tuple)) else [payload]
+    return [CALL_FORMAT.pack(call_id, msg_type, len(name)) + name] + parts
+
+
+def decode_call(payload):
+    call_id, msg_type, name_length = CALL_FORMAT.unpack_from(payload)
+    _check_wire_type(msg_type)
+    offset = CALL_FORMAT.size
+    name = bytes(payload[offset:offset + name_length]).decode()
+    request = decode_message(msg_type, payload[offset + name_length:])
+    # payload is reused for the next frame
+    if msg_type == MSG_NDARRAY:
+        request = request.copy()
+    return call_id, name, request
+
+
+def encode_reply(call_id, future):
+    # payload of a MSG_REPLY frame for a finished call, a failure travels as its message
+    ok, value = _outcome(future)
+    if ok:
+        try:
+            msg_type, payload = encode_message(value)
+        except TypeError as e:
+            ok, value = False, e
+
+    if not ok:
+        msg_type, payload = MSG_STR, f'{type(value).__name__}: {value}'.encode()
+
+    parts = list(payload) if isinstance(payload, (list, tuple)) else [payload]
+    return [REPLY_FORMAT.pack(call_id, int(ok), msg_type)] + parts
+
+
+def decode_reply(payload):
+    # returns (call id, ok, response or error message)
+    call_id, ok, msg_type = REPLY_FORMAT.unpack_from(payload)
+    _check_wire_type(msg_type)
+    value = decode_message(msg_type, payload[REPLY_FORMAT.size:])
+    if msg_type == MSG_NDARRAY:
+        value = value.copy()
+    return call_id, bool(ok), value
+
+
+def _outcome(future):
+    # (True, result) or (False, exception) of a finished future
+    if future.cancelled():
+        return False, futures.CancelledError()
+    exception = future.exception()
+    if exception is not None:
+        return False, exception
+    return True, future.result()
+
+
+def _settle(future, result=None, exception=None):
+    # the first outcome wins, a call can time out while it is still being served
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except futures.InvalidStateError:
+        pass
+
+
+# struct codes of the scalar types a topic schema can declare, str and bytes have a variable length
+SCALAR_TYPES = {
+    'bool': '?', 'int8': 'b', 'uint8': 'B', 'int16': 'h', 'uint16': 'H', 'int32': 'i', 'uint32': 'I', 'int64': 'q', 'uint64': 'Q',
+    'float32': 'f', 'float64': 'd', 'int': 'q', 'float': 'd', 'str': None, 'bytes': None,
+}
+
+
+class Scalar_Schema:
+
+    def __init__(self, name):
+        if name not in SCALAR_TYPES:
+            raise ValueError(f'unknown scalar type: {name}, choose from {tuple(SCALAR_TYPES)}')
+
+        self.name = name
+        self.spec = name
+        self.code = SCALAR_TYPES[name]
+        self.format = struct.Struct('!' + self.code) if self.code is not None else None
+
+        if self.code is not None and self.code in 'bBhHiIqQ':
+            bits = 8 * struct.calcsize(self.code)
+            self.bounds = (0, 2 ** bits - 1) if self.code.isupper() else (-2 ** (bits - 1), 2 ** (bits - 1) - 1)
+        elif self.code == 'f':
+            # largest finite float32, larger finite values do not pack
+            self.bounds = (-3.4028234663852886e38, 3.4028234663852886e38)
+
+    def error(self, value):
+        # why value does not fit, None if it does
+        if self.name == 'str':
+            ok = isinstance(value, str)
+        elif self.name == 'bytes':
+            ok = isinstance(value, (bytes, bytearray, memoryview))
+        elif self.code == '?':
+            ok = isinstance(value, bool) or getattr(getattr(value, 'dtype', None), 'kind', None) == 'b'
+        elif self.code in 'fd':
+            ok = isinstance(value, numbers.Real) and not isinstance(value, bool)
+            if ok and self.code == 'f' and math.isfinite(value) and not self.bounds[0] <= value <= self.bounds[1]:
+                return f'{value} is out of range for {self.name}'
+        else:
+            ok = isinstance(value, numbers.Integral) and not isinstance(value, bool)
+            if ok and not self.bounds[0] <= value <= self.bounds[1]:
+                return f'{value} is out of range for {self.name}'
+
+        return None if ok else f'expected {self.name}, got {type(value).__name__}'
+
+    def validate(self, topic, message):
+        error = self.error(message)
+        if error is not None:
+            raise TypeError(f'{topic}: {error}')
+
+    def encode(self, message):
+        if self.name == 'str':
+            return message.encode()
+        if self.name == 'bytes':
+            return message
+        return self.format.pack(message)
+
+    def decode(self, payload):
+        if self.name == 'str':
+            return bytes(payload).decode()
+        if self.name == 'bytes':
+            return bytes(payload)
+        return self.format.unpack(payload)[0]
+
+
+class Struct_Schema:
+
+    # a dict of fixed size scalar fields, packed in declaration order without names
+
+    def __init__(self, fields):
+        if not isinstance(fields, dict) or len(fields) == 0:
+            raise ValueError(f'a struct schema needs a mapping of field names to scalar types, got {fields}')
+
+        self.names = tuple(fields)
+        self.fields = tuple(Scalar_Schema(name) for name in fields.values())
+        for name, field in zip(self.names, self.fields):
+            if field.format is None:
+                raise ValueError(f'struct field {name} must have a fixed size, not {field.name}')
+
+        self.spec = {'struct': dict(fields)}
+        self.format = struct.Struct('!' + ''.join(field.code for field in self.fields))
+
+    def validate(self, topic, message):
+        if not isinstance(message, dict):
+            raise TypeError(f'{topic}: expected a struct of {", ".join(self.names)}, got {type(message).__name__}')
+        if len(message) != len(self.names) or any(name not in message for name in self.names):
+            raise TypeError(f'{topic}: expected fields {", ".join(self.names)}, got {", ".join(map(str, message))}')
+
+        for name, field in zip(self.names, self.fields):
+            error = field.error(message[name])
+            if error is not None:
+                raise TypeError(f'{topic}.{name}: {error}')
+
+    def encode(self, message):
+        return self.format.pack(*[message[name] for name in self.names])
+
+    def decode(self, payload):
+        return dict(zip(self.names, self.format.unpack(payload)))
+
+
+class Ndarray_Schema:
+
+    # fixed dtype, a shape where null dimensions may vary, a fully fixed shape leaves only the raw data on the wire
+
+    def __init__(self, dtype, shape=None):
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape) if shape is not None else None
+
+        if self.dtype.hasobject:
+            raise ValueError('object arrays cannot have a schema')
+
+        self.fixed = self.shape is not None and all(dim is not None for dim in self.shape)
+        self.spec = {'ndarray': {'dtype': self.dtype.str, 'shape': list(self.shape) if self.shape is not None else None}}
+
+        if self.fixed:
+            self.count = int(np.prod(self.shape))
+        elif self.shape is not None:
+            self.shape_format = struct.Struct(f'!{len(self.shape)}I')
+
+    def validate(self, topic, message):
+        if not _is_ndarray(message):
+            raise TypeError(f'{topic}: expected an array of {self.dtype}, got {type(message).__name__}')
+        if message.dtype != self.dtype:
+            raise TypeError(f'{topic}: expected dtype {self.dtype}, got {message.dtype}')
+        if self.shape is not None and (message.ndim != len(self.shape) or any(dim is not None and dim != n for dim, n in zip(self.shape, message.shape))):
+            raise TypeError(f'{topic}: expected shape {self.shape}, got {message.shape}')
+
+    def encode(self, message):
+        message = np.ascontiguousarray(message)
+        if self.fixed:
+            return message
+        if self.shape is not None:
+            return (self.shape_format.pack(*message.shape), message)
+        return (struct.pack(f'!B{message.ndim}I', message.ndim, *message.shape), message)
+
+    def decode(self, payload):
+        # the returned array is a view on payload
+        if self.fixed:
+            return np.frombuffer(payload, self.dtype, count=self.count).reshape(self.shape)
+
+        if self.shape is not None:
+            shape = self.shape_format.unpack_from(payload)
+            offset = self.shape_format.size
+        else:
+            ndim = payload[0]
+            shape = struct.unpack_from(f'!{ndim}I', payload, 1)
+            offset = 1 + 4 * ndim
+
+        return np.frombuffer(payload, self.dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+
+def compile_schema(spec):
+    # a scalar type name, {'struct': {field: type}} or {'ndarray': {'dtype': ..., 'shape': [...]}}
+    if isinstance(spec, str):
+        return Scalar_Schema(spec)
+
+    if isinstance(spec, dict) and len(spec) == 1:
+        kind, value = next(iter(spec.items()))
+        if kind == 'struct':
+            return Struct_Schema(value)
+        if kind == 'ndarray':
+            return Ndarray_Schema(value['dtype'], value.get('shape'))
+
+    raise ValueError(f'unknown schema: {spec}')
+
+
+_node_modules = {}
+_node_modules_lock = threading.Lock()
+
+def _load_node_module(node_path):
+    # every file is executed once and registered under its own name, nodes sharing a file share its module
+    path = os.path.realpath(node_path)
+
+    with _node_modules_lock:
+        if path in _node_modules:
+            return _node_modules[path]
+
+        stem = ''.join(c if c.isalnum() else '_' for c in os.path.splitext(os.path.basename(path))[0])
+        module_name = f'yamal_node_{len(_node_modules)}_{stem}'
+
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[module_name]
+            raise
+
+        _node_modules[path] = module
+        return module
+
+
+def _load_node_class(node_path, class_name):
+    return getattr(_load_node_module(node_path), class_name)
+
+
+def _process_context():
+    # processes are started by a server process, forking this one would copy its threads and the locks they hold
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def writable(message):
+    # messages delivered as shared are read-only, this gives the caller its private copy to modify
+    if _is_ndarray(message) and not message.flags.writeable:
+        return message.copy()
+    return message
+
+
+def _read_only_view(message):
+    if _is_ndarray(message):
+        message = message.view()
+        message.flags.writeable = False
+    return message
+
+
+class Histogram:
+
+    # fixed log-spaced buckets (quarter octaves from 1us), recording is a bisect and an increment
+
+    BOUNDS = [1e-6 * 2 ** (i / 4) for i in range(108)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile
+        if self.count == 0:
+            return None
+
+        target = p / 100 * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= target:
+                break
+
+        return min(self.BOUNDS[i] if i < len(self.BOUNDS) else self.max, self.max)
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count > 0 else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class Topic_Stats:
+
+    def __init__(self):
+        self.published = 0
+        self.first = None
+        self.last = None
+
+    def record(self):
+        # not locked, concurrent publishers on one topic can lose the odd count
+        self.last = time.monotonic()
+        if self.first is None:
+            self.first = self.last
+        self.published += 1
+
+    def rate(self):
+        if self.published < 2 or self.last == self.first:
+            return 0.0
+        return (self.published - 1) / (self.last - self.first)
+
+
+class Lane_Stats:
+
+    # latency from publish until the callback starts or the frame is written, and the messages that missed their deadline
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.rank = PRIORITIES.index(priority)
+        self.latency = Histogram()
+        self.expired = 0
+
+    def stats(self):
+        return {'latency': self.latency.snapshot(), 'expired': self.expired}
+
+
+def _fresh(stamp, subscription=None):
+    # stamp is (lane, published, expires), a message past its deadline is dropped instead of delivered late
+    lane, published, expires = stamp
+    now = time.monotonic()
+    if expires is not None and now > expires:
+        lane.expired += 1
+        if subscription is not None:
+            subscription.expired += 1
+        return False
+    lane.latency.record(now - published)
+    return True
+
+
+def _thread_cpu_time(thread):
+    if thread.ident is None or not thread.is_alive() or not hasattr(time, 'pthread_getcpuclockid'):
+        return None
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (OSError, ProcessLookupError):
+        return None
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:.0f}us'
+    if seconds < 1:
+        return f'{seconds * 1e3:.1f}ms'
+    return f'{seconds:.2f}s'
+
+
+def is_pattern(topic):
+    # topics are split in levels on '/', '*' matches a single level and '#' all remaining levels
+    return any(level in ('*', '#') for level in topic.split('/'))
+
+
+class Topic_Trie:
+
+    # prefix tree of subscription patterns, match returns every pattern a concrete topic falls under
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, pattern):
+        levels = pattern.split('/')
+        assert '#' not in levels[:-1], f'# has to be the last level of {pattern}'
+
+        node = self.root
+        for level in levels:
+            node = node.setdefault(level, {})
+        node.setdefault(None, set()).add(pattern)
+
+    def remove(self, pattern):
+        path = [self.root]
+        for level in pattern.split('/'):
+            if level not in path[-1]:
+                return
+            path.append(path[-1][level])
+
+        path[-1].get(None, set()).discard(pattern)
+        if not path[-1].get(None, True):
+            del path[-1][None]
+
+        # prune the branches that no pattern ends in anymore
+        for level, (parent, node) in zip(reversed(pattern.split('/')), reversed(list(zip(path, path[1:])))):
+            if node:
+                break
+            del parent[level]
+
+    def match(self, topic):
+        patterns = []
+        self._match(self.root, topic.split('/'), 0, patterns)
+        return patterns
+
+    def _match(self, node, levels, i, patterns):
+        if '#' in node:
+            patterns.extend(node['#'].get(None, ()))
+
+        if i == len(levels):
+            patterns.extend(node.get(None, ()))
+            return
+
+        for key in (levels[i], '*'):
+            child = node.get(key)
+            if child is not None:
+                self._match(child, levels, i + 1, patterns)
+
+
 class Node_Manager:
 
     def __init__(self, args=None):
         self._close_event = threading.Event()
         self.lock = threading.Lock()
         self.subscriptions = {}
+        self.topics = {}
+        self.schemas = {}
+        self.services = {}
         self.threads = []
 
+        # topics with a priority or deadline get their messages stamped, the others skip the bookkeeping
+        self.lanes = {priority: Lane_Stats(priority) for priority in PRIORITIES}
+        self.topic_lanes = {}
+
+        # subscriptions keyed by exact topic or pattern, publish reads the resolved tuple of a concrete topic
+        self.topic_trie = Topic_Trie()
+        self._resolved = {}
+
+        self.timer = Timer_Scheduler()
+
+        self.id = os.urandom(MANAGER_ID_SIZE)
+        self.server = None
+        self.server_thread = None
+
+        self.topic_stats = {}
+        self.run_cpu = {}
+        self.retired_callback_cpu = collections.Counter()
+
         self.args = args
+        self.verbose = get_arg(self.args, 'verbose', 1)
 
-        if not get_arg(self.args, 'cli', False):
-            self.original_print = print
-            builtins.print = self._verbose_print
-    
-    def _verbose_print(self, *args, **kwargs):
-        if 'verbose' in kwargs and get_arg(self.args, 'verbose', 1) < kwargs['verbose']:
-            return
-        self.original_print(*args)
+        self.log_writer = start_logging(self.verbose)
+        if get_arg(self.args, 'log_file', None):
+            handler = logging.FileHandler(get_arg(self.args, 'log_file'))
+            handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+            self.log_writer.add_handler(handler)
     
     def _start(self, config):
-        for name, properties in config.items():
-
-            node = self._load_external_node(properties['location'], properties['class name'])
+        config = dict(config)
+        self.declare_topics(config.pop('topics', None) or {})
+
+        # nodes are constructed in parallel so slow __init__s don't add up, they are started in config order
+        nodes = [None] * len(config)
+        errors = []
+
+        def construct(i, name, properties):
+            try:
+                nodes[i] = self._construct_node(name, properties)
+                log(f'{name} loaded', verbose=2)
+            except BaseException as e:
+                errors.append(e)
+
+        # node classes are loaded here, one module after the other, construction threads only run the __init__s
+        entries = list(enumerate(config.items()))
+        forking = set()
+        for i, (name, properties) in entries:
+            if not properties.get('process', False) and self._load_external_node(properties['location'], properties['class name']).starts_processes:
+                forking.add(i)
+
+        # nodes forking a process in __init__ are constructed before the construction threads, so none of those holds a
+        # lock while they fork, the log writer and the timer threads of the manager may already run, a child has to set
+        # up its own logging rather than use the inherited one, process nodes start from a forkserver and need none of this
+        for i, (name, properties) in entries:
+            if i in forking:
+                construct(i, name, properties)
+        entries = [entry for entry in entries if entry[0] not in forking]
+
+        if get_arg(self.args, 'parallel construction', True):
+            construct_threads = [threading.Thread(target=construct, args=(i, name, properties), daemon=True)
+                                 for i, (name, properties) in entries]
+            for thread in construct_threads:
+                thread.start()
+            for thread in construct_threads:
+                thread.join()
+        else:
+            for i, (name, properties) in entries:
+                construct(i, name, properties)
 
-            node = node(name, self, properties['args'] if 'args' in properties else None)
+        if errors:
+            for node in nodes:
+                if node is not None:
+                    node.close()
+            raise errors[0]
 
-            thread = threading.Thread(target=node.run, daemon=True)
+        for node in nodes:
+            thread = threading.Thread(target=self._run_node, args=(node,), daemon=True)
             self.threads.append((node, thread))
-
-            print(f'{node.name} loaded', verbose=2)
         
         for node, thread in self.threads:
             thread.start()
-            print(f'{node.name} started', verbose=1)
+            log(f'{node.name} started', verbose=1)
 
-        server_thread = None
         if get_arg(self.args, 'server', False):
-            self.server_threads = []
-            server_thread = threading.Thread(target=self._server, daemon=True)
-            server_thread.start()
+            self.start_server(get_arg(self.args, 'ip'), get_arg(self.args, 'port'))
+
+        for address in get_arg(self.args, 'connect', None) or ():
+            ip, port = address.rsplit(':', 1)
+            self.connect(ip, int(port))
         
         for node, thread in self.threads:
             thread.join()
-            print(f'{node.name} joined', verbose=1)
+            log(f'{node.name} joined', verbose=1)
+
+        # non-blocking loops outlive the node threads on the timer thread
+        for node, thread in self.threads:
+            node.wait_periodic_tasks()
         
         self._close_event.set()
+
+        for node, thread in self.threads:
+            if isinstance(node, Process_Node) and not node._close_event.is_set():
+                node.close()
+                log(f'{node.name} process closed', verbose=2)
         
-        if server_thread is not None:
-            print('waiting for server thread to close, this can take up to 30s ...', verbose=1)
-            server_thread.join()
+        self.stop_server()
         
-        print('all threads stopped', verbose=1)
+        log('all threads stopped', verbose=1)
     
-    def _load_external_node(self, node_path, class_name):
+    def declare_topics(self, topics):
+        # properties of the topics section of the config, schemas are compiled once here and checked on every publish
+        for topic, properties in topics.items():
+            properties = properties or {}
+            self.topics[topic] = properties
+            if 'schema' in properties:
+                self.schemas[topic] = compile_schema(properties['schema'])
+            else:
+                self.schemas.pop(topic, None)
+
+            priority = properties.get('priority')
+            deadline = properties.get('deadline')
+            if priority is not None and priority not in PRIORITIES:
+                raise ValueError(f'unknown priority of topic {topic}: {priority}')
+            if deadline is not None and not deadline > 0:
+                raise ValueError(f'deadline of topic {topic} must be positive: {deadline}')
+
+            if priority is not None or deadline is not None:
+                self.topic_lanes[topic] = (self.lanes[priority or NORMAL], deadline)
+            else:
+                self.topic_lanes.pop(topic, None)
+
+    def start_server(self, ip=None, port=None):
+        # without an ip the server does not listen, it only serves the bridges opened by connect
+        self.server = Socket_Server(self, ip, port, get_arg(self.args, 'max buffered', 16 << 20), get_arg(self.args, 'overflow policy', DROP_OLDEST))
+        self.server_thread = threading.Thread(target=self.server.run, daemon=True)
+        self.server_thread.start()
+        return self.server
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.close()
+            self.server_thread.join()
+            self.server = None
+
+    def connect(self, ip, port):
+        # federates with the manager serving at ip : port, topics subscribed on one side are forwarded from the other
+        if self.server is None:
+            self.start_server()
+        return self.server.connect(ip, port)
+
+    def _run_node(self, node):
+        try:
+            node.run()
+        finally:
+            self.run_cpu[node.name] = time.thread_time()
 
-        spec = importlib.util.spec_from_file_location("node", node_path)
+    def _construct_node(self, name, properties):
+        args = properties['args'] if 'args' in properties else None
 
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
+        if properties.get('process', False):
+            return Process_Node(name, self, properties['location'], properties['class name'], args)
 
-        return getattr(module, class_name)
-    
-    def _server(self):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((get_arg(self.args, 'ip'), get_arg(self.args, 'port')))
-
-            s.listen()
-            print("server is listening for connections...", verbose=1)
-            
-            while not self._close_event.is_set():
-                try:
-                    s.settimeout(10)
-                    conn, addr = s.accept()
-
-                    node = Socket_Node(f'socket node {len(self.server_threads)}', self, conn)
-                    thread = threading.Thread(target=node.run, daemon=True)
-                    thread.start()
-                    print(f'{node.name} started', verbose=3)
-                    self.server_threads.append((node, thread))
+        node = self._load_external_node(properties['location'], properties['class name'])
+        return node(name, self, args)
 
-                except socket.timeout:
-                    pass
-            
-            for node, thread in self.server_threads:
-                node.close()
-                print(f'{node.name} closed', verbose=2)
-                thread.join()
-                print(f'{node.name} joined', verbose=1)
-            
-        
+    def _load_external_node(self, node_path, class_name):
+        return _load_node_class(node_path, class_name)
+    
     def close_all_nodes(self):
 
         self._close_event.set()
 
         with self.lock:
-            self.subscriptions = []
+            subscriptions = [s for subscriptions in self.subscriptions.values() for s in subscriptions]
+            self.subscriptions = {}
+            self.topic_trie = Topic_Trie()
+            self._resolved = {}
+        
+        for subscription in subscriptions:
+            subscription.close()
+
+        with self.lock:
+            services = list(self.services.values())
+            self.services = {}
+
+        for service in services:
+            service.close()
         
         for node, thread in self.threads:
             node.close()
-            print(f'{node.name} closed', verbose=2)
+            log(f'{node.name} closed', verbose=2)
+
+        # loops on the timer thread would only notice the close on their next deadline
+        for node, thread in self.threads:
+            for task in list(node.periodic_tasks):
+                self.timer.cancel(task)
+            node.wait_periodic_tasks()
     
-    def publish(self, topic, message):
-        execute = []
-        with self.lock:
-            if topic in self.subscriptions:
-                for subscriber, callback_function in self.subscriptions[topic]:
-                    execute.append((subscriber, callback_function))
+    def publish(self, topic, message, delivery=None, deadline=None):
+        # deadline in seconds overrides the one of the topic for this message
+        schema = self.schemas.get(topic)
+        if schema is not None:
+            schema.validate(topic, message)
+
+        # subscriptions are immutable tuples swapped by (un)subscribe, no lock needed here
+        execute = self._resolved.get(topic)
+        if execute is None:
+            execute = self._resolve(topic)
+
+        stats = self.topic_stats.get(topic)
+        if stats is None:
+            if len(self.topic_stats) >= MAX_CACHED_TOPICS:
+                self._forget_topic_stats()
+            stats = self.topic_stats.setdefault(topic, Topic_Stats())
+        stats.record()
         
-        for s, e in execute:
-            print(f'publishing... topic: {topic}, subscriber: {s.name}, message: {str(message) if len(str(message)) < 32 else "too long"}', verbose=3)
-            e(topic, copy.copy(message))
+        if len(execute) == 0:
+            return
+
+        stamp = None
+        lane = self.topic_lanes.get(topic)
+        if lane is not None or deadline is not None:
+            lane, topic_deadline = lane or (self.lanes[NORMAL], None)
+            deadline = deadline if deadline is not None else topic_deadline
+            published = time.monotonic()
+            stamp = (lane, published, published + deadline if deadline is not None else None)
+
+        if delivery is None:
+            delivery = self.topics.get(topic, _EMPTY_MAPPING).get('delivery', COPY)
+
+        # shared hands every subscriber a read-only view of an array, the publisher's own array stays writable and
+        # writable() gives a subscriber its private copy, any other message is shared as it is and must not be modified
+        if delivery == SHARED:
+            message = _read_only_view(message)
+        else:
+            assert delivery in (COPY, DEEP_COPY), f'unknown delivery mode: {delivery}'
+
+        if logger.isEnabledFor(TRACE):
+            text = str(message)
+            text = text if len(text) < 32 else "too long"
+            for s in execute:
+                log(f'publishing... topic: {topic}, subscriber: {s.subscriber.name}, delivery: {delivery}, message: {text}', verbose=3)
+
+        for s in execute:
+            if delivery == COPY:
+                s.deliver(topic, copy.copy(message), stamp)
+            elif delivery == DEEP_COPY:
+                s.deliver(topic, copy.deepcopy(message), stamp)
+            else:
+                s.deliver(topic, message, stamp)
+
+    def _resolve(self, topic):
+        # exact and pattern subscribers of a concrete topic, cached until a subscription changes
+        with self.lock:
+            execute = self.subscriptions.get(topic, ())
+            for pattern in self.topic_trie.match(topic):
+                if pattern != topic:
+                    execute += self.subscriptions.get(pattern, ())
+            # cleared rather than growing with every topic a pattern ever matched
+            if len(self._resolved) >= MAX_CACHED_TOPICS:
+                self._resolved = {}
+            self._resolved[topic] = execute
+            return execute
+
+    def _forget_topic_stats(self):
+        # keeps the half of the topics published most recently, the dict is swapped so readers never see it change size
+        with self.lock:
+            recent = sorted(self.topic_stats.items(), key=lambda item: item[1].last or 0.0, reverse=True)
+            self.topic_stats = dict(recent[:MAX_CACHED_TOPICS // 2])
+
+    def _invalidate(self, topic):
+        # called with the lock held
+        if is_pattern(topic):
+            self._resolved = {}
+        else:
+            self._resolved.pop(topic, None)
+
+    def subscribe(self, topic, callback_function, subscriber, asynchronous=False, queue_size=10, overflow_policy=DROP_OLDEST, conflate=None,
+                  batch_size=None, batch_timeout=None, stack=False, workers=None, worker_type=THREADS, result_callback=None, ordered=True):
+        if conflate is None:
+            conflate = self.topics.get(topic, _EMPTY_MAPPING).get('conflate', False)
+
+        if workers is not None:
+            subscription = Pool_Subscription(topic, callback_function, subscriber, workers, worker_type, result_callback, ordered, queue_size, overflow_policy)
+        elif batch_size is not None or batch_timeout is not None:
+            subscription = Batch_Subscription(topic, callback_function, subscriber, batch_size, batch_timeout, stack, queue_size, overflow_policy)
+        elif conflate:
+            subscription = Latest_Subscription(topic, callback_function, subscriber)
+        elif asynchronous:
+            subscription = Async_Subscription(topic, callback_function, subscriber, queue_size, overflow_policy)
+        else:
+            subscription = Subscription(topic, callback_function, subscriber)
 
-    def subscribe(self, topic, callback_function, subscriber):
+        self._add_subscription(subscription)
+
+    def _add_subscription(self, subscription):
+        topic, subscriber = subscription.topic, subscription.subscriber
         with self.lock:
-            if topic not in self.subscriptions:
-                self.subscriptions[topic] = []
-            self.subscriptions[topic].append((subscriber, callback_function))
-            print(f'subscribed {subscriber.name} to {topic}', verbose=3)
+            if is_pattern(topic) and topic not in self.subscriptions:
+                self.topic_trie.add(topic)
+            self.subscriptions[topic] = self.subscriptions.get(topic, ()) + (subscription,)
+            self._invalidate(topic)
+            log(f'subscribed {subscriber.name} to {topic}', verbose=3)
+
+        self._interest_changed(topic, subscriber)
 
     def unsubscribe(self, topic, subscriber):
+        removed = ()
         with self.lock:
             if topic in self.subscriptions:
-                self.subscriptions[topic] = [x for x in self.subscriptions[topic] if x[0] != subscriber]
-            print(f'ussubscribed {subscriber.name} to {topic}', verbose=3)
+                removed = tuple(x for x in self.subscriptions[topic] if x.subscriber == subscriber)
+                remaining = tuple(x for x in self.subscriptions[topic] if x.subscriber != subscriber)
+                if len(remaining) == 0:
+                    del self.subscriptions[topic]
+                    if is_pattern(topic):
+                        self.topic_trie.remove(topic)
+                else:
+                    self.subscriptions[topic] = remaining
+                self._invalidate(topic)
+            log(f'ussubscribed {subscriber.name} to {topic}', verbose=3)
+        
+        for subscription in removed:
+            subscription.close()
+            self.retired_callback_cpu[subscription.subscriber.name] += subscription.cpu_time
+
+        self._interest_changed(topic, subscriber)
+
+    def provide_service(self, name, handler, provider, workers=4):
+        # handler(name, request) returns the response, concurrent calls are served by workers threads
+        self._add_service(Service(name, handler, provider, workers))
+
+    def _add_service(self, service):
+        with self.lock:
+            if service.name in self.services:
+                service.close()
+                raise ValueError(f'service {service.name} is already provided by {self.services[service.name].provider.name}')
+            self.services[service.name] = service
+        log(f'{service.provider.name} provides service {service.name}', verbose=2)
+
+        server = self.server
+        if server is not None:
+            server.services_changed()
+
+    def remove_service(self, name, provider):
+        with self.lock:
+            service = self.services.get(name)
+            if service is None or service.provider is not provider:
+                return
+            del self.services[name]
+
+        service.close()
+        server = self.server
+        if server is not None:
+            server.services_changed()
+
+    def call(self, name, request, timeout=None):
+        # returns a future, a service of this manager gets the request itself, otherwise it goes to a federated manager
+        # providing it, failures like an unknown service fail the future, as they do in process nodes and clients
+        future = futures.Future()
+
+        service = self.services.get(name)
+        if service is not None:
+            service.call(request, future)
+        else:
+            server = self.server
+            peer = server.service_provider(name) if server is not None else None
+            if peer is None:
+                _settle(future, exception=LookupError(f'no service called {name}'))
+                return future
+            peer.call(name, request, future)
+
+        if timeout is not None and not future.done():
+            self.timer.add(_Call_Timeout(future, name, timeout))
+        return future
+
+    def _interest_changed(self, topic, subscriber):
+        # federated managers only get the topics someone here subscribed to, the server tells them itself about its relays
+        server = self.server
+        if server is not None and subscriber is not server.relay_node:
+            server.interest_changed(topic)
     
     def get_nodes(self):
         for node, thread in self.threads:
-            print(f'{node.name} is {"running" if thread.is_alive() else "closed" if node._close_event.is_set() else "standby"}')
+            log(f'{node.name} is {"running" if thread.is_alive() else "closed" if node._close_event.is_set() else "standby"}')
     
     def get_topics(self):
-        for topic in self.subscriptions:
-            print(f'topic: {topic}')
-            for subscriber, callback_function in self.subscriptions[topic]:
-                print(f' - {subscriber.name}')
+        for topic, subscriptions in list(self.subscriptions.items()):
+            log(f'topic: {topic}')
+            for subscription in subscriptions:
+                if isinstance(subscription, Async_Subscription):
+                    log(f' - {subscription.subscriber.name} (queue: {len(subscription.queue)}/{subscription.queue_size}, dropped: {subscription.dropped})')
+                elif isinstance(subscription, Pool_Subscription):
+                    log(f' - {subscription.subscriber.name} ({subscription.workers} {subscription.worker_type}, in flight: {len(subscription.pending)}/{subscription.queue_size}, dropped: {subscription.dropped})')
+                else:
+                    log(f' - {subscription.subscriber.name}')
+
+    def stats(self):
+        topics = {}
+        for topic in set(self.topic_stats) | set(self.subscriptions):
+            stats = self.topic_stats.get(topic, Topic_Stats())
+            topics[topic] = {
+                'published': stats.published,
+                'rate': stats.rate(),
+                'subscribers': {s.subscriber.name: s.stats() for s in self.subscriptions.get(topic, ())},
+            }
+
+        nodes = {}
+        for node, thread in self.threads:
+            run_cpu = _thread_cpu_time(thread)
+            if run_cpu is None:
+                run_cpu = self.run_cpu.get(node.name)
+            # ticks of non-blocking loops run on the timer thread, they are charged to the node of the loop
+            loop_cpu = sum(task.cpu_time for task in list(node.periodic_tasks) if task.scheduled)
+            if loop_cpu:
+                run_cpu = (run_cpu or 0.0) + loop_cpu
+            nodes[node.name] = {'run cpu': run_cpu, 'callback cpu': 0.0}
+            if node.periodic_tasks:
+                nodes[node.name]['loops'] = [task.stats() for task in node.periodic_tasks]
+
+        for subscriptions in list(self.subscriptions.values()):
+            for subscription in subscriptions:
+                node = nodes.setdefault(subscription.subscriber.name, {'run cpu': None, 'callback cpu': 0.0})
+                node['callback cpu'] += subscription.cpu_time
+
+        for name, cpu_time in self.retired_callback_cpu.items():
+            nodes.setdefault(name, {'run cpu': None, 'callback cpu': 0.0})['callback cpu'] += cpu_time
+
+        snapshot = {'time': time.monotonic(), 'topics': topics, 'nodes': nodes, 'lanes': {priority: lane.stats() for priority, lane in self.lanes.items()}}
+
+        server = getattr(self, 'server', None)
+        if server is not None:
+            snapshot['connections'] = {node.name: {'buffered': node.buffered, 'queued frames': len(node.outbound), 'dropped': node.dropped, 'expired': node.expired} for node in list(server.connections)}
+            snapshot['socket lanes'] = {priority: lane.stats() for priority, lane in server.lanes.items()}
+            snapshot['forwarded'] = {'queued': len(server.forwarded), 'dropped': server.forward_dropped}
+
+        display_server = _display_server
+        if display_server is not None:
+            snapshot['displays'] = display_server.stats()
+
+        if self.services:
+            snapshot['services'] = {name: service.stats() for name, service in list(self.services.items())}
+
+        return snapshot
+
+    def get_stats(self):
+        snapshot = self.stats()
+
+        for topic, stats in sorted(snapshot['topics'].items()):
+            log(f'topic: {topic}, published: {stats["published"]}, rate: {stats["rate"]:.1f}/s')
+            for name, s in stats['subscribers'].items():
+                d = s['duration']
+                queue = f', queue: {s["queue depth"]}' if 'queue depth' in s else ''
+                expired = f', expired: {s["expired"]}' if s['expired'] else ''
+                log(f' - {name}: delivered: {d["count"]}, p50: {_format_duration(d["p50"])}, p95: {_format_duration(d["p95"])}, p99: {_format_duration(d["p99"])}, max: {_format_duration(d["max"])}{queue}, dropped: {s["dropped"]}{expired}')
+                if 'workers' in s:
+                    log(f'   {s["workers"]} workers: received: {s["received rate"]:.1f}/s, processed: {s["processed rate"]:.1f}/s, emitted: {s["emitted rate"]:.1f}/s, in flight: {s["in flight"]}, reorder: {s["reorder depth"]} (max {s["max reorder depth"]})')
+
+        for name, stats in sorted(snapshot['nodes'].items()):
+            log(f'node: {name}, run cpu: {_format_duration(stats["run cpu"])}, callback cpu: {_format_duration(stats["callback cpu"])}')
+            for loop in stats.get('loops', ()):
+                log(f' - loop every {_format_duration(loop["period"])}: ticks: {loop["ticks"]}, overruns: {loop["overruns"]}, cpu: {_format_duration(loop["cpu"])}')
+
+        # only lanes some stamped message went through
+        for kind in ('lanes', 'socket lanes'):
+            for priority, stats in snapshot.get(kind, {}).items():
+                d = stats['latency']
+                if d['count'] or stats['expired']:
+                    log(f'{kind[:-1]}: {priority}, delivered: {d["count"]}, p50: {_format_duration(d["p50"])}, p99: {_format_duration(d["p99"])}, max: {_format_duration(d["max"])}, expired: {stats["expired"]}')
+
+        for name, stats in snapshot.get('connections', {}).items():
+            log(f'{name}: buffered: {stats["buffered"]} bytes in {stats["queued frames"]} frames, dropped: {stats["dropped"]}, expired: {stats["expired"]}')
+
+        if 'forwarded' in snapshot:
+            log(f'forwarded from federated managers: queued: {snapshot["forwarded"]["queued"]}, dropped: {snapshot["forwarded"]["dropped"]}')
+
+        for name, stats in snapshot.get('displays', {}).items():
+            log(f'display: {name}, rendered: {stats["rendered"]}, fps: {stats["fps"]:.1f}, dropped: {stats["dropped"]}')
+
+        for name, stats in snapshot.get('services', {}).items():
+            d = stats['duration']
+            log(f'service: {name} of {stats["provider"]}, calls: {stats["calls"]}, failures: {stats["failures"]}, pending: {stats["pending"]}, p50: {_format_duration(d["p50"])}, p99: {_format_duration(d["p99"])}')
+
+
+class Subscription:
+
+    def __init__(self, topic, callback_function, subscriber):
+        self.topic = topic
+        self.callback_function = callback_function
+        self.subscriber = subscriber
+        self.dropped = 0
+        self.expired = 0
+
+        self.durations = Histogram()
+        self.cpu_time = 0.0
+
+    def deliver(self, topic, message, stamp=None):
+        if stamp is None or _fresh(stamp, self):
+            self._call(topic, message)
+
+    def _call(self, topic, message, *args):
+        t = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            self.callback_function(topic, message, *args)
+        finally:
+            self.cpu_time += time.thread_time() - cpu
+            self.durations.record(time.perf_counter() - t)
+
+    def stats(self):
+        return {'duration': self.durations.snapshot(), 'cpu': self.cpu_time, 'dropped': self.dropped, 'expired': self.expired}
+
+    def close(self):
+        pass
+
+
+class Async_Subscription(Subscription):
+
+    def __init__(self, topic, callback_function, subscriber, queue_size=10, overflow_policy=DROP_OLDEST):
+        super().__init__(topic, callback_function, subscriber)
+
+        assert queue_size > 0, 'queue size must be at least 1'
+        assert overflow_policy in (DROP_OLDEST, DROP_NEWEST, BLOCK), f'unknown overflow policy: {overflow_policy}'
+
+        self._close_event = threading.Event()
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+
+        self.queue = collections.deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+        self.thread = threading.Thread(target=self._deliver_worker, daemon=True)
+        self.thread.start()
+
+    def deliver(self, topic, message, stamp=None):
+        with self.lock:
+            if len(self.queue) >= self.queue_size:
+
+                if self.overflow_policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return
+
+                elif self.overflow_policy == DROP_OLDEST:
+                    self.queue.popleft()
+                    self.dropped += 1
+
+                elif self.overflow_policy == BLOCK:
+                    while len(self.queue) >= self.queue_size and not self._close_event.is_set():
+                        self.not_full.wait()
+
+            if self._close_event.is_set():
+                return
+
+            self.queue.append((topic, message, stamp))
+            self.not_empty.notify()
+
+    def _deliver_worker(self):
+        while True:
+            with self.lock:
+                while len(self.queue) == 0 and not self._close_event.is_set():
+                    self.not_empty.wait()
+
+                if self._close_event.is_set():
+                    return
+
+                topic, message, stamp = self.queue.popleft()
+                self.not_full.notify()
+
+            # the deadline is checked when the message leaves the queue, where it waited
+            if stamp is not None and not _fresh(stamp, self):
+                continue
+
+            try:
+                self._call(topic, message)
+            except Exception as e:
+                self.subscriber.logger.error('callback on %s raised %r', topic, e)
+
+    def stats(self):
+        stats = super().stats()
+        stats['queue depth'] = len(self.queue)
+        return stats
+
+    def close(self):
+        with self.lock:
+            self._close_event.set()
+            self.queue.clear()
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+class Batch_Subscription(Async_Subscription):
+
+    # hands the callback a list of up to batch_size messages, or whatever arrived within batch_timeout seconds
+    # of the first one, split by topic for a pattern, stack turns a batch of equally shaped arrays into a single array
+
+    def __init__(self, topic, callback_function, subscriber, batch_size=None, batch_timeout=None, stack=False, queue_size=10, overflow_policy=DROP_OLDEST):
+        assert batch_size is not None or batch_timeout is not None, 'a batch needs a size or a timeout'
+        assert batch_size is None or batch_size > 0, 'batch size must be at least 1'
+
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.stack = stack
+        self.batches = 0
+
+        # a batch of whatever arrived within the timeout takes them all, so without a size the queue is unbounded
+        if batch_size is not None:
+            queue_size = max(queue_size, 2 * batch_size)
+        else:
+            queue_size = float('inf')
+        super().__init__(topic, callback_function, subscriber, queue_size, overflow_policy)
+
+    def _deliver_worker(self):
+        while True:
+            with self.lock:
+                while len(self.queue) == 0 and not self._close_event.is_set():
+                    self.not_empty.wait()
+
+                if self._close_event.is_set():
+                    return
+
+                if self.batch_timeout is not None:
+                    deadline = time.monotonic() + self.batch_timeout
+                    while (self.batch_size is None or len(self.queue) < self.batch_size) and not self._close_event.is_set():
+                        wait = deadline - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self.not_empty.wait(wait)
+
+                n = len(self.queue) if self.batch_size is None else min(self.batch_size, len(self.queue))
+                batch = [self.queue.popleft() for _ in range(n)]
+                self.not_full.notify_all()
+
+            # a pattern subscription gets one batch per concrete topic, in the order the topics first arrived
+            groups = {}
+            for topic, message, stamp in batch:
+                if stamp is None or _fresh(stamp, self):
+                    groups.setdefault(topic, []).append(message)
+
+            for topic, messages in groups.items():
+                self.batches += 1
+                try:
+                    # arrays of different shapes or dtypes are handed over as the list they came in
+                    if self.stack and all(_is_ndarray(message) for message in messages) and \
+                            len(set((message.shape, message.dtype) for message in messages)) == 1:
+                        messages = np.stack(messages)
+                    self._call(topic, messages)
+                except Exception as e:
+                    self.subscriber.logger.error('callback on %s raised %r', topic, e)
+
+    def stats(self):
+        stats = super().stats()
+        stats['batches'] = self.batches
+        return stats
+
+
+class Latest_Subscription(Async_Subscription):
+
+    # conflating subscription, a new message overwrites the undelivered one so the callback only sees the newest
+
+    def __init__(self, topic, callback_function, subscriber):
+        super().__init__(topic, callback_function, subscriber, queue_size=1, overflow_policy=DROP_OLDEST)
+
+    def deliver(self, topic, message, stamp=None):
+        with self.lock:
+            if self._close_event.is_set():
+                return
+            if self.queue:
+                self.queue[0] = (topic, message, stamp)
+                self.dropped += 1
+            else:
+                self.queue.append((topic, message, stamp))
+                self.not_empty.notify()
+
+
+class _Relay_Subscription(Subscription):
+
+    # the socket server's subscription, the stamp goes along so frames keep the lane and deadline of their message
+
+    def __init__(self, topic, server):
+        super().__init__(topic, functools.partial(server._relay, subscription=topic), server.relay_node)
+
+    def deliver(self, topic, message, stamp=None):
+        if stamp is not None and stamp[2] is not None and time.monotonic() > stamp[2]:
+            stamp[0].expired += 1
+            self.expired += 1
+            return
+        self._call(topic, message, stamp)
+
+
+class Service:
+
+    # a handler served by a pool of worker threads, in-process callers get the response object itself, nothing is copied
+
+    def __init__(self, name, handler, provider, workers=4):
+        assert workers > 0, 'a service needs at least 1 worker'
+
+        self.name = name
+        self.handler = handler
+        self.provider = provider
+        self.workers = workers
+        self.executor = futures.ThreadPoolExecutor(workers, thread_name_prefix=f'{provider.name}-{name}')
+
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.calls = 0
+        self.failures = 0
+        self.durations = Histogram()
+
+    def call(self, request, future):
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._forget)
+        try:
+            self.executor.submit(self._serve, request, future)
+        except RuntimeError as e:
+            _settle(future, exception=e)
+
+    def _forget(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def _serve(self, request, future):
+        # a call that timed out or was cancelled while queued is not served anymore
+        if future.done():
+            return
+
+        t = time.perf_counter()
+        try:
+            ok, value = True, self.handler(self.name, request)
+        except Exception as e:
+            ok, value = False, e
+
+        # counted before the caller can see the outcome
+        with self.lock:
+            self.durations.record(time.perf_counter() - t)
+            self.calls += 1
+            self.failures += not ok
+
+        _settle_outcome(future, ok, value)
+
+    def stats(self):
+        return {'provider': self.provider.name, 'workers': self.workers, 'calls': self.calls, 'failures': self.failures,
+                'pending': len(self.pending), 'duration': self.durations.snapshot()}
+
+    def close(self):
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            _settle(future, exception=RuntimeError(f'service {self.name} closed'))
+
+        # a handler closing its own service cannot wait for itself
+        wait = threading.current_thread() not in getattr(self.executor, '_threads', ())
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class _Process_Service:
+
+    # stands in for a service of a process node, its calls go over the pipe and are served in the child
+
+    def __init__(self, name, provider, workers=4):
+        self.name = name
+        self.provider = provider
+        self.workers = workers
+        self.calls = 0
+        self.failures = 0
+        self.durations = Histogram()
+
+    def call(self, request, future):
+        t = time.perf_counter()
+        future.add_done_callback(functools.partial(self._done, t))
+        self.provider._call_child(self.name, request, future)
+
+    def _done(self, t, future):
+        self.durations.record(time.perf_counter() - t)
+        self.calls += 1
+        self.failures += not _outcome(future)[0]
+
+    def stats(self):
+        return {'provider': self.provider.name, 'workers': self.workers, 'calls': self.calls, 'failures': self.failures,
+                'pending': len(self.provider.pending_calls), 'duration': self.durations.snapshot()}
+
+    def close(self):
+        pass
+
+
+def _send_outcome(send, kind, call_id, future):
+    # answers a call that came over a pipe
+    ok, value = _outcome(future)
+    try:
+        send((kind, call_id, ok, value))
+    except Exception as e:
+        # the response or the exception does not pickle
+        send((kind, call_id, False, RuntimeError(f'{type(e).__name__}: {e}')))
+
+
+def _settle_outcome(future, ok, value):
+    if ok:
+        _settle(future, value)
+    else:
+        _settle(future, exception=value)
+
+
+class _Call_Timeout:
+
+    # a one shot timer task, fails a call that has not been answered by its deadline, it lets go of the future as soon
+    # as the call is done, the response is not kept alive by the timer until the deadline
+
+    def __init__(self, future, name, timeout):
+        self.future = future
+        self.name = name
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future):
+        self.future = None
+
+    def tick(self):
+        future = self.future
+        if future is not None and not future.done():
+            _settle(future, exception=TimeoutError(f'call to {self.name} timed out after {self.timeout}s'))
+        return None
+
+    def finish(self):
+        return None
+
+
+def _pool_call(callback_function, topic, message, expires=None):
+    # runs on a pool worker, thread or process, the timing travels back with the result, a message past its
+    # deadline is not worked on and comes back without a duration
+    started = time.monotonic()
+    if expires is not None and started > expires:
+        return None, None, None, started
+    t = time.perf_counter()
+    cpu = time.thread_time()
+    result = callback_function(topic, message)
+    return result, time.perf_counter() - t, time.thread_time() - cpu, started
+
+
+class Pool_Subscription(Subscription):
+
+    # runs the callback on a pool of workers, threads for callbacks that release the GIL like most of OpenCV and numpy,
+    # processes otherwise (the callback and messages are then pickled, so a process pool needs a module level function,
+    # not a lambda, closure or method of a node), whatever the callback returns is handed to result_callback in the
+    # order the messages arrived, a callback returning None hands over nothing
+
+    def __init__(self, topic, callback_function, subscriber, workers=4, worker_type=THREADS, result_callback=None, ordered=True, queue_size=10, overflow_policy=DROP_OLDEST):
+        super().__init__(topic, callback_function, subscriber)
+
+        assert workers > 0, 'a pool needs at least 1 worker'
+        assert worker_type in (THREADS, PROCESSES), f'unknown worker type: {worker_type}'
+        assert overflow_policy in (DROP_OLDEST, DROP_NEWEST, BLOCK), f'unknown overflow policy: {overflow_policy}'
+
+        # fails here rather than on every message in the workers
+        if worker_type == PROCESSES:
+            try:
+                pickle.dumps(callback_function)
+            except Exception as e:
+                raise TypeError(f'the callback of a process pool on {topic} does not pickle, use a module level function: {e!r}') from e
+
+        self.workers = workers
+        self.worker_type = worker_type
+        self.result_callback = result_callback
+        self.ordered = ordered
+        self.overflow_policy = overflow_policy
+
+        # messages in flight are queued or being worked on, at least one per worker to keep them all busy
+        self.queue_size = max(queue_size, workers)
+
+        if worker_type == THREADS:
+            self.executor = futures.ThreadPoolExecutor(workers, thread_name_prefix=f'{subscriber.name}-pool')
+        else:
+            self.executor = futures.ProcessPoolExecutor(workers, mp_context=_process_context())
+
+        self._closed = False
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        # held while results are handed over so they go out one at a time and in order
+        self.emit_lock = threading.Lock()
+
+        self.pending = collections.OrderedDict()
+        self.reorder = {}
+        self.next_sequence = 0
+        self.next_emit = 0
+        self.max_reorder_depth = 0
+
+        self.received = Topic_Stats()
+        self.processed = Topic_Stats()
+        self.emitted = Topic_Stats()
+
+    def deliver(self, topic, message, stamp=None):
+        with self.lock:
+            self.received.record()
+
+            if len(self.pending) >= self.queue_size:
+
+                if self.overflow_policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return
+
+                elif self.overflow_policy == DROP_OLDEST:
+                    # only messages no worker picked up yet can be dropped, the gap is skipped when re-sequencing
+                    for sequence, future in self.pending.items():
+                        if future.cancel():
+                            del self.pending[sequence]
+                            if self.ordered:
+                                self.reorder[sequence] = None
+                            self.dropped += 1
+                            break
+                    else:
+                        self.dropped += 1
+                        return
+
+                elif self.overflow_policy == BLOCK:
+                    while len(self.pending) >= self.queue_size and not self._closed:
+                        self.not_full.wait()
+
+            if self._closed:
+                return
+
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            future = self.executor.submit(_pool_call, self.callback_function, topic, message, stamp[2] if stamp is not None else None)
+            self.pending[sequence] = future
+
+        future.add_done_callback(functools.partial(self._done, sequence, topic, stamp))
+
+    def _done(self, sequence, topic, stamp, future):
+        # cancelled futures are dropped in deliver, which still holds the lock when this gets called
+        if future.cancelled():
+            return
+
+        try:
+            result, duration, cpu, started = future.result()
+        except Exception as e:
+            self.subscriber.logger.error('callback on %s raised %r', topic, e)
+            result = None
+        else:
+            with self.lock:
+                if duration is None:
+                    self.expired += 1
+                    stamp[0].expired += 1
+                else:
+                    self.durations.record(duration)
+                    self.cpu_time += cpu
+                    self.processed.record()
+                    if stamp is not None:
+                        stamp[0].latency.record(started - stamp[1])
+
+        if not self.ordered:
+            with self.lock:
+                self.pending.pop(sequence, None)
+                self.not_full.notify()
+            self._emit(topic, result)
+            return
+
+        with self.emit_lock:
+            with self.lock:
+                self.pending.pop(sequence, None)
+                self.not_full.notify()
+
+                self.reorder[sequence] = (topic, result)
+
+                ready = []
+                while self.next_emit in self.reorder:
+                    ready.append(self.reorder.pop(self.next_emit))
+                    self.next_emit += 1
+
+                # what is left waits for an earlier message still on a worker
+                self.max_reorder_depth = max(self.max_reorder_depth, len(self.reorder))
+
+            for item in ready:
+                if item is not None:
+                    self._emit(*item)
+
+    def _emit(self, topic, result):
+        if result is None or self.result_callback is None or self._closed:
+            return
+        self.emitted.record()
+        try:
+            self.result_callback(topic, result)
+        except Exception as e:
+            self.subscriber.logger.error('result callback on %s raised %r', topic, e)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            'workers': self.workers,
+            'in flight': len(self.pending),
+            'reorder depth': len(self.reorder),
+            'max reorder depth': self.max_reorder_depth,
+            'received rate': self.received.rate(),
+            'processed rate': self.processed.rate(),
+            'emitted rate': self.emitted.rate(),
+        })
+        return stats
+
+    def close(self):
+        with self.lock:
+            self._closed = True
+            self.not_full.notify_all()
+
+        # a worker closing its own pool cannot wait for itself
+        wait = threading.current_thread() not in getattr(self.executor, '_threads', ())
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class Periodic_Task:
+
+    # calls loop_event of a node on deadlines of a monotonic clock, start + n * period, so it does not drift
+
+    def __init__(self, node, items, period, overrun_policy=SKIP):
+        assert period > 0, 'period must be positive'
+        assert overrun_policy in (SKIP, CATCH_UP), f'unknown overrun policy: {overrun_policy}'
+
+        self.node = node
+        self.items = items
+        self.period = period
+        self.overrun_policy = overrun_policy
+
+        self.deadline = time.monotonic()
+        self.ticks = 0
+        self.overruns = 0
+        self.done = threading.Event()
+
+        # set for loops on the timer thread, its cpu time then is not part of the node thread
+        self.scheduled = False
+        self.cpu_time = 0.0
+
+    def tick(self):
+        # runs one event, returns the next deadline or None when the loop is over
+        if self.node._close_event.is_set():
+            return self.finish()
+
+        try:
+            item = next(self.items)
+        except StopIteration:
+            return self.finish()
+
+        start = time.thread_time()
+        try:
+            self.node.loop_event(item)
+        except BaseException:
+            self.finish()
+            raise
+        finally:
+            self.cpu_time += time.thread_time() - start
+        self.ticks += 1
+
+        if self.node._close_event.is_set():
+            return self.finish()
+
+        self.deadline += self.period
+        late = time.monotonic() - self.deadline
+        if late > 0:
+            if self.overrun_policy == SKIP:
+                missed = int(late // self.period) + 1
+                self.overruns += missed
+                self.deadline += missed * self.period
+            else:
+                self.overruns += 1
+
+        return self.deadline
+
+    def finish(self):
+        self.done.set()
+        return None
+
+    def stats(self):
+        return {'ticks': self.ticks, 'overruns': self.overruns, 'period': self.period, 'cpu': self.cpu_time}
+
+
+class Timer_Scheduler:
+
+    # a single thread that drives every non-blocking periodic loop, started on first use
+
+    def __init__(self):
+        self.tasks = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self._counter = itertools.count()
+
+    def add(self, task):
+        with self.condition:
+            heapq.heappush(self.tasks, (task.deadline, next(self._counter), task))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def cancel(self, task):
+        with self.condition:
+            self.tasks = [entry for entry in self.tasks if entry[2] is not task]
+            heapq.heapify(self.tasks)
+        task.finish()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    # nothing left to drive, the thread stops and add starts a new one
+                    if not self.tasks:
+                        self.thread = None
+                        return
+                    wait = self.tasks[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+
+                _, _, task = heapq.heappop(self.tasks)
+
+            try:
+                deadline = task.tick()
+            except Exception as e:
+                task.node.logger.error('loop raised %r', e)
+                continue
+
+            if deadline is not None:
+                with self.condition:
+                    heapq.heappush(self.tasks, (deadline, next(self._counter), task))
 
 
 class Node:
 
+    # set by nodes that fork a process in __init__, the manager then constructs them before any other node
+    starts_processes = False
+
     def __init__(self, name, mgr, args=None):
         self._close_event = threading.Event()
         self.name = name
         self.mgr = mgr
         self.args = args
+        self.periodic_tasks = []
+        self.logger = logger.getChild(name)
     
-    def loop(self, for_loop_count=None, for_loop_in=None, while_loop_condition=None):
+    def loop(self, for_loop_count=None, for_loop_in=None, while_loop_condition=None, rate=None, period=None, overrun_policy=SKIP, block=True):
 
         assert int(for_loop_count is None) + int(for_loop_in is None) + int(while_loop_condition is None) >= 2, 'cannot set 2 loop condition simultaneously'
+        assert rate is None or period is None, 'cannot set both rate and period'
+
+        if rate is not None:
+            period = 1 / rate
+
+        if period is not None:
+            return self._loop_periodic(for_loop_count, for_loop_in, while_loop_condition, period, overrun_policy, block)
 
         if for_loop_count is not None:
             for index in range(for_loop_count):
@@ -197,17 +2052,61 @@ class Node:
                 if self._close_event.is_set():
                     return
 
+    def _loop_periodic(self, for_loop_count, for_loop_in, while_loop_condition, period, overrun_policy, block):
+
+        if for_loop_count is not None:
+            items = iter(range(for_loop_count))
+        elif for_loop_in is not None:
+            items = iter(for_loop_in)
+        else:
+            items = itertools.repeat(None) if while_loop_condition else iter(())
+
+        task = Periodic_Task(self, items, period, overrun_policy)
+        self.periodic_tasks.append(task)
+
+        # non-blocking loops share the timer thread of the manager, run returns and the manager waits for the loop
+        # after joining the node thread
+        if not block:
+            task.scheduled = True
+            self.mgr.timer.add(task)
+            return task
+
+        while True:
+            deadline = task.tick()
+            if deadline is None:
+                return task
+            wait = deadline - time.monotonic()
+            if wait > 0 and self._close_event.wait(wait):
+                task.finish()
+                return task
+
+    def log(self, *args, verbose=1):
+        log(*args, verbose=verbose, logger=self.logger)
+
+    def wait_periodic_tasks(self):
+        for task in list(self.periodic_tasks):
+            task.done.wait()
+
     def loop_event(self, item):
         pass
 
-    def publish(self, topic, message):
-        self.mgr.publish(topic, message)
+    def publish(self, topic, message, **kwargs):
+        self.mgr.publish(topic, message, **kwargs)
     
-    def subscribe(self, topic, callback_function):
-        self.mgr.subscribe(topic, callback_function, self)
+    def subscribe(self, topic, callback_function, **kwargs):
+        self.mgr.subscribe(topic, callback_function, self, **kwargs)
 
     def unsubscribe(self, topic):
         self.mgr.unsubscribe(topic, self)
+
+    def provide_service(self, name, handler, workers=4):
+        self.mgr.provide_service(name, handler, self, workers)
+
+    def remove_service(self, name):
+        self.mgr.remove_service(name, self)
+
+    def call(self, name, request, timeout=None):
+        return self.mgr.call(name, request, timeout)
     
     def before_close(self):
         pass
@@ -216,6 +2115,279 @@ class Node:
         self.before_close()
         self._close_event.set()
 
+        for task in self.periodic_tasks:
+            if not task.done.is_set():
+                self.mgr.timer.cancel(task)
+
+
+class Process_Node(Node):
+
+    # stands in for a node running in its own process, bridges publish/subscribe/logging over a pipe
+
+    def __init__(self, name, mgr, location, class_name, args=None):
+        super().__init__(name, mgr, args)
+        self.location = location
+        self.class_name = class_name
+
+        self.send_lock = threading.Lock()
+        self._run_finished_event = threading.Event()
+
+        # calls the child serves for the rest of the managers
+        self.pending_calls = {}
+        self._call_ids = itertools.count(1)
+
+        self.conn, child_conn = multiprocessing.Pipe()
+        # the child checks its publishes against the same schemas, so a mismatch raises in the node that published
+        schemas = {topic: schema.spec for topic, schema in getattr(mgr, 'schemas', {}).items()}
+        # the child loads the node class from its location, nothing of this process is inherited
+        self.process = _process_context().Process(target=_run_process_node, args=(name, location, class_name, args, child_conn, logger.getEffectiveLevel(), schemas))
+        self.process.start()
+        child_conn.close()
+
+        self.pump_thread = threading.Thread(target=self._pump, daemon=True)
+        self.pump_thread.start()
+
+    def run(self):
+        self._send(('run',))
+        self._run_finished_event.wait()
+
+    def _send(self, request):
+        with self.send_lock:
+            try:
+                self.conn.send(request)
+            except (BrokenPipeError, OSError):
+                pass
+
+    def _forward(self, subscription, topic, message):
+        # the subscribed topic can be a pattern, the child looks its callbacks up by it
+        self._send(('message', subscription, topic, message))
+
+    def _pump(self):
+        while True:
+            try:
+                request = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if request[0] == 'publish':
+                _, topic, message, kwargs = request
+                try:
+                    self.mgr.publish(topic, message, **kwargs)
+                except TypeError as e:
+                    self.logger.error('publish failed: %s', e)
+
+            elif request[0] == 'subscribe':
+                _, topic, kwargs = request
+                self.subscribe(topic, functools.partial(self._forward, topic), **kwargs)
+
+            elif request[0] == 'unsubscribe':
+                self.unsubscribe(request[1])
+
+            elif request[0] == 'call':
+                _, call_id, name, call_request = request
+                future = self.mgr.call(name, call_request)
+                future.add_done_callback(functools.partial(_send_outcome, self._send, 'reply', call_id))
+
+            elif request[0] == 'served':
+                _, call_id, ok, value = request
+                future = self.pending_calls.pop(call_id, None)
+                if future is not None:
+                    _settle_outcome(future, ok, value)
+
+            elif request[0] == 'provide':
+                # the child cannot wait for this, a name that is taken is only logged
+                _, name, workers = request
+                try:
+                    self.mgr._add_service(_Process_Service(name, self, workers))
+                except ValueError as e:
+                    self.logger.error('%s', e)
+
+            elif request[0] == 'remove service':
+                self.mgr.remove_service(request[1], self)
+
+            elif request[0] == 'log':
+                record = request[1]
+                logging.getLogger(record.name).handle(record)
+
+            elif request[0] == 'run finished':
+                self._run_finished_event.set()
+
+        for name, service in list(getattr(self.mgr, 'services', {}).items()):
+            if service.provider is self:
+                self.mgr.remove_service(name, self)
+        for future in list(self.pending_calls.values()):
+            _settle(future, exception=ConnectionError(f'{self.name} exited'))
+
+        self._run_finished_event.set()
+
+    def _call_child(self, name, request, future):
+        call_id = next(self._call_ids)
+        self.pending_calls[call_id] = future
+        future.add_done_callback(lambda future: self.pending_calls.pop(call_id, None))
+        self._send(('serve', call_id, name, request))
+
+    def before_close(self):
+        self._send(('close',))
+        self.process.join()
+        self.conn.close()
+        return super().before_close()
+
+
+class Process_Manager:
+
+    # manager handed to a node inside its own process, everything goes through the Process_Node in the main process
+
+    def __init__(self, conn, level=logging.INFO, schemas=None):
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.subscriptions = {}
+        self.pools = {}
+        self.schemas = {topic: compile_schema(spec) for topic, spec in (schemas or {}).items()}
+
+        # services of this node are served here, calls to any other service go through the main process
+        self.services = {}
+        self.pending_calls = {}
+        self._call_ids = itertools.count(1)
+        self._run_event = threading.Event()
+        self._close_event = threading.Event()
+        self.timer = Timer_Scheduler()
+
+        # records are handled by the loggers of the main process, the queue handler only needs put_nowait
+        logger.handlers = [logging_handlers.QueueHandler(self)]
+        logger.setLevel(level)
+
+    def _send(self, request):
+        with self.send_lock:
+            try:
+                self.conn.send(request)
+            except (BrokenPipeError, OSError):
+                pass
+
+    def put_nowait(self, record):
+        self._send(('log', record))
+
+    def _listen(self, node):
+        while True:
+            try:
+                request = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if request[0] == 'run':
+                self._run_event.set()
+
+            elif request[0] == 'message':
+                _, subscription, topic, message = request
+                for callback_function in self.subscriptions.get(subscription, ()):
+                    # a raising callback must not end this loop, the node would stop receiving messages and calls
+                    try:
+                        callback_function(topic, message)
+                    except Exception as e:
+                        node.logger.error('callback on %s raised %r', topic, e)
+
+            elif request[0] == 'serve':
+                _, call_id, name, call_request = request
+                future = futures.Future()
+                future.add_done_callback(functools.partial(_send_outcome, self._send, 'served', call_id))
+                service = self.services.get(name)
+                if service is None:
+                    _settle(future, exception=LookupError(f'no service called {name}'))
+                else:
+                    service.call(call_request, future)
+
+            elif request[0] == 'reply':
+                _, call_id, ok, value = request
+                future = self.pending_calls.pop(call_id, None)
+                if future is not None:
+                    _settle_outcome(future, ok, value)
+
+            elif request[0] == 'close':
+                node.close()
+                break
+
+        for pools in list(self.pools.values()):
+            for pool in pools:
+                pool.close()
+        for service in list(self.services.values()):
+            service.close()
+        for future in list(self.pending_calls.values()):
+            _settle(future, exception=ConnectionError('main process closed the connection'))
+
+        self._close_event.set()
+        self._run_event.set()
+
+    def publish(self, topic, message, **kwargs):
+        schema = self.schemas.get(topic)
+        if schema is not None:
+            schema.validate(topic, message)
+        self._send(('publish', topic, message, kwargs))
+
+    def subscribe(self, topic, callback_function, subscriber, workers=None, worker_type=THREADS, result_callback=None, ordered=True, **kwargs):
+        if workers is not None:
+            # the pool lives in this process, the main process delivers to it like to any other callback
+            pool = Pool_Subscription(topic, callback_function, subscriber, workers, worker_type, result_callback, ordered,
+                                     kwargs.pop('queue_size', 10), kwargs.pop('overflow_policy', DROP_OLDEST))
+            self.pools[topic] = self.pools.get(topic, ()) + (pool,)
+            callback_function = pool.deliver
+
+        if topic not in self.subscriptions:
+            self._send(('subscribe', topic, kwargs))
+        self.subscriptions[topic] = self.subscriptions.get(topic, ()) + (callback_function,)
+
+    def unsubscribe(self, topic, subscriber):
+        if topic in self.subscriptions:
+            del self.subscriptions[topic]
+            self._send(('unsubscribe', topic))
+        for pool in self.pools.pop(topic, ()):
+            pool.close()
+
+    def provide_service(self, name, handler, provider, workers=4):
+        if name in self.services:
+            raise ValueError(f'service {name} is already provided by {provider.name}')
+        self.services[name] = Service(name, handler, provider, workers)
+        self._send(('provide', name, workers))
+
+    def remove_service(self, name, provider):
+        service = self.services.pop(name, None)
+        if service is not None:
+            service.close()
+            self._send(('remove service', name))
+
+    def call(self, name, request, timeout=None):
+        # an unknown service fails the future instead of raising, only the main process knows them all
+        future = futures.Future()
+
+        service = self.services.get(name)
+        if service is not None:
+            service.call(request, future)
+        else:
+            call_id = next(self._call_ids)
+            self.pending_calls[call_id] = future
+            future.add_done_callback(lambda future: self.pending_calls.pop(call_id, None))
+            self._send(('call', call_id, name, request))
+
+        if timeout is not None and not future.done():
+            self.timer.add(_Call_Timeout(future, name, timeout))
+        return future
+
+
+def _run_process_node(name, location, class_name, args, conn, level=logging.INFO, schemas=None):
+
+    mgr = Process_Manager(conn, level, schemas)
+    node = _load_node_class(location, class_name)(name, mgr, args)
+
+    listen_thread = threading.Thread(target=mgr._listen, args=(node,), daemon=True)
+    listen_thread.start()
+
+    mgr._run_event.wait()
+    if not mgr._close_event.is_set():
+        node.run()
+        node.wait_periodic_tasks()
+        mgr._send(('run finished',))
+
+    listen_thread.join()
+    conn.close()
+
 
 class Client_Manager:
 
@@ -223,6 +2395,19 @@ class Client_Manager:
         self._close_event = threading.Event()
         self.args = args
         self.conn = None
+        self.callbacks = {}
+        self.callback_trie = Topic_Trie()
+
+        self.log_writer = start_logging(get_arg(self.args, 'verbose', 1))
+
+        self.topics = None
+        self._topics_event = threading.Event()
+
+        # calls can come from any thread, a frame has to go out in one piece
+        self.send_lock = threading.Lock()
+        self.pending_calls = {}
+        self._call_ids = itertools.count(1)
+        self.timer = Timer_Scheduler()
     
     def _start(self):
 
@@ -230,7 +2415,7 @@ class Client_Manager:
             conn.connect((get_arg(self.args, 'ip'), get_arg(self.args, 'port')))
             time.sleep(1)
             self.conn = conn
-            print('connection established', verbose=1)
+            log('connection established', verbose=1)
 
             thread_listen = threading.Thread(target=self._listen, daemon=True)
             thread_listen.start()
@@ -240,72 +2425,150 @@ class Client_Manager:
         self.conn = None
 
     def _listen(self):
+        # however listening ends, calls still waiting for their reply fail
+        try:
+            self._receive()
+        finally:
+            for future in list(self.pending_calls.values()):
+                _settle(future, exception=ConnectionError('connection closed'))
+
+    def _receive(self):
+
+        receiver = Frame_Receiver(self.conn)
+        topics = {}
+        schemas = {}
 
         while not self._close_event.is_set():
 
-            message = b''
-            while len(message) == 0 or not message[-len(END_MARKER):] == END_MARKER:
+            try:
+                msg_type, topic_id, payload = receiver.receive()
+            except (ConnectionError, OSError) as e:
+                log(f'connection lost: {e}', verbose=1)
+                break
 
-                packet = self.conn.recv(4096)
+            if msg_type == MSG_CLOSE:
+                break
 
-                if self._close_event.is_set():
-                    return
-                if not packet or len(packet) == 0:
-                    continue
+            if msg_type == MSG_TOPIC:
+                topics[topic_id] = bytes(payload).decode()
+                continue
 
-                message += packet
-            
-            for m in message.split(END_MARKER)[:-1]:
-                if len(m) == 0:
-                    print('something went wrong, message has a length of 0', verbose=1)
-                    continue
+            if msg_type == MSG_REPLY:
+                try:
+                    call_id, ok, value = decode_reply(payload)
+                except (ConnectionError, ValueError, struct.error) as e:
+                    log(f'connection lost: invalid reply: {e!r}', verbose=1)
+                    break
+                future = self.pending_calls.pop(call_id, None)
+                if future is not None and ok:
+                    _settle(future, value)
+                elif future is not None:
+                    _settle(future, exception=RuntimeError(value))
+                continue
+
+            if msg_type == MSG_SCHEMA:
+                # the decoder of a typed topic is picked once, here, not for every message
+                try:
+                    schemas[topic_id] = compile_schema(json.loads(bytes(payload)))
+                except (ValueError, TypeError, KeyError, AttributeError) as e:
+                    log(f'cannot read schema of topic id {topic_id}: {e!r}', verbose=1)
+                continue
 
-                if m[:len(START_MARKER)] != START_MARKER:
-                    print(f'wrong start marker, expected {START_MARKER}, but got {m[0]}, from message {m}', verbose=1)
-                    continue
+            if msg_type == MSG_TOPICS:
+                self.topics = bytes(payload).decode().split('\n') if len(payload) > 0 else []
+                self._topics_event.set()
+                continue
 
-                m = m[len(START_MARKER):]
+            if topic_id not in topics:
+                log(f'received message for unknown topic id {topic_id}', verbose=1)
+                continue
 
-                if m == CLOSE_MARKER:
-                    return
+            topic = topics[topic_id]
 
-                if len(m.split(SPLIT_MARKER)) != 3:
-                    print(f'cannot recognize message {m}')
-                    continue
+            try:
+                if msg_type == MSG_TYPED:
+                    message = schemas[topic_id].decode(payload)
+                else:
+                    message = decode_message(msg_type, payload)
+            except (ValueError, KeyError, struct.error) as e:
+                log(f'cannot decode message on {topic}: {e!r}', verbose=1)
+                continue
+
+            # payload is reused for the next frame, callbacks get their own copy
+            if msg_type in (MSG_NDARRAY, MSG_TYPED) and _is_ndarray(message):
+                message = message.copy()
+
+            callback_functions = self.callbacks.get(topic, ())
+            for pattern in self.callback_trie.match(topic):
+                if pattern != topic:
+                    callback_functions += self.callbacks[pattern]
+
+            if len(callback_functions) == 0:
+                if _is_ndarray(message):
+                    log(f'at {topic}, received array of shape {message.shape} and dtype {message.dtype}', verbose=1)
+                else:
+                    log(f'at {topic}, received {type(message).__name__}: {message if len(str(message)) < 32 else "too long"}', verbose=1)
+                continue
 
-                dtype, topic, data = m.split(SPLIT_MARKER)
-                dtype = dtype.decode()
-                topic = topic.decode()
+            for callback_function in callback_functions:
+                try:
+                    callback_function(topic, message)
+                except Exception as e:
+                    log(f'callback on {topic} raised {e!r}', verbose=1)
 
-                if dtype == 'STR':
-                    print(f'at {topic}, received string: {data.decode()}', verbose=1)
-                
-                elif dtype == 'INT':
-                    print(f'at {topic}, received int: {struct.unpack('!i', data)[0]}', verbose=1)
-                
-                elif dtype == 'FLOAT':
-                    print(f'at {topic}, received float: {struct.unpack('!d', data)[0]}', verbose=1)
-                
-                elif dtype == 'IMG':
-                    print(f'at {topic}, received image', verbose=1)
+    def call(self, name, request, timeout=None):
+        # returns a future of the response of a service provided by the manager at the other side
 
-                    # TODO
-                    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if self.conn is None:
+            raise ConnectionError('no connection established')
 
-                else:
-                    print(f'message dtype not implemented: {dtype}')
+        future = futures.Future()
+        call_id = next(self._call_ids)
+        payload = encode_call(call_id, name, request)
 
-    def get_topics(self):
-        # TODO
-        pass
+        self.pending_calls[call_id] = future
+        future.add_done_callback(lambda future: self.pending_calls.pop(call_id, None))
+
+        with self.send_lock:
+            send_frame(self.conn, MSG_CALL, payload=payload)
+
+        if timeout is not None:
+            self.timer.add(_Call_Timeout(future, name, timeout))
+        return future
 
-    def subscribe(self, topic='ping'):
+    def get_topics(self, timeout=1):
 
         if self.conn is None:
-            print('no connection established', verbose=1)
+            log('no connection established', verbose=1)
             return
+
+        self._topics_event.clear()
+        send_frame(self.conn, MSG_TOPICS)
+
+        if not self._topics_event.wait(timeout):
+            log('no topic list received', verbose=1)
+            return
+
+        for topic in self.topics:
+            log(f'topic: {topic}')
+        return self.topics
+
+    def subscribe(self, topic='ping', encoding=RAW, quality=90, callback_function=None):
+
+        if self.conn is None:
+            log('no connection established', verbose=1)
+            return
+
+        assert encoding in ENCODINGS, f'unknown encoding {encoding}, choose from {ENCODINGS}'
+
+        if callback_function is not None:
+            if is_pattern(topic):
+                self.callback_trie.add(topic)
+            self.callbacks[topic] = self.callbacks.get(topic, ()) + (callback_function,)
         
-        self.conn.sendall(SUBSCRIPTION_MARKER + topic.encode() + END_MARKER)
+        payload = SUBSCRIPTION_FORMAT.pack(ENCODINGS.index(encoding), int(quality)) + topic.encode()
+        with self.send_lock:
+            send_frame(self.conn, MSG_SUBSCRIBE, payload=payload)
 
         # TODO confirmation?
 
@@ -329,26 +2592,26 @@ class Cli:
         self.stdscr.keypad(True)  # Enable special keys (e.g., arrows)
 
         self.line = 0
-        builtins.print = self.custom_print
+
+        # the cli takes the place of stdout while it runs, other consumers of the log keep theirs, its handler is called on the writer thread
+        self.handler = _Cli_Handler(self)
+        self.stdout_handlers = mgr.log_writer.replace_stdout(self.handler)
 
         self.input_thread = threading.Thread(target=self.get_user_input, daemon=True)
         self.input_thread.start()
 
         time.sleep(1)
     
-    def custom_print(self, *args, **kwargs):
+    def write_line(self, text):
 
         # TODO: print line longer than terminal width
         # TODO: scroll?
         # TODO resizing terminal while using
 
-        if 'verbose' in kwargs and self.verbose < kwargs['verbose']:
-            return
-
         with self.lock:
 
             y, x = self.stdscr.getyx()
-            self.stdscr.addstr(self.line, 0, " ".join(str(arg) for arg in args))
+            self.stdscr.addstr(self.line, 0, text)
             self.stdscr.move(y, x)
             self.stdscr.refresh()
 
@@ -463,12 +2726,12 @@ class Cli:
 
 
                 self.stdscr.addstr(self.term_h - 1, 0, f'executing {command}...')
-                print(f'executing {command}, with {", ".join([parameter + ' : ' + user_parameter for parameter, user_parameter in zip(parameters, user_parameters)])} ...', verbose=1)
+                log(f'executing {command}, with {", ".join([parameter + ' : ' + user_parameter for parameter, user_parameter in zip(parameters, user_parameters)])} ...', verbose=1)
 
                 try:
                     getattr(self.mgr, command)(*user_parameters)
                 except TypeError:
-                    print('only string parameters are supported at the moment')
+                    log('only string parameters are supported at the moment')
 
                 break
         else:
@@ -484,10 +2747,14 @@ class Cli:
 
         self._close_event.set()
 
-        print('press ENTER to exit cli...', verbose=0)
+        log('press ENTER to exit cli...', verbose=0)
 
         self.input_thread.join()
 
+        # the remaining records still go to the screen, later ones to stdout again
+        self.mgr.log_writer.flush()
+        self.mgr.log_writer.restore_stdout(self.handler, self.stdout_handlers)
+
         # Clean up curses
         curses.nocbreak()
         self.stdscr.keypad(False)
@@ -495,106 +2762,1087 @@ class Cli:
         curses.endwin()
 
 
+class _Cli_Handler(logging.Handler):
+
+    def __init__(self, cli):
+        super().__init__()
+        self.cli = cli
+        self.setFormatter(logging.Formatter('%(message)s'))
+
+    def emit(self, record):
+        self.cli.write_line(self.format(record))
+
+
+class Shared_Ring_Buffer:
+
+    # fixed-size slots of preallocated numpy arrays in shared memory, readers pin the slot they are reading
+
+    def __init__(self, shape, dtype='uint8', n_slots=4, name=None, condition=None):
+        assert n_slots >= 2, 'a ring buffer needs at least 2 slots'
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.n_slots = n_slots
+        self.condition = condition if condition is not None else _process_context().Condition()
+
+        self._owner = name is None
+        header_size = (2 + 2 * n_slots) * 8
+        slot_size = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        if self._owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_size + n_slots * slot_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+        # header: latest sequence number, closed flag, sequence number per slot, readers per slot
+        self.header = np.ndarray((2 + 2 * n_slots,), dtype=np.int64, buffer=self.shm.buf)
+        self.slot_seq = self.header[2:2 + n_slots]
+        self.pins = self.header[2 + n_slots:]
+        self.slots = np.ndarray((n_slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=header_size)
+
+        self._next_slot = 0
+        self.last_read = 0
+        self.dropped = 0
+
+    def attach_args(self):
+        # (shape, dtype, n_slots, name) to reopen this buffer in another process, share the condition at process start
+        return (self.shape, self.dtype.str, self.n_slots, self.name)
+
+    @property
+    def closed(self):
+        return self.header[1] != 0
+
+    def write(self, array):
+        assert array.shape == self.shape, f'array of shape {array.shape} does not fit slots of shape {self.shape}'
+
+        with self.condition:
+            while True:
+                for i in range(self.n_slots):
+                    slot = (self._next_slot + i) % self.n_slots
+                    if self.pins[slot] == 0:
+                        break
+                else:
+                    self.condition.wait()
+                    continue
+                break
+
+            self.slot_seq[slot] = 0
+
+        self.slots[slot][...] = array
+
+        with self.condition:
+            seq = int(self.header[0]) + 1
+            self.slot_seq[slot] = seq
+            self.header[0] = seq
+            self.condition.notify_all()
+
+        self._next_slot = (slot + 1) % self.n_slots
+        return seq
+
+    @contextlib.contextmanager
+    def view(self, timeout=None, latest=True):
+        # yields a read-only view of the newest (or next unread) slot, None on timeout or when closed
+        with self.condition:
+            self.condition.wait_for(lambda: self.header[0] > self.last_read or self.closed, timeout)
+
+            available = self.slot_seq[self.slot_seq > self.last_read]
+            if len(available) == 0 or self.closed:
+                slot = None
+            else:
+                seq = int(available.max() if latest else available.min())
+                slot = int(np.argmax(self.slot_seq == seq))
+                self.pins[slot] += 1
+
+        if slot is None:
+            yield None
+            return
+
+        self.dropped += seq - self.last_read - 1
+        self.last_read = seq
+
+        try:
+            frame = self.slots[slot].view()
+            frame.flags.writeable = False
+            yield frame
+        finally:
+            with self.condition:
+                self.pins[slot] -= 1
+                self.condition.notify_all()
+
+    def read(self, timeout=None, latest=True):
+        with self.view(timeout, latest) as frame:
+            return None if frame is None else frame.copy()
+
+    def close(self):
+        if self._owner:
+            with self.condition:
+                self.header[1] = 1
+                self.condition.notify_all()
+
+        del self.header, self.slot_seq, self.pins, self.slots
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+# bag files: magic, then records of (timestamp, message type, topic id, payload length) + payload,
+# then an index of (timestamp, record offset) per message and a footer pointing at the index
+BAG_MAGIC = b'YAMALBAG\x01'
+BAG_RECORD = struct.Struct('!dBHI')
+BAG_INDEX_ENTRY = struct.Struct('!dQ')
+BAG_FOOTER = struct.Struct('!Q8s')
+BAG_FOOTER_MAGIC = b'YAMALIDX'
+
+
+class Bag_Writer:
+
+    # append-only log of published messages, arrays are stored as raw buffers
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(BAG_MAGIC)
+        self.offset = len(BAG_MAGIC)
+
+        self.lock = threading.Lock()
+        self.topic_ids = {}
+        self.index = []
+
+    def write(self, topic, message, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        try:
+            msg_type, payload = encode_message(message)
+        except TypeError:
+            msg_type, payload = MSG_PICKLE, pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+
+        buffers = payload if isinstance(payload, (list, tuple)) else (payload,)
+        buffers = [memoryview(buffer).cast('B') for buffer in buffers]
+
+        with self.lock:
+            if topic not in self.topic_ids:
+                self.topic_ids[topic] = len(self.topic_ids) + 1
+                self._write_record(timestamp, MSG_TOPIC, self.topic_ids[topic], (topic.encode(),))
+
+            self.index.append((timestamp, self.offset))
+            self._write_record(timestamp, msg_type, self.topic_ids[topic], buffers)
+
+    def _write_record(self, timestamp, msg_type, topic_id, buffers):
+        length = sum(len(buffer) for buffer in buffers)
+        self.file.write(BAG_RECORD.pack(timestamp, msg_type, topic_id, length))
+        for buffer in buffers:
+            self.file.write(buffer)
+        self.offset += BAG_RECORD.size + length
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            index_offset = self.offset
+            self.file.write(b''.join(BAG_INDEX_ENTRY.pack(*entry) for entry in self.index))
+            self.file.write(BAG_FOOTER.pack(index_offset, BAG_FOOTER_MAGIC))
+            self.file.close()
+
+
+def _decode_bag_message(msg_type, payload):
+    # messages encode_message cannot handle are pickled by Bag_Writer, only open bags you trust
+    if msg_type == MSG_PICKLE:
+        return pickle.loads(payload)
+    return decode_message(msg_type, payload)
+
+
+class Bag_Reader:
+
+    # memory-maps a bag file, messages are decoded without copying, arrays are read-only views on the file
+
+    INDEX_DTYPE = [('timestamp', '>f8'), ('offset', '>u8')]
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.map)
+
+        assert self.buffer[:len(BAG_MAGIC)] == BAG_MAGIC, f'{path} is not a bag file'
+
+        self.topics = {}
+        end = len(self.buffer)
+
+        index_offset, magic = BAG_FOOTER.unpack_from(self.buffer, end - BAG_FOOTER.size) if end >= len(BAG_MAGIC) + BAG_FOOTER.size else (0, b'')
+        if magic == BAG_FOOTER_MAGIC:
+            n_entries = (end - BAG_FOOTER.size - index_offset) // BAG_INDEX_ENTRY.size
+            self.index = np.frombuffer(self.buffer, self.INDEX_DTYPE, count=n_entries, offset=index_offset)
+            self._scan_topics(index_offset)
+        else:
+            # the recording was not closed, rebuild the index from the records
+            log(f'{path} has no index, scanning records', verbose=2)
+            self.index = np.array(self._scan_topics(end), dtype=self.INDEX_DTYPE)
+
+    def _scan_topics(self, end):
+        # walks the record headers, reads topic records and returns the (timestamp, offset) of every message
+        index = []
+        offset = len(BAG_MAGIC)
+        while offset + BAG_RECORD.size <= end:
+            timestamp, msg_type, topic_id, length = BAG_RECORD.unpack_from(self.buffer, offset)
+            if offset + BAG_RECORD.size + length > end:
+                break
+            if msg_type == MSG_TOPIC:
+                start = offset + BAG_RECORD.size
+                self.topics[topic_id] = bytes(self.buffer[start:start + length]).decode()
+            else:
+                index.append((timestamp, offset))
+            offset += BAG_RECORD.size + length
+        return index
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, i):
+        # (timestamp, topic, message) of the i-th message
+        offset = int(self.index[i]['offset'])
+        timestamp, msg_type, topic_id, length = BAG_RECORD.unpack_from(self.buffer, offset)
+        start = offset + BAG_RECORD.size
+        return timestamp, self.topics[topic_id], _decode_bag_message(msg_type, self.buffer[start:start + length])
+
+    def seek(self, timestamp):
+        # index of the first message recorded at or after timestamp
+        return int(np.searchsorted(self.index['timestamp'], timestamp))
+
+    def messages(self, start=0, topics=None):
+        for i in range(start, len(self)):
+            timestamp, topic, message = self.read(i)
+            if topics is None or topic in topics:
+                yield timestamp, topic, message
+
+    def close(self):
+        self.index = None
+        try:
+            self.buffer.release()
+            self.map.close()
+        except BufferError:
+            # subscribers still hold views on the file, the map is closed once they let go
+            pass
+        self.file.close()
+
+
+_display_server = None
+_display_lock = threading.Lock()
+
+DISPLAY_STATS_QUEUE_SIZE = 64
+
+
+class _Display_Server:
+
+    # a single display process renders the windows of every Image_Display of this process, target runs in it and has
+    # to be a module level function, the process is started by a server process and does not inherit this one
+
+    def __init__(self, target=None):
+        self.n_windows = 0
+        self.window_stats = {}
+
+        # every ring shares this condition, so the display process sleeps until any window has a new frame
+        context = _process_context()
+        self.condition = context.Condition()
+        self.control_queue = context.Queue()
+        # stats are totals, when nobody reads them the display process drops the oldest rather than piling them up
+        self.stats_queue = context.Queue(DISPLAY_STATS_QUEUE_SIZE)
+
+        # the display process has to share our resource tracker, otherwise it unlinks the rings when it exits
+        resource_tracker.ensure_running()
+
+        self.process = context.Process(target=target or _run_display_process, args=(self.condition, self.control_queue, self.stats_queue), daemon=True)
+        self.process.start()
+
+    def send(self, request):
+        self.control_queue.put(request)
+        with self.condition:
+            self.condition.notify_all()
+
+    def stats(self):
+        while True:
+            try:
+                name, stats = self.stats_queue.get_nowait()
+            except (queue.Empty, OSError, ValueError):
+                break
+            self.window_stats[name] = stats
+        return dict(self.window_stats)
+
+    def close(self):
+        self.send(None)
+        # keep draining the stats, the display process cannot exit while its queue is not flushed
+        while self.process.is_alive():
+            self.process.join(timeout=0.1)
+            self.stats()
+        self.stats()
+
+
 class Image_Display:
 
-    def __init__(self, name):
+    def __init__(self, name, n_slots=3):
+        global _display_server
+
         self.name = name
+        self.n_slots = n_slots
+        self.ring = None
 
-        self.image_queue = multiprocessing.Queue()
-        self.queue_size = multiprocessing.Value('i', 0)
+        with _display_lock:
+            if _display_server is None:
+                _display_server = _Display_Server()
+            _display_server.n_windows += 1
+            self.server = _display_server
 
-        self.process = multiprocessing.Process(target=self._display_process)
-        self.process.start()
+        self.condition = self.server.condition
         
     def display(self, image):
 
-        if self.queue_size.value > 3:
-            # Clear queue if it gets too large
-            print(f'clearing image queue, queue size of {self.queue_size.value} is too large', verbose=2)
-            while not self.image_queue.empty():
-                self.image_queue.get()
-            self.queue_size.value = 0
+        # frames go through a shared memory ring, the control queue only announces new rings
+        if self.ring is None or self.ring.shape != image.shape or self.ring.dtype != image.dtype:
+            if self.ring is not None:
+                log(f'frame format of {self.name} changed to {image.shape} {image.dtype}', verbose=2)
+                self.ring.close()
+
+            self.ring = Shared_Ring_Buffer(image.shape, image.dtype, self.n_slots, condition=self.condition)
+            self.server.send(('attach', self.name, self.ring.attach_args()))
 
+        self.ring.write(image)
 
-        self.image_queue.put(image)
-        self.queue_size.value += 1
+    def stats(self):
+        # rendered frames, render fps and frames that were overwritten before they could be shown
+        return self.server.stats().get(self.name)
     
     def close(self):
-        self.queue_size.value = -1
-        self.process.join()
+        global _display_server
 
-    def _display_process(self):
+        self.server.send(('detach', self.name))
 
-        t = time.time()
+        with _display_lock:
+            self.server.n_windows -= 1
+            last_window = self.server.n_windows == 0
+            if last_window and _display_server is self.server:
+                _display_server = None
 
-        while self.queue_size.value != -1:
+        if last_window:
+            self.server.close()
 
-            while self.queue_size.value == 0:
-                cv2.waitKey(1)
-            
-            if self.queue_size.value > 0:
-                image = self.image_queue.get()
-                self.queue_size.value -= 1
-                cv2.imshow(self.name, image)
-                cv2.setWindowTitle(self.name, f'{self.name} - display fps: {1/(time.time() - t):.2f}')
+        if self.ring is not None:
+            self.ring.close()
 
-                t = time.time()
-        
-        cv2.destroyAllWindows()
+
+def _run_display_process(condition, control_queue, stats_queue):
+
+    windows = {}
+    report_time = time.monotonic()
+
+    def report(name, window, elapsed):
+        window['fps'] = (window['rendered'] - window['reported']) / elapsed if elapsed > 0 else 0.0
+        window['reported'] = window['rendered']
+        dropped = window['dropped'] + window['ring'].dropped
+        stats = (name, {'rendered': window['rendered'], 'fps': window['fps'], 'dropped': dropped})
+        while True:
+            try:
+                stats_queue.put_nowait(stats)
+                break
+            except queue.Full:
+                try:
+                    stats_queue.get_nowait()
+                except queue.Empty:
+                    pass
+        return dropped
+
+    def has_work():
+        if not control_queue.empty():
+            return True
+        return any(not w['ring'].closed and w['ring'].header[0] > w['ring'].last_read for w in windows.values())
+
+    while True:
+
+        try:
+            request = control_queue.get_nowait()
+        except queue.Empty:
+            request = ()
+
+        if request is None:
+            break
+
+        if request and request[0] == 'attach':
+            _, name, (shape, dtype, n_slots, ring_name) = request
+            window = windows.setdefault(name, {'ring': None, 'rendered': 0, 'reported': 0, 'dropped': 0, 'fps': 0.0})
+            if window['ring'] is not None:
+                window['dropped'] += window['ring'].dropped
+                window['ring'].close()
+            window['ring'] = Shared_Ring_Buffer(shape, dtype, n_slots, name=ring_name, condition=condition)
+            continue
+
+        if request and request[0] == 'detach':
+            window = windows.pop(request[1], None)
+            if window is not None:
+                report(request[1], window, time.monotonic() - report_time)
+                window['ring'].close()
+                cv2.destroyWindow(request[1])
+            continue
+
+        # blocks until a frame or a control request arrives, the timeout keeps the windows responsive
+        with condition:
+            condition.wait_for(has_work, timeout=0.05)
+
+        for name, window in windows.items():
+            with window['ring'].view(timeout=0) as image:
+                if image is not None:
+                    cv2.imshow(name, image)
+                    window['rendered'] += 1
+
+        cv2.waitKey(1)
+
+        elapsed = time.monotonic() - report_time
+        if elapsed >= 1:
+            for name, window in windows.items():
+                dropped = report(name, window, elapsed)
+                cv2.setWindowTitle(name, f'{name} - display fps: {window["fps"]:.2f}, dropped: {dropped}')
+            report_time = time.monotonic()
+
+    for name, window in windows.items():
+        report(name, window, time.monotonic() - report_time)
+        window['ring'].close()
+    cv2.destroyAllWindows()
+
+
+_federation = threading.local()
+
+
+class Socket_Server:
+
+    # one selector thread serves every connection, publishers only queue frames on the connections
+
+    def __init__(self, mgr, ip, port, max_buffered=16 << 20, overflow_policy=DROP_OLDEST):
+        self._close_event = threading.Event()
+        self.mgr = mgr
+        self.max_buffered = max_buffered
+        self.overflow_policy = overflow_policy
+        self.connections = []
+        self.n_connections = 0
+
+        # a single subscription per topic, its messages are encoded once per encoding and shared by all connections
+        self.relays = {}
+        self.relay_node = Node('socket server', mgr)
+
+        # latency until a frame is completely written to its connection, per priority lane
+        self.lanes = {priority: Lane_Stats(priority) for priority in PRIORITIES}
+
+        # messages from federated managers are published on their own thread, so subscribers can neither stall nor
+        # kill the selector, when they fall behind the oldest forwarded messages are dropped
+        self.forwarded = collections.deque()
+        self.max_forwarded = get_arg(mgr.args, 'forward queue size', 1000)
+        self.forward_dropped = 0
+        self.forward_ready = threading.Condition()
+        self.forward_thread = threading.Thread(target=self._publish_forwarded, daemon=True)
+        self.forward_thread.start()
+
+        self.listener = None
+        self.address = None
+        if ip is not None:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind((ip, port))
+            self.listener.listen()
+            self.listener.setblocking(False)
+            self.address = self.listener.getsockname()
+
+        self.lock = threading.Lock()
+        self._wants_write = set()
+        self._wakeup_receiver, self._wakeup_sender = socket.socketpair()
+        self._wakeup_receiver.setblocking(False)
+        self._wakeup_sender.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        if self.listener is not None:
+            self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self._wakeup_receiver, selectors.EVENT_READ)
+
+    def wakeup(self, node=None):
+        if node is not None:
+            with self.lock:
+                self._wants_write.add(node)
+        try:
+            self._wakeup_sender.send(b'\0')
+        except OSError:
+            # the wakeup pipe is full, or the server already stopped and closed it
+            pass
+
+    def run(self):
+        if self.listener is not None:
+            log('server is listening for connections...', verbose=1)
+
+        while not self._close_event.is_set():
+            for key, events in self.selector.select():
+
+                if key.fileobj is self.listener:
+                    self._accept()
+
+                elif key.fileobj is self._wakeup_receiver:
+                    try:
+                        while self._wakeup_receiver.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+
+                else:
+                    node = key.data
+                    try:
+                        if events & selectors.EVENT_READ:
+                            node._on_readable()
+                        if events & selectors.EVENT_WRITE:
+                            node._on_writable()
+                    except (ConnectionError, OSError) as e:
+                        log(f'{node.name} disconnected: {e}', verbose=2)
+                        self._disconnect(node)
+                    except Exception as e:
+                        # a malformed frame only costs the connection it came in on
+                        log(f'{node.name} disconnected after an invalid frame: {e!r}', verbose=1)
+                        self._disconnect(node)
+
+            with self.lock:
+                wants_write, self._wants_write = self._wants_write, set()
+
+            for node in wants_write:
+                if node in self.connections:
+                    self.selector.modify(node.conn, selectors.EVENT_READ | selectors.EVENT_WRITE, node)
+
+        for node in list(self.connections):
+            node.close()
+            self._disconnect(node)
+            log(f'{node.name} closed', verbose=2)
+
+        self.selector.close()
+        if self.listener is not None:
+            self.listener.close()
+        self._wakeup_receiver.close()
+        self._wakeup_sender.close()
+
+    def _accept(self):
+        try:
+            conn, addr = self.listener.accept()
+        except BlockingIOError:
+            return
+
+        # frames are written whole, waiting for more data to fill a segment only adds latency
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.setblocking(False)
+        node = Socket_Node(f'socket node {self.n_connections}', self.mgr, conn, self)
+        self.n_connections += 1
+        self.connections.append(node)
+        self.selector.register(conn, selectors.EVENT_READ, node)
+        log(f'{node.name} connected from {addr[0]} : {addr[1]}', verbose=3)
+
+    def connect(self, ip, port):
+        conn = socket.create_connection((ip, port))
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.setblocking(False)
+
+        node = Socket_Node(f'bridge {self.n_connections}', self.mgr, conn, self)
+        self.n_connections += 1
+        self.connections.append(node)
+        self.selector.register(conn, selectors.EVENT_READ, node)
+        log(f'{node.name} connected to {ip} : {port}', verbose=2)
+
+        node.send_hello()
+        return node
+
+    def _disconnect(self, node):
+        if node not in self.connections:
+            return
+
+        self.connections.remove(node)
+        try:
+            self.selector.unregister(node.conn)
+        except (KeyError, ValueError):
+            pass
+
+        for topic in list(node.encodings):
+            self._remove_subscriber(node, topic)
+        node._close_event.set()
+        node.conn.close()
+        node.fail_calls(ConnectionError(f'{node.name} disconnected'))
+
+    def _add_subscriber(self, node, topic, encoding, quality):
+        key = (encoding, quality) if encoding != RAW else RAW
+
+        with self.lock:
+            groups = {k: v for k, v in self.relays.get(topic, {}).items()}
+            groups[key] = groups.get(key, ()) + (node,)
+            first = topic not in self.relays
+            self.relays[topic] = groups
+
+            if first:
+                self.mgr._add_subscription(_Relay_Subscription(topic, self))
+
+        self.interest_changed(topic)
+
+    def _remove_subscriber(self, node, topic):
+        with self.lock:
+            groups = {k: tuple(n for n in v if n is not node) for k, v in self.relays.get(topic, {}).items()}
+            groups = {k: v for k, v in groups.items() if len(v) > 0}
+
+            if len(groups) > 0:
+                self.relays[topic] = groups
+            elif topic in self.relays:
+                del self.relays[topic]
+                self.mgr.unsubscribe(topic, self.relay_node)
+
+        self.interest_changed(topic)
+
+    def _wants(self, topic, peer):
+        # a peer is told about a topic when someone besides the peer itself subscribed to it here
+        if any(s.subscriber is not self.relay_node for s in self.mgr.subscriptions.get(topic, ())):
+            return True
+        return any(node is not peer for nodes in self.relays.get(topic, {}).values() for node in nodes)
+
+    def advertise(self, peer, topics=None):
+        # (un)subscribes at the peer for every topic that changed, never called with the server lock held
+        if topics is None:
+            topics = list(self.mgr.subscriptions) + list(peer.advertised)
+
+        changed = False
+        with peer.send_lock:
+            for topic in topics:
+                wanted = self._wants(topic, peer)
+                if wanted and topic not in peer.advertised:
+                    peer.advertised.add(topic)
+                    peer._queue_frame(MSG_SUBSCRIBE, 0, SUBSCRIPTION_FORMAT.pack(ENCODINGS.index(RAW), 0) + topic.encode(), droppable=False)
+                    changed = True
+                elif not wanted and topic in peer.advertised:
+                    peer.advertised.discard(topic)
+                    peer._queue_frame(MSG_UNSUBSCRIBE, 0, topic.encode(), droppable=False)
+                    changed = True
+
+        if changed:
+            self.wakeup(peer)
+
+    def services_changed(self):
+        for node in list(self.connections):
+            if node.peer_id is not None:
+                node.send_services()
+
+    def service_provider(self, name):
+        # the first federated manager that said it provides the service
+        for node in list(self.connections):
+            if name in node.remote_services:
+                return node
+        return None
+
+    def interest_changed(self, topic):
+        for node in list(self.connections):
+            if node.peer_id is not None:
+                self.advertise(node, (topic,))
+
+    def _relay(self, topic, message, stamp=None, subscription=None):
+        # subscription is the subscribed topic or pattern, topic the concrete one the message was published on
+        groups = self.relays.get(topic if subscription is None else subscription, _EMPTY_MAPPING)
+        schema = self.mgr.schemas.get(topic)
+        encoded = None
+
+        # managers this message already passed through, it is never forwarded back to them
+        route = getattr(_federation, 'route', ())
+
+        for key, nodes in groups.items():
+            try:
+                if key == RAW or not _is_ndarray(message):
+                    # everything but encoded images looks the same for every connection
+                    if encoded is None:
+                        encoded = (MSG_TYPED, schema.encode(message)) if schema is not None else encode_message(message)
+                    msg_type, payload = encoded
+                else:
+                    msg_type, payload = encode_message(message, *key)
+            except (TypeError, ValueError, struct.error, OverflowError) as e:
+                # only this encoding failed, connections of the other groups still get the message
+                log(f'cannot send message over socket: {e}', verbose=1)
+                continue
+
+            for node in nodes:
+                if node.peer_id is None:
+                    node.send_encoded(topic, msg_type, payload, stamp)
+                elif node.peer_id not in route:
+                    node.send_forwarded(topic, msg_type, payload, route + (self.mgr.id,), stamp)
+
+    def forward(self, topic, message, route):
+        with self.forward_ready:
+            if len(self.forwarded) >= self.max_forwarded:
+                self.forwarded.popleft()
+                self.forward_dropped += 1
+            self.forwarded.append((topic, message, route))
+            self.forward_ready.notify()
+
+    def _publish_forwarded(self):
+        while True:
+            with self.forward_ready:
+                while len(self.forwarded) == 0 and not self._close_event.is_set():
+                    self.forward_ready.wait()
+                if self._close_event.is_set():
+                    return
+                topic, message, route = self.forwarded.popleft()
+
+            # managers the message passed through, _relay never sends it back to them
+            _federation.route = route
+            try:
+                self.mgr.publish(topic, message)
+            except Exception as e:
+                log(f'cannot publish forwarded message on {topic}: {e!r}', verbose=1)
+            finally:
+                _federation.route = ()
+
+    def close(self):
+        self._close_event.set()
+        with self.forward_ready:
+            self.forward_ready.notify_all()
+        self.wakeup()
 
 
 class Socket_Node(Node):
-    def __init__(self, name, mgr, conn, args=None):
+    def __init__(self, name, mgr, conn, server, args=None):
         super().__init__(name, mgr, args)
         self.conn = conn
+        self.server = server
+        self.receiver = Frame_Receiver(conn)
+        self.topic_ids = {}
+        self.encodings = {}
+
+        # set once a federated manager said hello, plain clients stay None
+        self.peer_id = None
+        self.hello_sent = False
+        self.remote_topics = {}
+        self.remote_schemas = {}
+        self.advertised = set()
+
+        # calls sent to the other side waiting for their reply, and the services the other side provides
+        self.pending_calls = {}
+        self.remote_services = set()
+        self._call_ids = itertools.count(1)
+
+        # frames waiting to be written: [views, bytes left, droppable, lane rank, size, published, expires], ordered by
+        # lane, first in first out within one
+        self.outbound = collections.deque()
+        self.buffered = 0
+        self.dropped = 0
+        self.expired = 0
+        self.send_lock = threading.Lock()
+        self.not_full = threading.Condition(self.send_lock)
+
+    def _on_readable(self):
+        while True:
+            frame = self.receiver.receive_nowait()
+            if frame is None:
+                return
 
-    def run(self):
-        self.loop(while_loop_condition=True)
-        
-    def loop_event(self, item):
+            msg_type, topic_id, payload = frame
+
+            if msg_type == MSG_TOPICS:
+                topics = sorted(set(self.mgr.topic_stats) | set(t for t in self.mgr.subscriptions if not is_pattern(t)))
+                with self.send_lock:
+                    self._queue_frame(MSG_TOPICS, 0, '\n'.join(topics).encode(), droppable=False)
+                self.server.wakeup(self)
+                continue
+
+            if msg_type == MSG_CLOSE:
+                raise ConnectionResetError('closed by peer')
+
+            if msg_type == MSG_HELLO:
+                self.peer_id = bytes(payload)
+                log(f'{self.name} federated with manager {self.peer_id.hex()}', verbose=2)
+                if not self.hello_sent:
+                    self.send_hello()
+                self.send_services()
+                self.server.advertise(self)
+                continue
+
+            if msg_type == MSG_CALL:
+                self._serve_call(payload)
+                continue
+
+            if msg_type == MSG_REPLY:
+                call_id, ok, value = decode_reply(payload)
+                future = self.pending_calls.pop(call_id, None)
+                if future is not None and ok:
+                    _settle(future, value)
+                elif future is not None:
+                    _settle(future, exception=RuntimeError(value))
+                continue
+
+            if msg_type == MSG_SERVICES:
+                self.remote_services = set(bytes(payload).decode().split('\n')) - {''}
+                continue
+
+            if msg_type == MSG_UNSUBSCRIBE:
+                topic = bytes(payload).decode()
+                self.encodings.pop(topic, None)
+                self.server._remove_subscriber(self, topic)
+                continue
+
+            if msg_type == MSG_TOPIC:
+                self.remote_topics[topic_id] = bytes(payload).decode()
+                continue
+
+            if msg_type == MSG_SCHEMA:
+                try:
+                    self.remote_schemas[topic_id] = compile_schema(json.loads(bytes(payload)))
+                except (ValueError, TypeError, KeyError, AttributeError) as e:
+                    raise ConnectionError(f'invalid schema for topic id {topic_id}: {e!r}')
+                continue
+
+            if msg_type == MSG_FORWARD:
+                self._receive_forwarded(topic_id, payload)
+                continue
+
+            if msg_type != MSG_SUBSCRIBE:
+                log(f'unrecognized message type for connection request: {msg_type}', verbose=1)
+                continue
+
+            encoding, quality = SUBSCRIPTION_FORMAT.unpack_from(payload)
+            subscription = bytes(payload[SUBSCRIPTION_FORMAT.size:]).decode()
+            log(f'received new connection request for {subscription}', verbose=1)
+
+            self.encodings[subscription] = (ENCODINGS[encoding], quality)
+            self.server._add_subscriber(self, subscription, ENCODINGS[encoding], quality)
+
+    def _receive_forwarded(self, topic_id, payload):
+        # only federated managers forward, and only on topics and with types they announced, anything else closes the connection
+        if self.peer_id is None:
+            raise ConnectionError('message forwarded before hello')
+
+        msg_type, n_hops = FORWARD_FORMAT.unpack_from(payload)
+        _check_wire_type(msg_type, WIRE_TYPES + (MSG_TYPED,))
 
+        topic = self.remote_topics.get(topic_id)
+        if topic is None:
+            raise ConnectionError(f'message forwarded on unknown topic id {topic_id}')
+        if msg_type == MSG_TYPED and topic_id not in self.remote_schemas:
+            raise ConnectionError(f'typed message forwarded on {topic} without a schema')
+
+        offset = FORWARD_FORMAT.size
+        route = tuple(bytes(payload[offset + i * MANAGER_ID_SIZE:offset + (i + 1) * MANAGER_ID_SIZE]) for i in range(n_hops))
+        offset += n_hops * MANAGER_ID_SIZE
+
+        # a message that does not decode is dropped, the connection stays up
         try:
-            self.conn.settimeout(10)
-            packet = self.conn.recv(4096)
-            if not packet or len(packet) == 0:
-                return
+            if msg_type == MSG_TYPED:
+                message = self.remote_schemas[topic_id].decode(payload[offset:])
+            else:
+                message = decode_message(msg_type, payload[offset:])
+        except (ValueError, TypeError, struct.error) as e:
+            log(f'cannot decode message forwarded on {topic}: {e!r}', verbose=1)
+            return
 
-            if packet[:len(SUBSCRIPTION_MARKER)] != SUBSCRIPTION_MARKER or packet[-len(END_MARKER):] != END_MARKER:
-                print(f'unrecognized format for connection request: {packet}', verbose=1)
-                return
+        # payload is reused for the next frame
+        if msg_type in (MSG_NDARRAY, MSG_TYPED) and _is_ndarray(message):
+            message = message.copy()
 
-            subscription = packet[len(SUBSCRIPTION_MARKER):-len(END_MARKER)].decode()
-            print(f'received new connection request for {subscription}', verbose=1)
+        self.server.forward(topic, message, route)
 
-            self.subscribe(subscription, self.send_message)
+    def _serve_call(self, payload):
+        # only services of this manager are served, calls are not passed on to further managers
+        call_id, name, request = decode_call(payload)
+        future = futures.Future()
+        future.add_done_callback(functools.partial(self._reply, call_id))
 
-        except socket.timeout:
-            pass
-        except socket.error as e:
-            if e.errno == 9:
-                pass
+        service = self.mgr.services.get(name)
+        if service is None:
+            _settle(future, exception=LookupError(f'no service called {name}'))
+        else:
+            service.call(request, future)
 
-    def send_message(self, topic, message):
+    def _reply(self, call_id, future):
+        with self.send_lock:
+            try:
+                self._queue_frame(MSG_REPLY, 0, encode_reply(call_id, future), droppable=False)
+            except OSError:
+                self.server.wakeup()
+
+    def call(self, name, request, future):
+        try:
+            payload = encode_call(next(self._call_ids), name, request)
+        except TypeError as e:
+            _settle(future, exception=e)
+            return
+
+        call_id = CALL_FORMAT.unpack_from(payload[0])[0]
+        self.pending_calls[call_id] = future
+        # a call that timed out or was cancelled does not wait for its reply anymore
+        future.add_done_callback(lambda future: self.pending_calls.pop(call_id, None))
+
+        with self.send_lock:
+            try:
+                self._queue_frame(MSG_CALL, 0, payload, droppable=False)
+            except OSError:
+                self.server.wakeup()
+
+        if self._close_event.is_set():
+            _settle(future, exception=ConnectionError(f'{self.name} is closed'))
+
+    def fail_calls(self, exception):
+        for future in list(self.pending_calls.values()):
+            _settle(future, exception=exception)
+
+    def send_services(self):
+        with self.send_lock:
+            self._queue_frame(MSG_SERVICES, 0, '\n'.join(sorted(self.mgr.services)).encode(), droppable=False)
+
+    def send_hello(self):
+        with self.send_lock:
+            self.hello_sent = True
+            self._queue_frame(MSG_HELLO, 0, self.mgr.id, droppable=False)
+
+    def send_forwarded(self, topic, msg_type, payload, route, stamp=None):
+        parts = list(payload) if isinstance(payload, (list, tuple)) else [payload]
+        self.send_encoded(topic, MSG_FORWARD, [FORWARD_FORMAT.pack(msg_type, len(route)) + b''.join(route)] + parts, stamp)
+
+    def _on_writable(self):
+        with self.send_lock:
+            self._flush()
+            if len(self.outbound) == 0:
+                self.server.selector.modify(self.conn, selectors.EVENT_READ, self)
+
+    def _flush(self):
+        # send as much as the socket takes without blocking, called with send_lock held
+        while len(self.outbound) > 0:
+            frame = self.outbound[0]
+
+            # a frame not started yet is dropped once past its deadline, a half sent one has to go out whole
+            if frame[6] is not None and frame[1] == frame[4] and time.monotonic() > frame[6]:
+                self.outbound.popleft()
+                self.buffered -= frame[1]
+                self.expired += 1
+                self.server.lanes[PRIORITIES[frame[3]]].expired += 1
+                continue
+
+            try:
+                sent = self.conn.sendmsg(frame[0]) if hasattr(self.conn, 'sendmsg') else self.conn.send(frame[0][0])
+            except BlockingIOError:
+                break
+
+            frame[1] -= sent
+            self.buffered -= sent
+
+            while sent > 0:
+                if sent >= len(frame[0][0]):
+                    sent -= len(frame[0][0])
+                    frame[0].pop(0)
+                else:
+                    frame[0][0] = frame[0][0][sent:]
+                    sent = 0
+
+            if frame[1] > 0:
+                break
+            self.outbound.popleft()
+            if frame[5] is not None:
+                self.server.lanes[PRIORITIES[frame[3]]].latency.record(time.monotonic() - frame[5])
+
+        self.not_full.notify_all()
 
-        # TODO image
+    def _queue_frame(self, msg_type, topic_id=0, payload=b'', droppable=True, rank=None, published=None, expires=None):
+        # control frames go in the high lane unless told otherwise, messages in the lane of their topic
+        if rank is None:
+            rank = PRIORITIES.index(HIGH if not droppable else NORMAL)
 
-        if isinstance(message, str):
-            data = START_MARKER + 'STR'.encode() + SPLIT_MARKER + topic.encode() + SPLIT_MARKER + message.encode() + END_MARKER
-        elif isinstance(message, int):
-            data = START_MARKER + 'INT'.encode() + SPLIT_MARKER + topic.encode() + SPLIT_MARKER + struct.pack('!i', message) + END_MARKER
-        elif isinstance(message, float):
-            data = START_MARKER + 'FLOAT'.encode() + SPLIT_MARKER + topic.encode() + SPLIT_MARKER + struct.pack('!d', message) + END_MARKER
+        parts = payload if isinstance(payload, (list, tuple)) else (payload,)
+        views = [memoryview(part).cast('B') for part in parts]
+        length = sum(len(view) for view in views)
+        header = FRAME_HEADER.pack(PROTOCOL_VERSION, msg_type, topic_id, length)
+        size = length + FRAME_HEADER.size
 
+        if length < 65536:
+            views = [memoryview(header + b''.join(views))]
         else:
-            print('cannot send message over socket, message type unsupported')
+            views = [memoryview(header)] + [view for view in views if len(view) > 0]
+
+        if droppable and self.buffered + size > self.server.max_buffered and len(self.outbound) > 0:
+
+            if self.server.overflow_policy == DROP_NEWEST:
+                self.dropped += 1
+                return
+
+            elif self.server.overflow_policy == DROP_OLDEST:
+                # the first frame may be half sent already, never drop that one, the oldest frames of the lowest lane go
+                # first and a frame never pushes out one of a higher lane, it is dropped itself when that would be needed
+                frames = list(self.outbound)
+                for i in sorted(range(1, len(frames)), key=lambda i: -frames[i][3]):
+                    if self.buffered + size <= self.server.max_buffered:
+                        break
+                    if frames[i][2] and frames[i][3] >= rank:
+                        self.buffered -= frames[i][1]
+                        self.dropped += 1
+                        frames[i] = None
+                self.outbound = collections.deque(frame for frame in frames if frame is not None)
+
+                if self.buffered + size > self.server.max_buffered and any(frame[2] for frame in frames[1:] if frame is not None):
+                    self.dropped += 1
+                    return
+
+            elif self.server.overflow_policy == BLOCK:
+                while self.buffered + size > self.server.max_buffered and len(self.outbound) > 0 and not self._close_event.is_set():
+                    self.not_full.wait()
+
+        if self._close_event.is_set():
             return
-        
-        self.conn.sendall(data)
+
+        # behind every frame of its own or a higher lane, but never in front of the first one, which may be half sent
+        i = len(self.outbound)
+        while i > 1 and self.outbound[i - 1][3] > rank:
+            i -= 1
+        self.outbound.insert(i, [views, size, droppable, rank, size, published, expires])
+        self.buffered += size
+
+        if len(self.outbound) == 1:
+            self._flush()
+        if len(self.outbound) > 0:
+            self.server.wakeup(self)
+
+    def send_message(self, topic, message):
+        encoding, quality = self.encodings.get(topic, (RAW, 90))
+        schema = self.mgr.schemas.get(topic)
+        try:
+            if schema is not None and (encoding == RAW or not _is_ndarray(message)):
+                msg_type, payload = MSG_TYPED, schema.encode(message)
+            else:
+                msg_type, payload = encode_message(message, encoding, quality)
+        except TypeError as e:
+            log(f'cannot send message over socket: {e}', verbose=1)
+            return
+
+        self.send_encoded(topic, msg_type, payload)
+
+    def send_encoded(self, topic, msg_type, payload, stamp=None):
+        # without a stamp, as for messages sent straight to this connection, the frame still goes in the lane of its topic
+        if stamp is not None:
+            lane, published, expires = stamp
+        else:
+            lane, published, expires = self.mgr.topic_lanes.get(topic, (self.mgr.lanes[NORMAL],))[0], None, None
+
+        with self.send_lock:
+            try:
+                if topic not in self.topic_ids:
+                    self.topic_ids[topic] = len(self.topic_ids) + 1
+                    self._queue_frame(MSG_TOPIC, self.topic_ids[topic], topic.encode(), droppable=False)
+
+                    schema = self.mgr.schemas.get(topic)
+                    if schema is not None:
+                        self._queue_frame(MSG_SCHEMA, self.topic_ids[topic], json.dumps(schema.spec).encode(), droppable=False)
+
+                self._queue_frame(msg_type, self.topic_ids[topic], payload, rank=lane.rank, published=published, expires=expires)
+            except OSError:
+                # the server notices the broken connection and cleans up
+                self.server.wakeup()
     
     def before_close(self):
-        self.conn.sendall(START_MARKER + CLOSE_MARKER + END_MARKER)
-        time.sleep(1)
-        self.conn.close()
+        # best effort, whatever does not fit in the socket buffer right now is lost
+        with self.send_lock:
+            self._close_event.set()
+            self.not_full.notify_all()
+            try:
+                self.outbound.append([[memoryview(pack_frame(MSG_CLOSE))], FRAME_HEADER.size, False, 0, FRAME_HEADER.size, None, None])
+                self._flush()
+            except OSError:
+                pass
+        self.fail_calls(ConnectionError(f'{self.name} closed'))
         return super().before_close()
 
 
@@ -609,6 +3857,8 @@ if __name__ == '__main__':
     parser.add_argument('--client', action='store_const', const=True, default=False, help='run as client')
     parser.add_argument('--ip', type=str, default='127.0.0.1', help='ip address for the server')
     parser.add_argument('--port', type=int, default=65432, help='port for the server')
+    parser.add_argument('--log-file', type=str, default=None, help='also write the log to this file')
+    parser.add_argument('--connect', type=str, action='append', default=None, help='ip:port of a manager to federate with, can be repeated')
 
     args = parser.parse_args()
 
@@ -622,7 +3872,7 @@ if __name__ == '__main__':
         if args.cli:
             cli = Cli(client, args.verbose)
 
-        print(f'starting client at {args.ip} : {args.port} with verbose level {args.verbose}, cli: {args.cli}', verbose=1)
+        log(f'starting client at {args.ip} : {args.port} with verbose level {args.verbose}, cli: {args.cli}', verbose=1)
 
         # TODO config file
         client._start()
@@ -639,9 +3889,9 @@ if __name__ == '__main__':
             cli = Cli(mgr, args.verbose)
 
         if args.server:
-            print(f'starting with verbose level {args.verbose}, cli: {args.cli}, server at {args.ip} : {args.port} and config file at {args.cfg}', verbose=1)
+            log(f'starting with verbose level {args.verbose}, cli: {args.cli}, server at {args.ip} : {args.port} and config file at {args.cfg}', verbose=1)
         else:
-            print(f'starting with verbose level {args.verbose}, cli: {args.cli} and config file at {args.cfg}', verbose=1)
+            log(f'starting with verbose level {args.verbose}, cli: {args.cli} and config file at {args.cfg}', verbose=1)
 
         with open(args.cfg, 'r') as f:
             config = yaml.full_load(f)